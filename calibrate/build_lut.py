@@ -0,0 +1,84 @@
+#!/usr/bin/env python2
+# Builds the color lookup table of cameravision.py from the captures of get_camera_pics.py.
+#
+# Each capture hsv_N.jpg can have a labeled mask hsv_N_mask.png of the same size, painted
+# green (0, 255, 0) on the puck, blue (255, 0, 0) on the goal and black on the background,
+# other colors are left out. Captures without a mask are labeled with the HSV ranges below,
+# as calibrate_test.py shows them.
+#
+#   ./build_lut.py                         all hsv_*.jpg, writes ../src/color_lut.npy
+#   ./build_lut.py -o arena.npy hsv_3.jpg hsv_4.jpg
+import os
+import sys
+import glob
+from optparse import OptionParser
+
+import cv2
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+import color_lut
+from color_lut import BACKGROUND, PUCK, GOAL
+
+blue_lower = np.array([67, 50, 50])
+blue_upper = np.array([200, 255, 255])
+
+green_lower = np.array([15, 165, 30])
+green_upper = np.array([55, 255, 155])
+
+
+def range_labels(hsv):
+    labels = np.empty(hsv.shape[:2], np.int8)
+    labels.fill(BACKGROUND)
+    labels[cv2.inRange(hsv, green_lower, green_upper) > 0] = PUCK
+    labels[cv2.inRange(hsv, blue_lower, blue_upper) > 0] = GOAL
+    return labels
+
+def load_sample(name, bgr=False):
+    image = cv2.imread(name)
+    if image is None:
+        raise IOError("Cannot read %s" % name)
+    mask_name = os.path.splitext(name)[0] + "_mask.png"
+    if os.path.exists(mask_name):
+        labels = color_lut.mask_labels(cv2.imread(mask_name))
+    elif bgr:
+        labels = range_labels(cv2.cvtColor(image, cv2.COLOR_BGR2HSV))
+    else:
+        labels = range_labels(image)
+    if not bgr:
+        image = cv2.cvtColor(image, cv2.COLOR_HSV2BGR)
+    return image, labels, mask_name if os.path.exists(mask_name) else "HSV ranges"
+
+
+if __name__ == '__main__':
+    parser = OptionParser(usage="usage: %prog [options] [capture ...]")
+    parser.add_option("-o", "--output", dest="output", default=os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                      '..', 'src', 'color_lut.npy'), help="table file to write [default: %default]")
+    parser.add_option("--bgr", action="store_true", dest="bgr", default=False,
+                      help="the captures are BGR instead of HSV")
+    parser.add_option("--min-count", type="int", dest="min_count", default=1,
+                      help="pixels a cell needs to get a class [default: %default]")
+    parser.add_option("--spread", type="int", dest="spread", default=1,
+                      help="steps the classes grow into unsampled colors [default: %default]")
+    (options, args) = parser.parse_args()
+
+    names = args or sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), "hsv_*.jpg")))
+    if not names:
+        parser.error("no captures given")
+
+    samples = []
+    for name in names:
+        image, labels, source = load_sample(name, options.bgr)
+        print "%s: %d puck, %d goal pixels (%s)" % (name, (labels == PUCK).sum(), (labels == GOAL).sum(), source)
+        samples.append((image, labels))
+
+    lut = color_lut.build_lut(samples, options.min_count, options.spread)
+    color_lut.save_lut(lut, options.output)
+
+    # how well the table reproduces the labels it was built from
+    for cls, name in ((BACKGROUND, "background"), (PUCK, "puck"), (GOAL, "goal")):
+        labeled = sum((labels == cls).sum() for image, labels in samples)
+        right = sum(((labels == cls) & (color_lut.classify(lut, image) == cls)).sum() for image, labels in samples)
+        print "%s: %d of %d cells, %.1f%% of its pixels" % (name, (lut == cls).sum(), lut.size,
+                                                          100.0 * right / max(labeled, 1))
+    print "Written to %s" % options.output
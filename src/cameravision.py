@@ -9,33 +9,134 @@ import pickle
 import time
 import cv2
 
-import picamera
-from picamera.array import PiRGBArray
-
-from parameters import MIN_FPS, MIN_GOAL_DIST
-
-# Recognize color using the camera
+from parameters import MIN_FPS, MIN_GOAL_DIST, COLOR_LUT_FILE
+import color_lut
+import dist_angle_matrices
+from frame_sources import PiCameraSource, FAST
+
+# Preallocated frame buffers, filled by one producer thread and read by one consumer thread.
+# The consumer always gets the newest frame, the frames it was too slow for are dropped, unless
+# the ring is lossless: then the producer waits until the consumer got the newest frame.
+class FrameRing(object):
+    def __init__(self, shape, size=3, lossless=False):
+        if size < 3:
+            raise ValueError("A frame ring needs a buffer to write, one to read and the newest frame")
+        self.frames = [np.empty(shape, np.uint8) for _ in range(size)]
+        self.times = [0.0] * size
+        self.lossless = lossless
+        self.sequence = 0
+        self.dropped = 0
+        self.__condition = threading.Condition()
+        self.__newest = None
+        self.__reading = None
+        self.__read_sequence = 0
+        self.__closed = False
+        self.__error = None
+
+    # index of a buffer to capture into, it is neither the newest frame nor being read
+    def acquire_write(self):
+        with self.__condition:
+            while self.lossless and self.sequence != self.__read_sequence and not self.__closed:
+                self.__condition.wait()
+            for index in range(len(self.frames)):
+                if index != self.__newest and index != self.__reading:
+                    return index
+
+    # makes the captured buffer the newest frame
+    def commit_write(self, index, timestamp):
+        with self.__condition:
+            self.times[index] = timestamp
+            self.__newest = index
+            self.sequence += 1
+            self.__condition.notify()
+
+    # waits for a frame newer than the last one read, and returns (frame, capture time),
+    # or None once the ring is closed, the frame stays valid until release_read
+    def acquire_read(self, timeout=None):
+        with self.__condition:
+            deadline = None if timeout is None else time.time() + timeout
+            while self.sequence == self.__read_sequence and not self.__closed:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    raise RuntimeError("No camera frame in %s seconds" % timeout)
+                self.__condition.wait(remaining)
+            # the last frame is still read after the producer closed the ring
+            if self.sequence == self.__read_sequence:
+                if self.__error is not None:
+                    raise self.__error
+                return None
+            self.dropped += self.sequence - self.__read_sequence - 1
+            self.__read_sequence = self.sequence
+            self.__reading = self.__newest
+            self.__condition.notify()
+            return self.frames[self.__reading], self.times[self.__reading]
+
+    def release_read(self):
+        with self.__condition:
+            self.__reading = None
+
+    # wakes up the consumer, with the error of the producer if it failed
+    def close(self, error=None):
+        with self.__condition:
+            self.__closed = True
+            self.__error = error
+            self.__condition.notify_all()
+
+
+# Latency of each stage of the frame processing in seconds: the last, mean and maximum
+class LatencyCounters(object):
+    def __init__(self, stages):
+        self.stages = stages
+        self.reset()
+
+    def reset(self):
+        self.count = dict.fromkeys(self.stages, 0)
+        self.total = dict.fromkeys(self.stages, 0.0)
+        self.max = dict.fromkeys(self.stages, 0.0)
+        self.last = dict.fromkeys(self.stages, 0.0)
+
+    def add(self, stage, seconds):
+        self.count[stage] += 1
+        self.total[stage] += seconds
+        self.last[stage] = seconds
+        self.max[stage] = max(self.max[stage], seconds)
+
+    def summary(self):
+        return dict((stage, {'last': self.last[stage], 'max': self.max[stage],
+                             'mean': self.total[stage] / self.count[stage] if self.count[stage] else 0.0})
+                    for stage in self.stages)
+
+
+# Recognize color using the camera, or the frames of another source of frame_sources.py
 class CameraVision(threading.Thread):
-    def __init__(self, camera, simulationLogger):
+    # exposure and white balance of the Pi camera are fixed once they settled
+    fix_exposure = True
+
+    def __init__(self, camera, simulationLogger, scale_down=1):
         super(CameraVision, self).__init__()
         self.CAMERA_WIDTH = 320
         self.CAMERA_HEIGHT = 240
-        self.scale_down = 1
-        self.camera = camera
+        self.scale_down = scale_down
+        self.camera = camera or PiCameraSource(self.CAMERA_WIDTH, self.CAMERA_HEIGHT, fix_exposure=self.fix_exposure)
         self.__isCameraAlive = threading.Condition()
         self.__isStopped = threading.Event()
         self.__simLogger = simulationLogger
         self.__imageAreaThreshold = 750
-        loaded_dist_angles = pickle.load(open("distances.p"))
-        self.distances = loaded_dist_angles['distances']
-        self.angles = loaded_dist_angles['angles']
-        self.MAX_DISTANCE = np.max(self.distances) + 1
+        # distance and angle of each pixel to the robot, and the pixels sorted by distance
+        self.distances, self.angles, self.distance_order = dist_angle_matrices.load(
+            self.CAMERA_HEIGHT, self.CAMERA_WIDTH, scale_down=self.scale_down)
+        self.MAX_DISTANCE = float(np.max(self.distances)) + 1
         self.presence = None
         self.presenceGoal = None
         self.callback = lambda values: values
         self.error_callback = lambda x: x
         self.hsv = False
         self.callback_lock = Lock()
+        # frames are captured into the ring on a thread of their own, see _startCapture
+        self.ring_size = 3
+        self.ring = None
+        # capture: age of a frame when its processing starts, the other stages: their duration
+        self.latency = LatencyCounters(('capture', 'segment', 'vector', 'callback'))
 
         #define color ranges
 
@@ -57,8 +158,34 @@ class CameraVision(threading.Thread):
         self.green_lower_superlight_bgr = np.array([0, 150, 0])
         self.green_upper_superlight_bgr = np.array([113, 255, 133])
 
+        # the presence of the puck and of the goal is averaged over their color ranges
+        self.puck_ranges = [(self.green_lower_bgr, self.green_upper_bgr),
+                            (self.green_lower_dark_bgr, self.green_upper_dark_bgr),
+                            (self.green_lower_light_bgr, self.green_upper_light_bgr),
+                            (self.green_lower_superlight_bgr, self.green_upper_superlight_bgr)]
+        self.goal_ranges = [(self.blue_lower_bgr, self.blue_upper_bgr),
+                            (self.blue_dark_lower_bgr, self.blue_dark_upper_bgr)]
+
+        # Fused segmentation, see labelImage and rangePresence. The puck and goal bits of the
+        # label image are those of the calibrated lookup table if there is one, otherwise those
+        # of the color ranges. The goal binary of CameraVisionVectors is the dark blue range alone.
+        self.color_lut = color_lut.load_lut(COLOR_LUT_FILE)
+        if self.color_lut is None:
+            self.__channel_luts = self.buildChannelLuts(self.puck_ranges + self.goal_ranges)
+            self.puck_bits = [1 << i for i in range(len(self.puck_ranges))]
+            self.goal_bits = [1 << (len(self.puck_ranges) + i) for i in range(len(self.goal_ranges))]
+            self.goal_binary_bits = self.goal_bits[1]
+        else:
+            self.puck_bits = [color_lut.PUCK]
+            self.goal_bits = [color_lut.GOAL]
+            self.goal_binary_bits = color_lut.GOAL
+        self.__canvas = None
+        self.__dilation = np.ones((19, 19), "uint8")
+
     def stop(self):
         self.__isStopped.set()
+        if self.ring is not None:
+            self.ring.close()
         with self.__isCameraAlive:
             self.__isCameraAlive.notify()
 
@@ -154,9 +281,99 @@ class CameraVision(threading.Thread):
 
         return presence
 
+    # lookup tables for cv2.LUT, one per channel: bit i of an entry is set when the value
+    # lies within color range i, so a pixel is in range i when bit i is set in all channels
+    def buildChannelLuts(self, color_ranges):
+        if len(color_ranges) > 8:
+            raise ValueError("At most 8 color ranges fit in a label image")
+        luts = np.zeros((1, 256, 3), np.uint8)
+        values = np.arange(256)
+        for i, (lower, upper) in enumerate(color_ranges):
+            for c in range(3):
+                luts[0, :, c] |= (((values >= lower[c]) & (values <= upper[c])) << i).astype(np.uint8)
+        return luts
+
+    # label image of the frame in one pass: the class of each pixel in the calibrated lookup table,
+    # or with bit i set for the pixels in color range i, the same pixels cv2.inRange selects
+    def labelImage(self, image):
+        if self.color_lut is not None:
+            return color_lut.classify(self.color_lut, image)
+        channels = cv2.split(cv2.LUT(image, self.__channel_luts))
+        return cv2.bitwise_and(cv2.bitwise_and(channels[0], channels[1]), channels[2])
+
+    # the (rows, columns) of the left, central, right and bottom sub-images, as in divideImage,
+    # with their (row, column) position in the grid they form
+    def regions(self, height, width):
+        valueDivision = (self.CAMERA_WIDTH / 3) / self.scale_down
+        valueDivisionVertical = (self.CAMERA_HEIGHT / 4) / self.scale_down
+        top = slice(0, valueDivisionVertical * 3)
+        return [((top, slice(0, valueDivision)), (0, 0)),
+                ((top, slice(valueDivision, valueDivision * 2)), (0, 1)),
+                ((top, slice(valueDivision * 2, self.CAMERA_WIDTH / self.scale_down)), (0, 2)),
+                ((slice(valueDivisionVertical * 3, height), slice(0, width)), (1, 0))]
+
+    # The sub-images of all color ranges are laid out on one canvas, apart from each other,
+    # so a single dilate and findContours covers them all. Each contour stays within
+    # its sub-image, and has the same shape as when its sub-image is processed alone.
+    def _layoutCanvas(self, shape, bits):
+        height, width = shape
+        count = len(bits)
+        # wider than the reach of the dilation
+        pad = 10
+        block_height = height + 2 * pad
+        canvas = np.zeros((block_height * count, width + 2 * pad), np.uint8)
+        tiles = np.empty(canvas.shape, np.int16)
+        tiles.fill(-1)
+        # OpenCV 2 findContours skips the 1-pixel border of the image it is given
+        ring = 1 if cv2.__version__.startswith('2.') else 0
+        keep = np.zeros(canvas.shape, np.uint8)
+        layout = []
+        for k in range(count):
+            for i, ((rows, cols), (grid_row, grid_col)) in enumerate(self.regions(height, width)):
+                top = rows.start + grid_row * pad + k * block_height
+                left = cols.start + grid_col * pad
+                tile = (slice(top, top + rows.stop - rows.start), slice(left, left + cols.stop - cols.start))
+                layout.append(((rows, cols), tile, bits[k]))
+                tiles[tile] = len(layout) - 1
+                keep[tile][ring:keep[tile].shape[0] - ring, ring:keep[tile].shape[1] - ring] = 255
+        self.__canvas = (shape, bits, canvas, tiles, keep, layout)
+
+    # presence of each of the bits of the label image, as retContours gives it for that color range
+    def rangePresence(self, labels, bits, selector):
+        if self.__canvas is None or self.__canvas[:2] != (labels.shape, bits):
+            self._layoutCanvas(labels.shape, bits)
+        shape, bits, canvas, tiles, keep, layout = self.__canvas
+
+        for region, tile, bit in layout:
+            np.bitwise_and(labels[region], bit, out=canvas[tile])
+        # The 15x15 dilation and 5x5 blur of retContours set the pixels within 9 pixels of the
+        # range, which is the 19x19 dilation, findContours only tells zero from non-zero.
+        # The dilation spreads into the gaps between the sub-images, these are cleared again.
+        binary = cv2.bitwise_and(cv2.dilate(canvas, self.__dilation), keep)
+        contours, hierarchy = cv2.findContours(binary, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
+
+        presence = np.zeros(len(layout))
+        largest = [(0, None)] * len(layout)
+        for contour in contours:
+            x, y = contour[0][0]
+            index = tiles[y, x]
+            if selector == 0:
+                area = cv2.contourArea(contour)
+                if area > largest[index][0]:
+                    largest[index] = (area, contour)
+            else:
+                moment = cv2.moments(contour)
+                # m00 is the area
+                if moment["m00"] > self.__imageAreaThreshold / self.scale_down:
+                    presence[index] += moment["m00"]
+        if selector == 0:
+            for index, (area, contour) in enumerate(largest):
+                presence[index] = self.retLargestContour(contour, None, None)
+        return presence.reshape(len(bits), 4)
+
     def divideImage(self, image):
-        valueDivision = math.floor((self.CAMERA_WIDTH / 3) / self.scale_down)
-        valueDivisionVertical = math.floor((self.CAMERA_HEIGHT / 4) / self.scale_down)
+        valueDivision = int(math.floor((self.CAMERA_WIDTH / 3) / self.scale_down))
+        valueDivisionVertical = int(math.floor((self.CAMERA_HEIGHT / 4) / self.scale_down))
 
         # Divide image in three pieces
         sub_image_left = image[0:valueDivisionVertical * 3, 0:0 + valueDivision]
@@ -171,26 +388,20 @@ class CameraVision(threading.Thread):
         return image_total
 
     def run_bgr(self, image, callback):
-        # Calculate value to divide the image into three/four different part
-        image_total = self.divideImage(image)
+        start_time = time.time()
+        # all color ranges are segmented at once, in the regions of divideImage
+        labels = self.labelImage(image)
+        presence = self.rangePresence(labels, tuple(self.puck_bits + self.goal_bits), 1)
+        segment_time = time.time()
+        self.latency.add('segment', segment_time - start_time)
+        puck, goal = presence[:len(self.puck_bits)], presence[len(self.puck_bits):]
 
         # combine the presence of lighter and darker color ranges for closer and more distant objects
-        self.presence = self.retContours(self.green_lower_bgr, self.green_upper_bgr, image_total, 1)
-        print "presence normal: ", self.presence
-        prescenceDark = self.retContours(self.green_lower_dark_bgr, self.green_upper_dark_bgr, image_total, 1)
-        print "presence dark: " , prescenceDark
-        presenceLight = self.retContours(self.green_lower_light_bgr, self.green_upper_light_bgr, image_total, 1)
-        # print "presence light ", presenceLight
-        presenceSuperlight = self.retContours(self.green_lower_superlight_bgr, self.green_upper_superlight_bgr, image_total, 1)
-        # print "presence super light: ", presenceSuperlight
-        self.presence = ((np.array(self.presence) + np.array(prescenceDark) + np.array(presenceLight) +
-                          np.array(presenceSuperlight)) / 4).tolist()
-
-        self.presenceGoal = self.retContours(self.blue_lower_bgr, self.blue_upper_bgr, image_total, 1)
-        presenceGoalDark = self.retContours(self.blue_dark_lower_bgr, self.blue_dark_upper_bgr, image_total, 1)
-        self.presenceGoal = ((np.array(self.presenceGoal) + np.array(presenceGoalDark)) / 2).tolist()
+        self.presence = (np.sum(puck, axis=0) / len(puck)).tolist()
+        self.presenceGoal = (np.sum(goal, axis=0) / len(goal)).tolist()
 
         callback({'puck': self.presence, 'target': self.presenceGoal})
+        self.latency.add('callback', time.time() - segment_time)
 
         # print("presencePuck {}".format(self.presence))
         # print("presenceGoal {}".format(self.presenceGoal))
@@ -237,30 +448,61 @@ class CameraVision(threading.Thread):
         self.callback = callback
         self.callback_lock.release()
 
+    """
+        Start capturing frames from the camera into the ring, on a thread of its own. The sources
+        capture straight into the buffers of the ring.
+    """
+    def _startCapture(self, camera):
+        # every frame is processed when the frames come as fast as possible, to measure the frame rate
+        self.ring = FrameRing((self.CAMERA_HEIGHT, self.CAMERA_WIDTH, 3), self.ring_size,
+                              lossless=getattr(camera, 'mode', None) == FAST)
+        ring = self.ring
+
+        def outputs():
+            while not self._stopped():
+                index = ring.acquire_write()
+                yield ring.frames[index]
+                ring.commit_write(index, time.time())
+
+        def capture():
+            try:
+                camera.capture_sequence(outputs())
+                ring.close()
+            except Exception as e:
+                ring.close(e)
+
+        capture_thread = threading.Thread(target=capture, name="camera capture")
+        capture_thread.daemon = True
+        capture_thread.start()
+        return capture_thread
+
+    """
+        The newest frames of the ring with their capture time, until the camera is stopped. Each frame is
+        only valid until the next one is asked for.
+    """
+    def _newestFrames(self):
+        while not self._stopped():
+            # a frame should come at the frame rate, the capture has stalled otherwise
+            frame = self.ring.acquire_read(timeout=5)
+            if frame is None:
+                break
+            try:
+                self.latency.add('capture', time.time() - frame[1])
+                yield frame
+            finally:
+                self.ring.release_read()
+
     """
         Run the cameravision, presence results will be reported to the callback function as array consisting of presence
         values for the goal and for the puck
     """
     def run(self):
         try:
-            with picamera.PiCamera() as camera:
-                camera.resolution = (self.CAMERA_WIDTH, self.CAMERA_HEIGHT)
-                camera.framerate = 32
-                rawCapture = PiRGBArray(camera, size=(self.CAMERA_WIDTH, self.CAMERA_HEIGHT))
-
-                time.sleep(0.1)
-                # Now fix the values
-                camera.shutter_speed = camera.exposure_speed
-                camera.exposure_mode = 'off'
-                g = camera.awb_gains #TODO: make this fixed?
-                camera.awb_mode = 'off'
-                camera.awb_gains = g
-
-                for frame in camera.capture_continuous(rawCapture, format="bgr", use_video_port=True):
+            with self.camera as camera:
+                capture_thread = self._startCapture(camera)
+                for image, capture_time in self._newestFrames():
                     last_time = time.time()
 
-                    image = frame.array
-                    rawCapture.truncate(0)
                     if self.hsv:
                         hsvImage = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
                         hsvImage = cv2.resize(hsvImage, (len(image[0]) / self.scale_down, len(image) / self.scale_down))
@@ -286,6 +528,8 @@ class CameraVision(threading.Thread):
                     print "sleep time: ", sleep_time
                     if sleep_time > 0:
                         time.sleep(sleep_time)
+                self.stop()
+                capture_thread.join(1)
             cv2.destroyAllWindows()
         except Exception as e:
             self.error_callback()
@@ -297,45 +541,197 @@ class CameraVision(threading.Thread):
             raise
 
 
+# The region of the image an object was last seen in. While the object is tracked only this
+# region is segmented, a full frame search is done when it is lost and every refresh frames.
+class ObjectTracker(object):
+    def __init__(self, shape, margin=16, refresh=10, max_fraction=0.25):
+        self.shape = shape
+        # pixels the region reaches beyond the object, the object may move this far in a frame
+        self.margin = margin
+        self.refresh = refresh
+        # a larger region is not worth tracking
+        self.max_area = max_fraction * shape[0] * shape[1]
+        self.roi = None
+        self.since_search = 0
+        self.tracked = 0
+        self.hits = 0
+        self.searches = 0
+
+    # whether the object in the binary image of the region reaches an edge of the region inside
+    # the image, then it may go on outside of it, and a nearer pixel may be missed
+    def clipped(self, binary, region):
+        top, bottom, left, right = region
+        return bool((top > 0 and binary[0].any()) or (bottom < self.shape[0] and binary[-1].any()) or
+                    (left > 0 and binary[:, 0].any()) or (right < self.shape[1] and binary[:, -1].any()))
+
+    # the next frame is searched in full, as when the view changed at once
+    def reset(self):
+        self.roi = None
+
+    # the (top, bottom, left, right) to segment, None for a full frame search
+    def region(self):
+        if self.roi is None or self.since_search >= self.refresh:
+            return None
+        return self.roi
+
+    # updates the region from the binary image of the region it covers, with the (row, column)
+    # of the nearest pixel of the object in the full image, None when it was not found
+    def update(self, binary, region, nearest):
+        if region is None:
+            self.searches += 1
+            self.since_search = 0
+        else:
+            self.tracked += 1
+            self.hits += nearest is not None
+            self.since_search += 1
+        if nearest is None:
+            self.roi = None
+            return
+        top, bottom, left, right = region or (0, self.shape[0], 0, self.shape[1])
+        if region is None:
+            # after a full search only the part around the nearest pixel is the object, the
+            # region grows along with it in the next frames
+            reach = 3 * self.margin
+            top, left = max(nearest[0] - reach, 0), max(nearest[1] - reach, 0)
+            bottom, right = min(nearest[0] + reach + 1, self.shape[0]), min(nearest[1] + reach + 1, self.shape[1])
+            binary = binary[top:bottom, left:right]
+        rows = np.flatnonzero(binary.any(axis=1))
+        cols = np.flatnonzero(binary.any(axis=0))
+        roi = (int(max(top + rows[0] - self.margin, 0)), int(min(top + rows[-1] + 1 + self.margin, self.shape[0])),
+               int(max(left + cols[0] - self.margin, 0)), int(min(left + cols[-1] + 1 + self.margin, self.shape[1])))
+        self.roi = roi if (roi[1] - roi[0]) * (roi[3] - roi[2]) <= self.max_area else None
+
+    def state(self):
+        return {'state': 'searching' if self.region() is None else 'tracking', 'roi': self.roi,
+                'hit_rate': float(self.hits) / self.tracked if self.tracked else 0.0}
+
+
 class CameraVisionVectors(CameraVision):
-    def __init__(self, camera, logger):
-        CameraVision.__init__(self, camera, logger)
+    fix_exposure = False
+
+    def __init__(self, camera, logger, scale_down=1, tracking=False):
+        CameraVision.__init__(self, camera, logger, scale_down)
         self.blur = (19, 19)
         self.binary_channels = None
         self.image = []
+        self.labels = None
         self.img_ready = False
-
-    def find_shortest(self, binary, check_puck=False):
+        # find_shortest scans the binary image in distance_order, nearest to the robot first and
+        # equally near pixels in the order of argmin, in chunks that double in size.
+        bounds = [0]
+        while bounds[-1] < self.distance_order.size:
+            bounds.append(min(bounds[-1] * 2 + 1024, self.distance_order.size))
+        self.scan_chunks = [self.distance_order[start:end] for start, end in zip(bounds, bounds[1:])]
+        self.__scan_buffer = np.empty(max(len(chunk) for chunk in self.scan_chunks), np.uint8)
+        # With tracking, the puck and the goal are only searched for in the region of the image they
+        # were last seen in, see ObjectTracker. The callback also gets their tracking state.
+        self.tracking = tracking
+        self.trackers = {'puck': ObjectTracker(self.distances.shape), 'target': ObjectTracker(self.distances.shape)}
+
+    # the binary image covers the region (top, bottom, left, right) of the image, all of it by default,
+    # the pixels outside the region are not set
+    def find_shortest(self, binary, check_puck=False, region=None):
         # if object is not found
         if not binary.any():
             return -np.inf, 0
 
-        central_index = binary.shape[1] / 2
-        if check_puck and (np.all(binary[-1, (central_index - 1):(central_index + 1)]) or
-                np.all(binary[-1, (central_index/2 - 1):(central_index/2 + 1)]) or
-                np.all(binary[-1, (central_index + central_index/2 - 1):(central_index + central_index/2 + 1)])):
+        return self.vector(binary, self.nearest_index(binary, region), check_puck, region)
+
+    # the puck is held when the bottom row is set at its center or at its quarter points
+    def puck_held(self, binary, region=None):
+        height, width = self.distances.shape
+        top, bottom, left, right = region or (0, height, 0, width)
+        if bottom != height:
+            return False
+        central_index = width / 2
+        for column in (central_index, central_index / 2, central_index + central_index / 2):
+            if left <= column - 1 and column + 1 <= right and np.all(binary[-1, column - 1 - left:column + 1 - left]):
+                return True
+        return False
+
+    # flat index in the image of the set pixel nearest to the robot, None if there is none
+    def nearest_index(self, binary, region=None):
+        if region is not None:
+            # a small region is searched at once, row by row as argmin does
+            top, bottom, left, right = region
+            distances = np.where(binary, self.distances[top:bottom, left:right], np.inf)
+            index = distances.argmin()
+            if not np.isfinite(distances.flat[index]):
+                return None
+            row, col = divmod(index, right - left)
+            return (top + row) * self.distances.shape[1] + left + col
+
+        # the first set pixel in distance order is the nearest, most objects are found in the first chunks
+        flat_binary = binary.reshape(-1)
+        for chunk in self.scan_chunks:
+            found = np.take(flat_binary, chunk, out=self.__scan_buffer[:len(chunk)])
+            first = found.argmax()
+            if found[first]:
+                return chunk[first]
+        return None
+
+    def get_binary_img(self, check_puck=False, labels=None):
+        bits = sum(self.puck_bits) if check_puck else self.goal_binary_bits
+        return cv2.compare(cv2.bitwise_and(self.labels if labels is None else labels, bits), 0, cv2.CMP_GT)
+
+    # binary image and vector of the puck or the goal, in the region its tracker gives when tracking
+    def locate(self, name, check_puck=False):
+        if not self.tracking:
+            binary = self.get_binary_img(check_puck)
+            return binary, self.img_to_vector(binary, check_puck=check_puck)
+
+        tracker = self.trackers[name]
+        region = tracker.region()
+        if region is not None:
+            top, bottom, left, right = region
+            labels = self.labels[top:bottom, left:right] if self.labels is not None else \
+                self.labelImage(self.image[top:bottom, left:right])
+            binary = self.get_binary_img(check_puck, labels)
+            nearest = self.nearest_index(binary, region)
+            if nearest is not None and not tracker.clipped(binary, region):
+                tracker.update(binary, region, divmod(nearest, self.distances.shape[1]))
+                full_binary = np.zeros(self.distances.shape, np.uint8)
+                full_binary[top:bottom, left:right] = binary
+                return full_binary, self.vector(binary, nearest, check_puck, region)
+            # lost, or leaving the region: it is searched for in the full frame
+            tracker.update(binary, region, None)
+
+        if self.labels is None:
+            self.labels = self.labelImage(self.image)
+        binary = self.get_binary_img(check_puck)
+        nearest = self.nearest_index(binary)
+        tracker.update(binary, None, None if nearest is None else divmod(nearest, self.distances.shape[1]))
+        return binary, self.vector(binary, nearest, check_puck)
+
+    # the vector of find_shortest, from the nearest_index of the binary image
+    def vector(self, binary, nearest, check_puck=False, region=None):
+        if nearest is None:
+            return -np.inf, 0
+        if check_puck and self.puck_held(binary, region):
             return 0, 0
-
-        distances_copy = self.distances.copy()
-        distances_copy[binary == 0] = np.finfo(distances_copy.dtype).max
-
-        shortest_dist_index = np.argmin(distances_copy)
-        shortest_dist = self.distances.reshape(-1)[shortest_dist_index]
-        angle = self.angles.reshape(-1)[shortest_dist_index]
-
-        return shortest_dist, angle
-
-    def get_binary_img(self, check_puck=False):
-        if check_puck:
-            mask_dark = cv2.inRange(self.image, self.green_lower_dark_bgr, self.green_upper_dark_bgr)
-            mask = cv2.inRange(self.image, self.green_lower_bgr, self.green_upper_bgr)
-            mask_light = cv2.inRange(self.image, self.green_lower_light_bgr, self.green_upper_light_bgr)
-            mask_lighter = cv2.inRange(self.image, self.green_lower_superlight_bgr, self.green_upper_superlight_bgr)
-            return cv2.bitwise_or(cv2.bitwise_or(mask_dark, mask), cv2.bitwise_or(mask_light, mask_lighter))
-        else:
-            mask_dark = cv2.inRange(self.image, self.blue_dark_lower_bgr, self.blue_dark_upper_bgr)
-            mask = cv2.inRange(self.image, self.blue_dark_lower_bgr, self.blue_dark_upper_bgr)
-            return cv2.bitwise_or(mask, mask_dark)
+        return self.distances.flat[nearest], self.angles.flat[nearest]
+
+    # presence of the puck and the goal in a frame, as given to the callback
+    def process_frame(self, image):
+        start_time = time.time()
+        self.image = image
+        # the full frame is segmented when an object is not tracked, the labels are shared
+        self.labels = None
+        if not self.tracking or any(tracker.region() is None for tracker in self.trackers.values()):
+            self.labels = self.labelImage(self.image)
+        segment_time = time.time()
+        self.latency.add('segment', segment_time - start_time)
+
+        self.puck_binary, self.presence = self.locate('puck', check_puck=True)
+        self.goal_binary, self.presenceGoal = self.locate('target')
+
+        self.binary_channels = [self.goal_binary, self.puck_binary]
+        self.latency.add('vector', time.time() - segment_time)
+
+        values = {"puck": self.presence, "target": self.presenceGoal}
+        if self.tracking:
+            values["tracking"] = dict((name, tracker.state()) for name, tracker in self.trackers.items())
+        return values
 
     def img_to_vector(self, binary, check_puck=False):
 
@@ -349,41 +745,33 @@ class CameraVisionVectors(CameraVision):
 
     def run(self):
         try:
-            with picamera.PiCamera() as camera:
-                camera.resolution = (self.CAMERA_WIDTH, self.CAMERA_HEIGHT)
-                camera.framerate = 32
-                rawCapture = PiRGBArray(camera, size=(self.CAMERA_WIDTH, self.CAMERA_HEIGHT))
-
-                time.sleep(0.1)
-                for frame in camera.capture_continuous(rawCapture, format="bgr", use_video_port=True):
+            with self.camera as camera:
+                capture_thread = self._startCapture(camera)
+                for image, capture_time in self._newestFrames():
                     start_time = time.time()
-                    self.image = frame.array
-                    rawCapture.truncate(0)
-
-                    self.image = cv2.resize(self.image, (len(self.image[0]) / self.scale_down, len(self.image) /
-                                                         self.scale_down))
-
-                    self.puck_binary = self.get_binary_img(check_puck=True)
-                    self.presence = self.img_to_vector(self.puck_binary, check_puck=True)
-
-                    self.goal_binary = self.get_binary_img()
-                    self.presenceGoal = self.img_to_vector(self.goal_binary)
-
-                    self.binary_channels = [self.goal_binary, self.puck_binary]
-                    #work complete, check if wait is needed
-
-                    sleep_time = float(MIN_FPS - (time.time() - start_time))
-                    if sleep_time > 0:
-                        time.sleep(sleep_time)
+                    if self.scale_down != 1:
+                        image = cv2.resize(image, (len(image[0]) / self.scale_down, len(image) / self.scale_down))
+                    # the frame of the ring is only valid during this iteration
+                    values = self.process_frame(image)
+                    vector_time = time.time()
 
+                    # the controller gets the vectors at once, the wait comes after
                     self.callback_lock.acquire()
-                    self.callback({"puck": self.presence, "target": self.presenceGoal})
+                    self.callback(values)
                     self.callback_lock.release()
+                    self.latency.add('callback', time.time() - vector_time)
 
                     # stop thread
                     if self._stopped():
                         print("Stopping camera thread")
                         break
+
+                    #work complete, check if wait is needed
+                    sleep_time = float(MIN_FPS - (time.time() - start_time))
+                    if sleep_time > 0:
+                        time.sleep(sleep_time)
+                self.stop()
+                capture_thread.join(1)
             cv2.destroyAllWindows()
         except Exception as e:
             print("Camera exception: " + str(e) + str(
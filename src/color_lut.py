@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+# Classification of BGR pixels into background, puck and goal with a lookup table,
+# built by calibrate/build_lut.py from labeled camera captures.
+import os
+import numpy as np
+
+# Classes of the table, PUCK and GOAL are also their bits in the label images of cameravision.py
+BACKGROUND, PUCK, GOAL = 0, 1, 2
+CLASSES = (BACKGROUND, PUCK, GOAL)
+# Colors of the classes in the labeled masks, BGR, other colors are not labeled
+MASK_COLORS = {BACKGROUND: (0, 0, 0), PUCK: (0, 255, 0), GOAL: (255, 0, 0)}
+UNLABELED = -1
+
+# The table is indexed by the highest LUT_BITS bits of each channel
+LUT_BITS = 5
+LUT_SHIFT = 8 - LUT_BITS
+LUT_SIZE = 1 << LUT_BITS
+
+
+def classify(lut, image):
+    """ The class of each pixel of a BGR image. """
+    quantized = image >> LUT_SHIFT
+    return lut[quantized[..., 0], quantized[..., 1], quantized[..., 2]]
+
+def mask_labels(mask):
+    """ The class of each pixel of a labeled mask, UNLABELED where it has no class color. """
+    labels = np.empty(mask.shape[:2], np.int8)
+    labels.fill(UNLABELED)
+    for cls, color in MASK_COLORS.items():
+        labels[np.all(mask == color, axis=-1)] = cls
+    return labels
+
+def build_lut(samples, min_count=1, spread=1):
+    """ Builds the table from (BGR image, labels) pairs, where labels holds the class
+        of each pixel or UNLABELED. Each cell gets the class most of its pixels have,
+        cells with fewer than min_count pixels are background. Then cells without
+        any pixels take the puck or goal class of a neighbouring cell, spread times,
+        so colors between the sampled ones are classified too.
+    """
+    cells = LUT_SIZE ** 3
+    counts = np.zeros((len(CLASSES), cells), np.int64)
+    for image, labels in samples:
+        quantized = (image >> LUT_SHIFT).astype(np.intp)
+        index = (quantized[..., 0] << (2 * LUT_BITS)) | (quantized[..., 1] << LUT_BITS) | quantized[..., 2]
+        for cls in CLASSES:
+            counts[cls] += np.bincount(index[labels == cls], minlength=cells)
+
+    # ties go to the background
+    lut = counts.argmax(axis=0).astype(np.uint8)
+    lut[counts.max(axis=0) < min_count] = BACKGROUND
+    lut = lut.reshape((LUT_SIZE,) * 3)
+    empty = (counts.sum(axis=0) == 0).reshape(lut.shape)
+
+    for _ in range(spread):
+        grown = lut.copy()
+        for cls in (PUCK, GOAL):
+            p = np.pad(lut == cls, 1, 'constant')
+            near = (p[:-2, 1:-1, 1:-1] | p[2:, 1:-1, 1:-1] | p[1:-1, :-2, 1:-1] |
+                    p[1:-1, 2:, 1:-1] | p[1:-1, 1:-1, :-2] | p[1:-1, 1:-1, 2:])
+            grown[empty & near & (grown == BACKGROUND)] = cls
+        empty &= grown == BACKGROUND
+        lut = grown
+    return lut
+
+def save_lut(lut, path):
+    np.save(path, lut)
+
+def load_lut(path):
+    """ Loads a table saved by save_lut, None if there is no such file. """
+    if not os.path.exists(path):
+        return None
+    lut = np.load(path)
+    if lut.shape != (LUT_SIZE,) * 3 or lut.dtype != np.uint8 or lut.max() > max(CLASSES):
+        raise ValueError("%s is not a %d^3 color lookup table" % (path, LUT_SIZE))
+    return lut
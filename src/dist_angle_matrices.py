@@ -1,16 +1,62 @@
-import cPickle as pickle
+# Distance and angle of each camera pixel to the reference point of the robot, the middle of
+# the bottom edge of the image, in pixels of the full resolution image.
+#
+# The matrices are saved as .npy files named after the resolution, the reference point, the
+# scale_down of the image and the version of this module, so other geometry gets its own files.
+# They are memory-mapped when loaded. Run this script to build the matrices of the camera.
+import os
+import sys
 import numpy as np
 
-distances = np.zeros((240, 320))
-angles = np.zeros((240, 320))
-point = 240, 160
+# Increase when the matrices are computed differently
+VERSION = 1
+DIRECTORY = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'dist_angle')
+NAMES = ('distances', 'angles', 'order')
 
-for x in range(240):
-    for y in range(320):
-        distances[x, y] = np.sqrt((x - .5 - point[0]) ** 2 +
-                                  (y - .5 - point[1]) ** 2)
-        angles[x, y] = -(np.arctan2(-(y - .5 - point[1]), -(x - .5 - point[0]))
-                         - np.pi / 2) - np.pi / 2
 
-pickle.dump({"distances": distances, "angles": angles},
-            open("distances.p", "wb"))
+def matrix_paths(height, width, point=None, scale_down=1, directory=DIRECTORY):
+    if point is None:
+        point = height, width / 2
+    key = "v%d_%dx%d_%d-%d_%d" % (VERSION, width, height, point[0], point[1], scale_down)
+    return [os.path.join(directory, "%s_%s.npy" % (key, name)) for name in NAMES]
+
+def build(height, width, point=None, scale_down=1):
+    """ Returns the distances and angles of the pixels of the image scaled down by scale_down,
+        and the flat indices of its pixels sorted by distance, equal distances in index order.
+    """
+    if point is None:
+        point = height, width / 2
+    x, y = np.mgrid[0:height / scale_down, 0:width / scale_down] * float(scale_down)
+    distances = np.sqrt((x - .5 - point[0]) ** 2 + (y - .5 - point[1]) ** 2)
+    angles = -(np.arctan2(-(y - .5 - point[1]), -(x - .5 - point[0])) - np.pi / 2) - np.pi / 2
+    distances = distances.astype(np.float32)
+    order = np.argsort(distances, axis=None, kind='mergesort').astype(np.int32)
+    return distances, angles.astype(np.float32), order
+
+def save(height, width, point=None, scale_down=1, directory=DIRECTORY):
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    for path, matrix in zip(matrix_paths(height, width, point, scale_down, directory),
+                            build(height, width, point, scale_down)):
+        # written under another name first, a reader never sees half a file
+        temp = "%s.%d.tmp.npy" % (path[:-len('.npy')], os.getpid())
+        np.save(temp, matrix)
+        os.rename(temp, path)
+
+def load(height, width, point=None, scale_down=1, directory=DIRECTORY):
+    """ Returns the read-only distances, angles and order of build, memory-mapped,
+        the files are built first if they do not exist.
+    """
+    paths = matrix_paths(height, width, point, scale_down, directory)
+    if not all(os.path.exists(path) for path in paths):
+        save(height, width, point, scale_down, directory)
+    return [np.load(path, mmap_mode='r') for path in paths]
+
+
+if __name__ == "__main__":
+    # python dist_angle_matrices.py [height width [scale_down]]
+    height, width = (int(sys.argv[1]), int(sys.argv[2])) if len(sys.argv) > 2 else (240, 320)
+    scale_down = int(sys.argv[3]) if len(sys.argv) > 3 else 1
+    if not all(os.path.exists(path) for path in matrix_paths(height, width, scale_down=scale_down)):
+        save(height, width, scale_down=scale_down)
+    print "\n".join(matrix_paths(height, width, scale_down=scale_down))
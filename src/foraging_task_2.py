@@ -4,14 +4,13 @@ from helpers import *
 from parameters import *
 from task_evaluator import TaskEvaluator
 from cameravision import *
+from image_stream import ImageStreamServer
 import classes as cl
 from peas.networks.rnn import NeuralNetwork
 from threading import Condition, Lock
 
 import gobject
 import glib
-import dbus
-import dbus.mainloop.glib
 from copy import deepcopy
 import json
 import time
@@ -50,7 +49,7 @@ class ForagingTask(TaskEvaluator):
                  timeStep=0.005, activationFunction='tanh', popSize=POPSIZE, generations=GENERATIONS, solvedAt=1000):
         TaskEvaluator.__init__(self, thymioController, commit_sha, debug, experimentName, evaluations, timeStep,
                                activationFunction, popSize, generations, solvedAt)
-        self.camera = CameraVisionVectors(False, self.logger)
+        self.camera = CameraVisionVectors(getFrameSource(), self.logger)
         self.ctrl_thread_started = False
         self.img_thread_started = False
         self.individuals_evaluated = 0
@@ -87,7 +86,7 @@ class ForagingTask(TaskEvaluator):
             inputs = np.hstack(([x if not x == -np.inf else -10000 for x in self.presence], has_box, 1))
             inputs[::2] = inputs[::2] / self.camera.MAX_DISTANCE
 
-            out = NeuralNetwork(evaluee).feed(inputs)
+            out = self.phenotypes.network(evaluee).feed(inputs)
             left, right = list(out[-2:])
             self.motorspeed = { 'left': left, 'right': right }
             self.motorLock.acquire()
@@ -137,10 +136,8 @@ class ForagingTask(TaskEvaluator):
         Calculate the difference in energy of the robot.
     """
     def getEnergyDelta(self):
-        global img_client
-        if img_client and not self.camera.binary_channels is None:
-            send_image(img_client, self.camera.binary_channels, self.energy,
-                       self.presence[0], self.presence[2])
+        if img_server is not None and self.camera.binary_channels is not None:
+            img_server.publish(self.camera.binary_channels, self.energy, self.presence[0], self.presence[2])
 
         speedpenalty = 0
         if self.motorspeed['left'] < 0 and self.motorspeed['right'] < 0:
@@ -293,37 +290,10 @@ def release_resources(thymio):
     ctrl_serversocket.close()
     if ctrl_client: ctrl_client.close()
 
-    global img_serversocket
-    global img_client
-    img_serversocket.close()
-    if img_client: img_client.close()
+    if img_server is not None: img_server.close()
 
     stopThymio(thymio)
 
-def write_header(client, boundary='thymio'):
-    client.send("HTTP/1.0 200 OK\r\n" +
-                "Connection: close\r\n" +
-                "Max-Age: 0\r\n" +
-                "Expires: 0\r\n" +
-                "Cache-Control: no-store, no-cache, must-revalidate, pre-check=0, post-check=0, max-age=0\r\n" +
-                "Pragma: no-cache\r\n" +
-                "Content-Type: multipart/x-mixed-replace; " +
-                "boundary=" + boundary + "\r\n" +
-                "\r\n" +
-                "--" + boundary + "\r\n")
-
-def send_image(client, binary_channels, energy, box_dist, goal_dist, boundary='thymio'):
-    red = np.zeros(binary_channels[0].shape, np.uint8)
-    cv2.putText(red, 'E: {0:.2f} P: {1:.0f} G: {2:.0f}'.format(energy, box_dist, goal_dist), (5, 20), cv2.FONT_HERSHEY_PLAIN, 1, (255, ), 1, 255)
-    image = np.dstack(binary_channels + [red])
-    _, encoded = cv2.imencode('.png', image)
-    image_bytes = bytearray(np.asarray(encoded))
-    client.send("Content-type: image/png\r\n")
-    client.send("Content-Length: %d\r\n\r\n" % len(image_bytes))
-    client.send(image_bytes)
-    client.send("\r\n--" + boundary + "\r\n")
-
-
 if __name__ == '__main__':
     from peas.methods.neat import NEATPopulation, NEATGenotype
     genotype = lambda: NEATGenotype(
@@ -374,9 +344,7 @@ if __name__ == '__main__':
         'weight_range': dummy_individual.weight_range
     }
 
-    dbus.mainloop.glib.DBusGMainLoop(set_as_default=True)
-    bus = dbus.SessionBus()
-    thymioController = dbus.Interface(bus.get_object('ch.epfl.mobots.Aseba', '/'), dbus_interface='ch.epfl.mobots.AsebaNetwork')
+    thymioController = getThymioController()
     thymioController.LoadScripts(AESL_PATH, reply_handler=dbusReply, error_handler=dbusError)
 
     # switch thymio LEDs off
@@ -397,17 +365,7 @@ if __name__ == '__main__':
         print 'Control server: got connection from', address
     thread.start_new_thread(set_client, ())
 
-    img_serversocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    img_serversocket.bind((sys.argv[-2], 31337))
-    img_serversocket.listen(5)
-    img_client = None
-    def set_img_client():
-        global img_client
-        print 'Image server: waiting for socket connections...'
-        (img_client, address) = img_serversocket.accept()
-        print 'Image server: got connection from', address
-        write_header(img_client)
-    thread.start_new_thread(set_img_client, ())
+    img_server = ImageStreamServer(sys.argv[-2], fps=IMAGE_STREAM_FPS, encoding=IMAGE_STREAM_ENCODING).start()
 
     def epoch_callback(population):
         # update log
@@ -433,7 +391,7 @@ if __name__ == '__main__':
         current_champ = population.champions[-1]
         # print 'Champion: ' + str(current_champ.get_network_data())
         # current_champ.visualize(os.path.join(CURRENT_FILE_PATH, 'img/' + task.experimentName + '_%d.jpg' % population.generation))
-        pickle.dump(current_champ, file(os.path.join(PICKLED_DIR, champion_file), 'w'))
+        pickle.dump(current_champ, file(os.path.join(PICKLED_DIR, champion_file), 'wb'), pickle.HIGHEST_PROTOCOL)
 
     try:
         pop.epoch(generations=GENERATIONS, evaluator=task, solution=task, callback=epoch_callback)
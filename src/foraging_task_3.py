@@ -3,9 +3,9 @@ from helpers import *
 from parameters import *
 from task_evaluator import TaskEvaluator
 from cameravision import *
+from image_stream import ImageStreamServer
 from peas.networks.rnn import NeuralNetwork
 from threading import Condition, Lock
-from socket import error as socket_error
 
 import gobject
 import glib
@@ -51,7 +51,7 @@ class ForagingTask(TaskEvaluator):
     def __init__(self, thymioController, commit_sha, debug=False):
         TaskEvaluator.__init__(self, thymioController, commit_sha, debug, EXPERIMENT_NAME, EVALUATIONS, TIME_STEP,
                                ACTIVATION_FUNC, POPSIZE, GENERATIONS, SOLVED_AT)
-        self.camera = CameraVisionVectors(False, self.logger)
+        self.camera = CameraVisionVectors(getFrameSource(), self.logger)
         self.ctrl_thread_started = False
         self.img_thread_started = False
         self.individuals_evaluated = 0
@@ -105,7 +105,7 @@ class ForagingTask(TaskEvaluator):
 
             #print "Inputs: ", inputs
 
-            out = NeuralNetwork(evaluee).feed(inputs)
+            out = self.phenotypes.network(evaluee).feed(inputs)
             left, right = list(out[-2:])
             self.motorspeed = { 'left': left, 'right': right }
             self.motorLock.acquire()
@@ -130,13 +130,8 @@ class ForagingTask(TaskEvaluator):
         return max(self.evaluations_taken + energy_norm, 1)
 
     def getEnergyDelta2(self):
-        global img_client
-        if img_client and self.camera.binary_channels is not None:
-            try:
-                send_image(img_client, self.camera.binary_channels, self.energy,
-                           self.presence[0], self.presence[2])
-            except socket_error:
-                print "could not send image"
+        if img_server is not None and self.camera.binary_channels is not None:
+            img_server.publish(self.camera.binary_channels, self.energy, self.presence[0], self.presence[2])
 
         self.presence = [x if not x == -np.inf else self.camera.MAX_DISTANCE for x in self.presence]
         self.prev_presence = [x if not x == -np.inf else self.camera.MAX_DISTANCE for x in self.prev_presence]
@@ -381,38 +376,10 @@ def release_resources(thymio):
     ctrl_serversocket.close()
     if ctrl_client: ctrl_client.close()
 
-    global img_serversocket
-    global img_client
-    img_serversocket.close()
-    if img_client: img_client.close()
+    if img_server is not None: img_server.close()
 
     stopThymio(thymio)
 
-def write_header(client, boundary='thymio'):
-    client.send("HTTP/1.0 200 OK\r\n" +
-                "Connection: close\r\n" +
-                "Max-Age: 0\r\n" +
-                "Expires: 0\r\n" +
-                "Cache-Control: no-store, no-cache, must-revalidate, pre-check=0, post-check=0, max-age=0\r\n" +
-                "Pragma: no-cache\r\n" +
-                "Content-Type: multipart/x-mixed-replace; " +
-                "boundary=" + boundary + "\r\n" +
-                "\r\n" +
-                "--" + boundary + "\r\n")
-
-
-def send_image(client, binary_channels, energy, box_dist, goal_dist, boundary='thymio'):
-    red = np.zeros(binary_channels[0].shape, np.uint8)
-    cv2.putText(red, 'E: {0:.2f} P: {1:.0f} G: {2:.0f}'.format(energy, box_dist, goal_dist), (5, 20), cv2.FONT_HERSHEY_PLAIN, 1, (255, ), 1, 255)
-    image = np.dstack(binary_channels + [red])
-    _, encoded = cv2.imencode('.png', image)
-    image_bytes = bytearray(np.asarray(encoded))
-    client.send("Content-type: image/png\r\n")
-    client.send("Content-Length: %d\r\n\r\n" % len(image_bytes))
-    client.send(image_bytes)
-    client.send("\r\n--" + boundary + "\r\n")
-
-
 if __name__ == '__main__':
     from peas.methods.neat import NEATPopulation, NEATGenotype
     genotype = lambda: NEATGenotype(
@@ -463,9 +430,7 @@ if __name__ == '__main__':
         'weight_range': dummy_individual.weight_range
     }
 
-    dbus.mainloop.glib.DBusGMainLoop(set_as_default=True)
-    bus = dbus.SessionBus()
-    thymioController = dbus.Interface(bus.get_object('ch.epfl.mobots.Aseba', '/'), dbus_interface='ch.epfl.mobots.AsebaNetwork')
+    thymioController = getThymioController()
     thymioController.LoadScripts(AESL_PATH, reply_handler=dbusReply, error_handler=dbusError)
 
     # switch thymio LEDs off
@@ -486,17 +451,7 @@ if __name__ == '__main__':
         print 'Control server: got connection from', address
     thread.start_new_thread(set_client, ())
 
-    img_serversocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    img_serversocket.bind((sys.argv[-2], 31337))
-    img_serversocket.listen(5)
-    img_client = None
-    def set_img_client():
-        global img_client
-        print 'Image server: waiting for socket connections.'
-        (img_client, address) = img_serversocket.accept()
-        print 'Image server: got connection from', address
-        write_header(img_client)
-    thread.start_new_thread(set_img_client, ())
+    img_server = ImageStreamServer(sys.argv[-2], fps=IMAGE_STREAM_FPS, encoding=IMAGE_STREAM_ENCODING).start()
 
     def epoch_callback(population):
         # update log
@@ -522,7 +477,7 @@ if __name__ == '__main__':
         current_champ = population.champions[-1]
         # print 'Champion: ' + str(current_champ.get_network_data())
         # current_champ.visualize(os.path.join(CURRENT_FILE_PATH, 'img/' + task.experimentName + '_%d.jpg' % population.generation))
-        pickle.dump(current_champ, file(os.path.join(PICKLED_DIR, champion_file), 'w'))
+        pickle.dump(current_champ, file(os.path.join(PICKLED_DIR, champion_file), 'wb'), pickle.HIGHEST_PROTOCOL)
 
     try:
         pop.epoch(generations=GENERATIONS, evaluator=task, solution=task, callback=epoch_callback)
@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+# Sources of BGR frames for cameravision.py: the Pi camera, or recorded and synthetic frames to
+# run the vision off the robot. A source is opened with a with-statement, and capture_sequence
+# captures into each buffer of outputs in turn, as picamera's capture_sequence does.
+import os
+import glob
+import time
+
+import cv2
+import numpy as np
+
+# Pacing of recorded frames: at the rate they were recorded, as fast as they are asked for,
+# or at a fixed rate
+REALTIME, FAST, FIXED = 'realtime', 'fast', 'fixed'
+
+
+class FrameSource(object):
+    def __init__(self, mode=REALTIME, fps=None, loop=False):
+        if mode not in (REALTIME, FAST, FIXED):
+            raise ValueError("Unknown frame source mode %r" % mode)
+        if mode == FIXED and not fps:
+            raise ValueError("A fixed rate needs the fps")
+        self.mode = mode
+        self.fps = fps
+        self.loop = loop
+        # frames per second the frames were recorded at
+        self.native_fps = 30.0
+        self.frames_read = 0
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def open(self):
+        pass
+
+    def close(self):
+        pass
+
+    # the frames of the source once, in order, the subclasses implement this
+    def frames(self):
+        raise NotImplementedError()
+
+    def _interval(self):
+        if self.mode == FAST:
+            return 0.0
+        return 1.0 / (self.fps if self.mode == FIXED else self.native_fps)
+
+    def capture_sequence(self, outputs):
+        interval = self._interval()
+        deadline = time.time()
+        frames = self.frames()
+        for output in outputs:
+            frame = next(frames, None)
+            if frame is None and self.loop and self.frames_read:
+                frames = self.frames()
+                frame = next(frames, None)
+            if frame is None:
+                return
+            # a deadline per frame, so the time spent outside does not slow the rate down
+            deadline += interval
+            delay = deadline - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                deadline = time.time()
+            if frame.shape != output.shape:
+                frame = cv2.resize(frame, (output.shape[1], output.shape[0]))
+            output[...] = frame
+            self.frames_read += 1
+
+
+class PiCameraSource(FrameSource):
+    """ The camera of the robot, the exposure and white balance are fixed after
+        they settled if fix_exposure is set. It always runs in real time.
+    """
+    def __init__(self, width=320, height=240, framerate=32, fix_exposure=True):
+        FrameSource.__init__(self)
+        self.resolution = (width, height)
+        self.native_fps = framerate
+        self.fix_exposure = fix_exposure
+        self.camera = None
+
+    def open(self):
+        import picamera
+        self.camera = picamera.PiCamera()
+        self.camera.resolution = self.resolution
+        self.camera.framerate = self.native_fps
+
+        time.sleep(0.1)
+        if self.fix_exposure:
+            # Now fix the values
+            self.camera.shutter_speed = self.camera.exposure_speed
+            self.camera.exposure_mode = 'off'
+            g = self.camera.awb_gains #TODO: make this fixed?
+            self.camera.awb_mode = 'off'
+            self.camera.awb_gains = g
+
+    def close(self):
+        if self.camera is not None:
+            self.camera.close()
+            self.camera = None
+
+    def capture_sequence(self, outputs):
+        self.camera.capture_sequence(outputs, format="bgr", use_video_port=True)
+
+
+class ImageDirectorySource(FrameSource):
+    """ The images of a directory or a glob pattern, in sorted order. HSV images are converted
+        back if hsv is set, by default that is the hsv_*.jpg captures of get_camera_pics.py.
+    """
+    def __init__(self, path, hsv=None, mode=REALTIME, fps=None, loop=False):
+        FrameSource.__init__(self, mode, fps, loop)
+        pattern = os.path.join(path, '*.jpg') if os.path.isdir(path) else path
+        self.names = sorted(glob.glob(pattern))
+        if not self.names:
+            raise IOError("No images in %s" % path)
+        self.hsv = hsv
+        self.images = None
+
+    def open(self):
+        # decoded up front, reading a file would count as the latency of the camera
+        self.images = []
+        for name in self.names:
+            image = cv2.imread(name)
+            if image is None:
+                raise IOError("Cannot read %s" % name)
+            hsv = self.hsv if self.hsv is not None else os.path.basename(name).startswith('hsv_')
+            self.images.append(cv2.cvtColor(image, cv2.COLOR_HSV2BGR) if hsv else image)
+
+    def frames(self):
+        return iter(self.images)
+
+
+class VideoFileSource(FrameSource):
+    """ The frames of a video file, at the rate it was recorded in real time. """
+    def __init__(self, path, mode=REALTIME, fps=None, loop=False):
+        FrameSource.__init__(self, mode, fps, loop)
+        self.path = path
+        self.video = None
+
+    def open(self):
+        self.video = cv2.VideoCapture(self.path)
+        if not self.video.isOpened():
+            raise IOError("Cannot open %s" % self.path)
+        # CAP_PROP_FPS is cv2.cv.CV_CAP_PROP_FPS in OpenCV 2
+        native_fps = self.video.get(getattr(cv2, 'CAP_PROP_FPS', 5))
+        if native_fps > 0:
+            self.native_fps = native_fps
+
+    def close(self):
+        if self.video is not None:
+            self.video.release()
+            self.video = None
+
+    def frames(self):
+        # rewinds for a loop
+        self.video.set(getattr(cv2, 'CAP_PROP_POS_FRAMES', 1), 0)
+        while True:
+            ok, frame = self.video.read()
+            if not ok:
+                return
+            yield frame
+
+
+class SyntheticSource(FrameSource):
+    """ Frames made in memory: the given list of frames, or a function of the frame number
+        that returns a frame, None ends the frames. By default a puck and a goal move
+        across the arena, for count frames.
+    """
+    def __init__(self, frames=None, width=320, height=240, count=300, mode=REALTIME, fps=None, loop=False):
+        FrameSource.__init__(self, mode, fps, loop)
+        self.width = width
+        self.height = height
+        self.count = count
+        if frames is None:
+            frames = self.arena_frame
+        self.make_frame = frames if callable(frames) else lambda number: frames[number] if number < len(frames) else None
+
+    def arena_frame(self, number):
+        if number >= self.count:
+            return None
+        frame = np.empty((self.height, self.width, 3), np.uint8)
+        frame[...] = (90, 90, 90)
+        phase = 2 * np.pi * number / self.count
+        # the goal drifts along the back wall, the puck circles in front of the robot
+        goal_x = int(self.width * (0.5 + 0.4 * np.sin(phase)))
+        cv2.rectangle(frame, (goal_x - 30, 0), (goal_x + 30, self.height / 5), (200, 20, 10), -1)
+        puck = (int(self.width * (0.5 + 0.3 * np.cos(phase))), int(self.height * (0.6 + 0.25 * np.sin(phase))))
+        cv2.circle(frame, puck, self.height / 10, (20, 180, 20), -1)
+        return frame
+
+    def frames(self):
+        number = 0
+        while True:
+            frame = self.make_frame(number)
+            if frame is None:
+                return
+            yield frame
+            number += 1
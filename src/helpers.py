@@ -1,5 +1,6 @@
 import sys, os, errno
-from parameters import MAX_MOTOR_SPEED
+import numpy as np
+from parameters import MAX_MOTOR_SPEED, SENSOR_MAX
 
 MAX_MOTOR_SPEED = 250
 RAND_MAX = sys.maxint
@@ -37,6 +38,42 @@ def getNextIDPath(path):
         nextID = int(filelist[-1][0]) + 1
     return str(nextID)
 
+def getThymioController(system=False):
+    """ Returns the Aseba network of the robot over D-Bus, or a simulated
+        one (see thymio_sim.py) when the THYMIO_SIM environment variable is set.
+    """
+    if os.environ.get('THYMIO_SIM'):
+        from thymio_sim import SimulatedThymio
+        return SimulatedThymio()
+    import dbus
+    import dbus.mainloop.glib
+    dbus.mainloop.glib.DBusGMainLoop(set_as_default=True)
+    bus = dbus.SystemBus() if system else dbus.SessionBus()
+    return dbus.Interface(bus.get_object('ch.epfl.mobots.Aseba', '/'), dbus_interface='ch.epfl.mobots.AsebaNetwork')
+
+def getFrameSource():
+    """ Returns the frame source of the camera vision, set by the CAMERA_SOURCE environment
+        variable: 'synthetic', a video file, or a directory or glob of images (see frame_sources.py),
+        or None for the Pi camera. CAMERA_FPS sets a fixed rate, or 'fast' for as fast as possible,
+        the frames are replayed in real time otherwise.
+    """
+    path = os.environ.get('CAMERA_SOURCE')
+    if not path:
+        return None
+    import frame_sources
+    fps = os.environ.get('CAMERA_FPS')
+    if fps == 'fast':
+        pacing = {'mode': frame_sources.FAST}
+    elif fps:
+        pacing = {'mode': frame_sources.FIXED, 'fps': float(fps)}
+    else:
+        pacing = {'mode': frame_sources.REALTIME}
+    if path == 'synthetic':
+        return frame_sources.SyntheticSource(loop=True, **pacing)
+    if os.path.isfile(path) and not path.lower().endswith(('.jpg', '.png')):
+        return frame_sources.VideoFileSource(path, loop=True, **pacing)
+    return frame_sources.ImageDirectorySource(path, loop=True, **pacing)
+
 def writeMotorSpeed(controller, motorspeed, max_speed=MAX_MOTOR_SPEED):
     controller.SetVariable("thymio-II", "motor.left.target", [motorspeed['left'] * max_speed])
     controller.SetVariable("thymio-II", "motor.right.target", [motorspeed['right'] * max_speed])
@@ -60,3 +97,51 @@ def dbusReply():
 
 def dbusError(e):
     print 'error %s' % str(e)
+
+
+# Fitness of the tasks, shared by the robot scripts and the simulated tasks (sim_tasks.py)
+
+def normalize_prox(prox):
+    """ Scales prox.horizontal readings to [-1, 1], as the tasks do. """
+    half = float(SENSOR_MAX[0] / 2)
+    return (prox - half) / half
+
+def obstacle_avoidance_fitness(left, right, observation):
+    """ Fitness of one timestep in [-2, 2], for a single robot or for arrays of robots:
+        left and right are the motor outputs, observation has the normalized
+        sensors in its last axis, followed by a constant.
+    """
+    speedpenalty = np.abs(left - right)
+    # Normalized distance to the nearest object
+    sensorpenalty = np.maximum(np.max(observation[..., :-1], axis=-1), 0)
+    return (left + right) * (1 - np.minimum(speedpenalty, 1)) * (1 - np.minimum(sensorpenalty, 1))
+
+def foraging_energy_delta(presence, prev_presence, proxvalues, has_puck, max_distance, puck_bonus_scale=1,
+                          goal_bonus_scale=2, turn_away_punish_scale=10, angle_penalty=1):
+    """ The energy change of one timestep of the foraging task, as in
+        ForagingTask.getEnergyDelta2 of foraging_task_3.py, whose scales are the
+        defaults, for arrays of robots. presence holds (puck distance, puck angle,
+        goal distance, goal angle) in its last axis, with max_distance for what
+        is not seen.
+    """
+    prox_penalty_front = (proxvalues[..., 0] + 1) * 20
+    prox_penalty_back = (proxvalues[..., 1] + 1) * 10
+
+    # Carrying the puck: rewarded for approaching the goal
+    prev_saw_goal = (prev_presence[..., 2] != max_distance) & (presence[..., 2] == max_distance)
+    angle_goal_diff = np.abs(prev_presence[..., 3]) - np.abs(presence[..., 3])
+    delta_goal_distance = np.abs(prev_presence[..., 2]) - np.abs(presence[..., 2])
+    delta_goal_distance = np.where(np.abs(delta_goal_distance) > 60, 10, delta_goal_distance)
+    to_goal = goal_bonus_scale * delta_goal_distance + angle_penalty * angle_goal_diff \
+        - turn_away_punish_scale * prev_saw_goal
+
+    # Searching: rewarded for approaching the puck
+    prev_saw_puck = (prev_presence[..., 0] != max_distance) & (presence[..., 0] == max_distance)
+    delta_puck_distance = np.abs(prev_presence[..., 0]) - np.abs(presence[..., 0])
+    delta_puck_distance = np.where(np.abs(delta_puck_distance) > 60, 10, delta_puck_distance)
+    angle_puck_diff = np.abs(prev_presence[..., 1]) - np.abs(presence[..., 1])
+    angle_puck_diff = np.where(angle_puck_diff < 0, 2 * angle_puck_diff, angle_puck_diff)
+    to_puck = puck_bonus_scale * delta_puck_distance + angle_penalty * angle_puck_diff \
+        - turn_away_punish_scale * prev_saw_puck
+
+    return np.where(has_puck, to_goal, to_puck) - prox_penalty_front - prox_penalty_back
@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+# Stream of the binary images of the camera vision to the viewers of img-stream.py, as a
+# multipart HTTP response on port 31337.
+#
+# The control loop only publishes its latest images, which never blocks: an encoder thread
+# takes the newest one at a lower rate, and each viewer has a sender thread that sends
+# the newest encoded frame when it is done with the last one. Frames a slow viewer could
+# not take are dropped for that viewer, the others and the control loop do not wait for it.
+import socket
+import threading
+import time
+
+import cv2
+import numpy as np
+
+IMAGE_PORT = 31337
+# a JPEG of the masks with the values drawn on them, or the masks themselves, lossless
+JPEG, MASK = 'jpeg', 'mask'
+
+
+def write_header(client, boundary='thymio'):
+    client.sendall("HTTP/1.0 200 OK\r\n" +
+                   "Connection: close\r\n" +
+                   "Max-Age: 0\r\n" +
+                   "Expires: 0\r\n" +
+                   "Cache-Control: no-store, no-cache, must-revalidate, pre-check=0, post-check=0, max-age=0\r\n" +
+                   "Pragma: no-cache\r\n" +
+                   "Content-Type: multipart/x-mixed-replace; " +
+                   "boundary=" + boundary + "\r\n" +
+                   "\r\n" +
+                   "--" + boundary + "\r\n")
+
+def encode_image(binary_channels, energy, box_dist, goal_dist, encoding=JPEG, quality=80, boundary='thymio'):
+    """ Returns a part of the multipart stream: the goal and puck masks in the blue and green
+        channels, the values in the red one.
+    """
+    red = np.zeros(binary_channels[0].shape, np.uint8)
+    cv2.putText(red, 'E: {0:.2f} P: {1:.0f} G: {2:.0f}'.format(energy, box_dist, goal_dist), (5, 20), cv2.FONT_HERSHEY_PLAIN, 1, (255, ), 1, 255)
+    image = cv2.merge(list(binary_channels) + [red])
+    if encoding == JPEG:
+        # IMWRITE_JPEG_QUALITY is cv2.cv.CV_IMWRITE_JPEG_QUALITY in OpenCV 2
+        _, encoded = cv2.imencode('.jpg', image, [getattr(cv2, 'IMWRITE_JPEG_QUALITY', 1), quality])
+        content_type = 'image/jpeg'
+    elif encoding == MASK:
+        _, encoded = cv2.imencode('.png', image)
+        content_type = 'image/png'
+    else:
+        raise ValueError("Unknown image encoding %r" % encoding)
+    return ("Content-type: %s\r\nContent-Length: %d\r\n\r\n" % (content_type, encoded.size) +
+            encoded.tostring() + "\r\n--" + boundary + "\r\n")
+
+
+class Viewer(object):
+    """ A connected viewer, it is sent the newest frame it was offered. """
+    def __init__(self, client, address, boundary, timeout):
+        self.client = client
+        self.address = address
+        self.boundary = boundary
+        self.client.settimeout(timeout)
+        self.condition = threading.Condition()
+        self.frame = None
+        self.closed = False
+        self.sent = 0
+        self.dropped = 0
+        self.thread = threading.Thread(target=self._send, name='viewer %s:%d' % address)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def offer(self, frame):
+        with self.condition:
+            if self.frame is not None:
+                self.dropped += 1
+            self.frame = frame
+            self.condition.notify()
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+
+    def _send(self):
+        try:
+            write_header(self.client, self.boundary)
+            while True:
+                with self.condition:
+                    while self.frame is None and not self.closed:
+                        self.condition.wait()
+                    if self.closed:
+                        return
+                    frame, self.frame = self.frame, None
+                self.client.sendall(frame)
+                self.sent += 1
+        except (socket.error, socket.timeout):
+            print 'Image server: lost connection to', self.address
+        finally:
+            self.closed = True
+            self.client.close()
+
+
+class ImageStreamServer(object):
+    """ Streams the images given to publish to any number of viewers, at most fps frames
+        per second.
+    """
+    def __init__(self, host, port=IMAGE_PORT, fps=2, encoding=JPEG, quality=80, max_viewers=8,
+                 timeout=5.0, boundary='thymio'):
+        if encoding not in (JPEG, MASK):
+            raise ValueError("Unknown image encoding %r" % encoding)
+        self.address = (host, port)
+        self.interval = 1.0 / fps
+        self.encoding = encoding
+        self.quality = quality
+        self.max_viewers = max_viewers
+        self.timeout = timeout
+        self.boundary = boundary
+
+        self.condition = threading.Condition()
+        self.latest = None
+        self.running = False
+        self.viewers = []
+        self.published = 0
+        self.encoded = 0
+        self.server_socket = None
+
+    def start(self):
+        self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server_socket.bind(self.address)
+        self.server_socket.listen(5)
+        self.address = self.server_socket.getsockname()
+        self.running = True
+        for target, name in ((self._accept, 'image accept'), (self._encode, 'image encoder')):
+            worker = threading.Thread(target=target, name=name)
+            worker.daemon = True
+            worker.start()
+        return self
+
+    def has_viewers(self):
+        return any(not viewer.closed for viewer in self.viewers)
+
+    def publish(self, binary_channels, energy, box_dist, goal_dist):
+        """ Keeps the images as the latest ones, an older one not encoded yet is dropped.
+            The images are not copied, they should not be changed afterwards.
+        """
+        with self.condition:
+            self.latest = (binary_channels, energy, box_dist, goal_dist)
+            self.published += 1
+            self.condition.notify()
+
+    def close(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        if self.server_socket is not None:
+            # shutdown wakes up the accept
+            try:
+                self.server_socket.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+            self.server_socket.close()
+        for viewer in self.viewers:
+            viewer.close()
+
+    def stats(self):
+        return {'published': self.published, 'encoded': self.encoded,
+                'viewers': [{'address': viewer.address, 'sent': viewer.sent, 'dropped': viewer.dropped}
+                            for viewer in self.viewers]}
+
+    def _accept(self):
+        print 'Image server: waiting for socket connections on %s:%d' % self.address
+        while self.running:
+            try:
+                (client, address) = self.server_socket.accept()
+            except socket.error:
+                break
+            self.viewers = [viewer for viewer in self.viewers if not viewer.closed]
+            if len(self.viewers) >= self.max_viewers:
+                print 'Image server: refused', address, ', too many viewers'
+                client.close()
+                continue
+            print 'Image server: got connection from', address
+            self.viewers.append(Viewer(client, address, self.boundary, self.timeout))
+
+    def _encode(self):
+        next_frame = time.time()
+        while True:
+            with self.condition:
+                while self.latest is None and self.running:
+                    self.condition.wait()
+                if not self.running:
+                    return
+            # the images published while waiting replace each other
+            delay = next_frame - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            next_frame = max(next_frame + self.interval, time.time())
+            with self.condition:
+                latest, self.latest = self.latest, None
+            viewers = [viewer for viewer in self.viewers if not viewer.closed]
+            if latest is None or not viewers:
+                continue
+            try:
+                frame = encode_image(*latest, encoding=self.encoding, quality=self.quality, boundary=self.boundary)
+            except cv2.error as error:
+                print 'Image server: could not encode image', error
+                continue
+            self.encoded += 1
+            for viewer in viewers:
+                viewer.offer(frame)
@@ -4,8 +4,6 @@ from parameters import *
 # from neat_task import NEATTask
 
 import numpy as np
-import dbus
-import dbus.mainloop.glib
 import logging
 logging.basicConfig()
 import parameters as pr
@@ -57,7 +55,7 @@ class ObstacleAvoidance(TaskEvaluator):
         def ok_call(psValues):
             psValues = np.array([psValues[0], psValues[2], psValues[4], psValues[5], psValues[6], 1],dtype='f')
             psValues[0:5] = [(float(x) - float(pr.SENSOR_MAX[0]/2))/float(pr.SENSOR_MAX[0]/2) for x in psValues[0:5]]
-            left, right = list(NeuralNetwork(evaluee).feed(psValues)[-2:])
+            left, right = list(self.phenotypes.network(evaluee).feed(psValues)[-2:])
             motorspeed = { 'left': left, 'right': right }
             try:
                 writeMotorSpeed(self.thymioController, motorspeed)
@@ -80,25 +78,8 @@ class ObstacleAvoidance(TaskEvaluator):
         return True
 
     def getFitness(self, motorspeed, observation):
-        # Calculate penalty for rotating
-        # speedpenalty = 0
-        # if motorspeed['left'] > motorspeed['right']:
-        #     speedpenalty = float((motorspeed['left'] - motorspeed['right']))
-        # else:
-        #     speedpenalty = float((motorspeed['right'] - motorspeed['left']))
-
-        speedpenalty = float(abs(motorspeed['left'] - motorspeed['right']))
-
-        # Calculate normalized distance to the nearest object
-        sensorpenalty = 0
-        for i, sensor in enumerate(observation[:-1]):
-            distance = sensor
-            if sensorpenalty < distance:
-                sensorpenalty = distance
-
-
-        # fitness for 1 timestep in [-2, 2]
-        return float(motorspeed['left'] + motorspeed['right']) * (1 - min(speedpenalty,1)) * (1 - min(sensorpenalty,1))
+        # fitness for 1 timestep in [-2, 2], shared with the simulated task
+        return float(obstacle_avoidance_fitness(motorspeed['left'], motorspeed['right'], observation))
 
 
 def check_stop(task):
@@ -132,7 +113,7 @@ if __name__ == '__main__':
         stdev_mutate_weight=.25,
         stdev_mutate_bias=.25,
         stdev_mutate_response=.25)
-    pop = NEATPopulation(genotype, popsize=POPSIZE, target_species=TARGET_SPECIES)
+    pop = NEATPopulation(genotype, popsize=POPSIZE, target_species=TARGET_SPECIES, seed=pr.seed)
 
     # log neat settings
     log = { 'neat': {}, 'generations': [] }
@@ -161,9 +142,7 @@ if __name__ == '__main__':
         'weight_range': dummy_individual.weight_range
     }
 
-    dbus.mainloop.glib.DBusGMainLoop(set_as_default=True)
-    bus = dbus.SessionBus()
-    thymioController = dbus.Interface(bus.get_object('ch.epfl.mobots.Aseba', '/'), dbus_interface='ch.epfl.mobots.AsebaNetwork')
+    thymioController = getThymioController()
     thymioController.LoadScripts(AESL_PATH, reply_handler=dbusReply, error_handler=dbusError)
 
     # switch thymio LEDs off
@@ -41,4 +41,10 @@ hidden_layer = 1
 CURRENT_FILE_PATH = os.path.abspath(os.path.dirname(__file__))
 OUTPUT_PATH = os.path.join(CURRENT_FILE_PATH, 'output')
 PICKLED_DIR = os.path.join(CURRENT_FILE_PATH, 'pickled')
+# Color lookup table written by calibrate/build_lut.py, the color ranges of cameravision.py are used without it
+COLOR_LUT_FILE = os.path.join(CURRENT_FILE_PATH, 'color_lut.npy')
 FORMATTER = logging.Formatter('%(asctime)s - %(levelname)s: %(message)s')
+# Images streamed to img-stream.py: at most this many frames per second, encoded as 'jpeg' or
+# as the lossless 'mask'
+IMAGE_STREAM_FPS = 2
+IMAGE_STREAM_ENCODING = 'jpeg'
@@ -41,7 +41,7 @@ def random_direction_vector():
     theta = np.random.random() * np.pi*2
     return np.array([np.cos(theta), np.sin(theta)])
 
-def run(method, splits, generations=500, popsize=500):
+def run(method, splits, generations=500, popsize=500, max_cores=1):
     complexity = 'half'
     splits = int(splits)
     
@@ -84,7 +84,7 @@ def run(method, splits, generations=500, popsize=500):
                                        prob_add_conn=0.3, prob_add_node=0.03,
                                        types=['sin', 'ident', 'gauss', 'sigmoid', 'abs'])
                                    
-        pop = NEATPopulation(geno, popsize=popsize, target_species=8)
+        pop = NEATPopulation(geno, popsize=popsize, max_cores=max_cores, target_species=8)
         developer = HyperNEATDeveloper(substrate=substrate, add_deltas=False, sandwich=False)
         
         
@@ -93,13 +93,13 @@ def run(method, splits, generations=500, popsize=500):
                                     max_nodes=3,
                                     types=['sin', 'ident', 'gauss', 'sigmoid', 'abs'])
                                    
-        pop = NEATPopulation(geno, popsize=popsize, target_species=8)
+        pop = NEATPopulation(geno, popsize=popsize, max_cores=max_cores, target_species=8)
         developer = HyperNEATDeveloper(substrate=substrate, add_deltas=False, sandwich=False)
         
 
     elif method == 'wavelet':
         geno = lambda: WaveletGenotype(inputs=2)
-        pop = SimplePopulation(geno, popsize=popsize)
+        pop = SimplePopulation(geno, popsize=popsize, max_cores=max_cores)
         developer = WaveletDeveloper(substrate=substrate, add_deltas=False, sandwich=False)
     
     
@@ -35,7 +35,7 @@ def solve(individual, task, developer):
 
 
 ### SETUPS ###    
-def run(method, setup, generations=100, popsize=100):
+def run(method, setup, generations=100, popsize=100, max_cores=1):
     """ Use hyperneat for a walking gait task
     """
     # Create task and genotype->phenotype converter
@@ -113,7 +113,7 @@ def run(method, setup, generations=100, popsize=100):
         
     if method == 'wvl':
         geno = lambda: WaveletGenotype(inputs=4, layers=3)
-        pop = SimplePopulation(geno, popsize=popsize)
+        pop = SimplePopulation(geno, popsize=popsize, max_cores=max_cores)
         developer = WaveletDeveloper(substrate=substrate, 
                                      add_deltas=False, 
                                      sandwich=False,
@@ -138,7 +138,7 @@ def run(method, setup, generations=100, popsize=100):
     
         geno = lambda: NEATGenotype(**geno_kwds)
 
-        pop = NEATPopulation(geno, popsize=popsize, target_species=8)
+        pop = NEATPopulation(geno, popsize=popsize, max_cores=max_cores, target_species=8)
     
         developer = HyperNEATDeveloper(substrate=substrate, 
                                        add_deltas=False,
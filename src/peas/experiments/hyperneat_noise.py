@@ -27,7 +27,7 @@ def evaluate(individual, task, developer):
         stats['nodes'] = sum(len(w) for w in individual.wavelets)
     return stats
 
-def run(method, level, generations=500, popsize=500, visualize_individual=None):
+def run(method, level, generations=500, popsize=500, visualize_individual=None, max_cores=1):
                 
     shape = (3,3)
     task = TargetWeightsTask(substrate_shape=shape, noise=level, fitnessmeasure='sqerr')
@@ -41,7 +41,7 @@ def run(method, level, generations=500, popsize=500, visualize_individual=None):
                                        prob_add_conn=0.3, prob_add_node=0.03,
                                        types=['sin', 'linear', 'gauss', 'sigmoid', 'abs'])
                                    
-        pop = NEATPopulation(geno, popsize=popsize, target_species=8)
+        pop = NEATPopulation(geno, popsize=popsize, max_cores=max_cores, target_species=8)
         developer = HyperNEATDeveloper(substrate=substrate, add_deltas=False, sandwich=False)
         
     elif method == '0hn':
@@ -51,13 +51,13 @@ def run(method, level, generations=500, popsize=500, visualize_individual=None):
                                        prob_add_conn=0.0, prob_add_node=0.00, topology=t,
                                        types=['sin', 'linear', 'gauss', 'sigmoid', 'abs'])
                                    
-        pop = NEATPopulation(geno, popsize=popsize, target_species=8)
+        pop = NEATPopulation(geno, popsize=popsize, max_cores=max_cores, target_species=8)
         developer = HyperNEATDeveloper(substrate=substrate, add_deltas=False, sandwich=False)
         
 
     elif method == 'wavelet':
         geno = lambda: WaveletGenotype(inputs=len(shape)*2)
-        pop = SimplePopulation(geno, popsize=popsize)
+        pop = SimplePopulation(geno, popsize=popsize, max_cores=max_cores)
         developer = WaveletDeveloper(substrate=substrate, add_deltas=False, sandwich=False)
     
 
@@ -30,7 +30,7 @@ def evaluate(individual, task, developer):
 def solve(individual, task, developer):
     return task.solve(developer.convert(individual))
 
-def run(method, setup, generations=250, popsize=100):
+def run(method, setup, generations=250, popsize=100, max_cores=1):
     # Create task and genotype->phenotype converter
     size = 11
     task_kwds = dict(size=size)
@@ -51,7 +51,7 @@ def run(method, setup, generations=250, popsize=100):
     if method == 'wavelet':
         num_inputs = 6 if deltas else 4
         geno = lambda: WaveletGenotype(inputs=num_inputs)
-        pop = SimplePopulation(geno, popsize=popsize)
+        pop = SimplePopulation(geno, popsize=popsize, max_cores=max_cores)
         developer = WaveletDeveloper(substrate=substrate, add_deltas=True, sandwich=True)
     
     else:
@@ -71,7 +71,7 @@ def run(method, setup, generations=250, popsize=100):
             geno_kwds['max_nodes'] = 8
     
         geno = lambda: NEATGenotype(**geno_kwds)
-        pop = NEATPopulation(geno, popsize=popsize, target_species=8)
+        pop = NEATPopulation(geno, popsize=popsize, max_cores=max_cores, target_species=8)
     	
         developer = HyperNEATDeveloper(substrate=substrate, 
                                        sandwich=True, 
@@ -0,0 +1,126 @@
+import random
+import socket
+import struct
+import time
+import threading
+from collections import OrderedDict
+
+from genome_wire import peek_fitness
+
+# The envelope of a genome message that is gossiped: its origin robot, an epoch drawn when the
+# origin started and a sequence number make its id, with the hops it may still make and the time
+# it was published. The genome message follows it.
+ENVELOPE = struct.Struct('!2sBB4sIId')
+MAGIC = 'GS'
+VERSION = 1
+# Ids of the messages seen, to drop the copies that come back
+SEEN_SIZE = 4096
+
+
+# Epidemic dissemination of the genotypes over the PeerNetwork: a message is sent to a few random
+# peers, and each robot that sees it for the first time puts it in its inbox and forwards it
+# to a few random peers of its own, until its hops run out.
+# Messages are forwarded in rounds, when the robot publishes its own: along with it, only the
+# forward fittest of the messages received since the last round are forwarded, so the traffic of
+# a robot does not grow with the number of robots.
+class Gossip(object):
+    def __init__(self, address, inbox, simulationLogger, fanout=2, ttl=4, forward=2, rng=None):
+        self.__address = address
+        self.__origin = socket.inet_aton(address)
+        self.__inbox = inbox
+        self.__simLogger = simulationLogger
+        self.__rng = rng or random.Random()
+        self.__epoch = self.__rng.getrandbits(32)
+        self.__sequence = 0
+        self.__seen = OrderedDict()
+        self.__lock = threading.Lock()
+        self.fanout = fanout
+        self.ttl = ttl
+        self.forward = forward
+        self.network = None
+        # messages to forward in the next round, by id, with their fitness
+        self.__pending = dict()
+        self.published = 0
+        self.received = 0
+        self.duplicates = 0
+        # copies sent to peers, of our messages and of those forwarded
+        self.sent = 0
+        self.__latencies = list()
+        # per origin and epoch: the first and last sequence numbers and the number of messages seen
+        self.__coverage = dict()
+
+    def publish(self, message):
+        with self.__lock:
+            self.__sequence += 1
+            envelope = ENVELOPE.pack(MAGIC, VERSION, self.ttl, self.__origin, self.__epoch, self.__sequence,
+                                     time.time())
+            self.__isNew(self.__origin, self.__epoch, self.__sequence)
+            self.published += 1
+            pending, self.__pending = self.__pending, dict()
+        self.__send(envelope + message, exclude=())
+        for fitness, data, exclude in sorted(pending.values(), reverse=True)[:self.forward]:
+            self.__send(data, exclude)
+
+    # Called by the PeerNetwork with each message it receives, in place of the inbox
+    def append(self, data, sender=None):
+        if len(data) < ENVELOPE.size or data[:2] != MAGIC:
+            # a robot that does not gossip sent the genome message itself
+            self.__inbox.append(data, sender)
+            return
+        magic, version, ttl, origin, epoch, sequence, published = ENVELOPE.unpack_from(data)
+        if version != VERSION:
+            self.__simLogger.warning("Gossip - dropped a message of version " + str(version))
+            return
+        with self.__lock:
+            if not self.__isNew(origin, epoch, sequence):
+                self.duplicates += 1
+                return
+            self.received += 1
+            self.__latencies.append(time.time() - published)
+            del self.__latencies[:-100]
+        originAddress = socket.inet_ntoa(origin)
+        message = data[ENVELOPE.size:]
+        self.__inbox.append(message, originAddress)
+        if ttl > 1:
+            try:
+                fitness = peek_fitness(message)
+            except ValueError:
+                return
+            forward = ENVELOPE.pack(MAGIC, VERSION, ttl - 1, origin, epoch, sequence, published) + message
+            with self.__lock:
+                self.__pending[(origin, epoch, sequence)] = (fitness, forward, (sender, originAddress))
+
+    def stats(self):
+        """ Returns the counts of messages, the delivery latency in seconds of the last messages,
+            which needs the clocks of the robots to be synchronized, and the coverage of each
+            origin: the fraction of the messages it published since we first heard of it that
+            reached us.
+        """
+        with self.__lock:
+            coverage = dict()
+            for (origin, epoch), (first, last, count) in self.__coverage.iteritems():
+                if origin != self.__origin:
+                    coverage[socket.inet_ntoa(origin)] = count / float(last - first + 1)
+            return {'published': self.published, 'received': self.received, 'duplicates': self.duplicates,
+                    'sent': self.sent, 'coverage': coverage,
+                    'latency_mean': sum(self.__latencies) / len(self.__latencies) if self.__latencies else None,
+                    'latency_max': max(self.__latencies) if self.__latencies else None}
+
+    def __isNew(self, origin, epoch, sequence):
+        key = (origin, epoch, sequence)
+        if key in self.__seen:
+            return False
+        self.__seen[key] = True
+        if len(self.__seen) > SEEN_SIZE:
+            self.__seen.popitem(last=False)
+        first, last, count = self.__coverage.get((origin, epoch), (sequence, sequence, 0))
+        self.__coverage[(origin, epoch)] = (min(first, sequence), max(last, sequence), count + 1)
+        return True
+
+    def __send(self, data, exclude):
+        peers = [peer for peer in self.network.peers if peer not in exclude]
+        targets = self.__rng.sample(peers, min(self.fanout, len(peers)))
+        self.network.sendTo(data, targets)
+        with self.__lock:
+            self.sent += len(targets)
+        self.__simLogger.debug("Gossip - sent a message to " + str(targets))
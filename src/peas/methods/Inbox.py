@@ -1,25 +1,86 @@
 __author__ = 'alessandrozonta'
 
+import heapq
+import itertools
 import threading
 
+from genome_wire import peek_fitness
 
-# Represents a shared inbox object
+
+# Represents a shared inbox object: the genotype messages received, fittest first.
+# Only the latest message of each sender is kept, and the capacity fittest messages in all.
 class Inbox(object):
-    def __init__(self, simulationLogger):
+    def __init__(self, simulationLogger, capacity=32):
+        self.capacity = capacity
+        # heap of (-fitness, arrival, sender, message), entries of a sender that sent again are stale
         self.__inbox = list()
+        self.__latest = dict()
+        self.__arrivals = itertools.count()
         self.__inboxLock = threading.Lock()
         self.__simLogger = simulationLogger
+        self.dropped = 0
 
-    def append(self, data):
+    def __len__(self):
         with self.__inboxLock:
-            self.__inbox.append(data)
+            return min(sum(1 for entry in self.__inbox if self.__live(entry, self.__latest)), self.capacity)
 
-    def popAll(self):
-        itemsList = list()
+    def append(self, data, sender=None):
+        try:
+            fitness = peek_fitness(data)
+        except ValueError, e:
+            self.__simLogger.warning("Inbox - dropped a message" + (" from " + sender if sender else "") +
+                                     ": " + str(e))
+            return
         with self.__inboxLock:
-            for i in self.__inbox:
-                item = self.__inbox.pop(0)
-                # self.__simLogger.debug("popAll - message fitness = " + str(item.fitness))
-                itemsList.append(item)
-        # self.__simLogger.debug("popAll - Popped " + str(itemsList))
-        return itemsList
+            arrival = next(self.__arrivals)
+            if sender is not None:
+                self.__latest[sender] = arrival
+            heapq.heappush(self.__inbox, (-fitness, arrival, sender, data))
+            if len(self.__inbox) > 2 * self.capacity:
+                self.__compact()
+
+    def best(self):
+        """ Returns the fittest message, without taking it, or None.
+        """
+        messages = self.top_k(1)
+        return messages[0] if messages else None
+
+    def top_k(self, k):
+        """ Returns the k fittest messages, fittest first, without taking them.
+        """
+        with self.__inboxLock:
+            entries = self.__pop(self.__inbox, self.__latest, min(k, self.capacity))
+            for entry in entries:
+                heapq.heappush(self.__inbox, entry)
+        return [entry[3] for entry in entries]
+
+    def drain(self, k=None):
+        """ Takes all messages out of the inbox and returns the k fittest of
+            them, fittest first, or the capacity fittest if k is None.
+        """
+        with self.__inboxLock:
+            inbox, self.__inbox = self.__inbox, list()
+            latest, self.__latest = self.__latest, dict()
+        return [entry[3] for entry in self.__pop(inbox, latest, self.capacity if k is None else min(k, self.capacity))]
+
+    @staticmethod
+    def __live(entry, latest):
+        return entry[2] is None or latest.get(entry[2]) == entry[1]
+
+    @staticmethod
+    def __pop(inbox, latest, k):
+        # pops the k fittest live entries, the stale ones on top are thrown away
+        entries = list()
+        while inbox and len(entries) < k:
+            entry = heapq.heappop(inbox)
+            if Inbox.__live(entry, latest):
+                entries.append(entry)
+        return entries
+
+    def __compact(self):
+        live = [entry for entry in self.__inbox if self.__live(entry, self.__latest)]
+        if len(live) > self.capacity:
+            self.dropped += len(live) - self.capacity
+            live = heapq.nsmallest(self.capacity, live)
+        heapq.heapify(live)
+        self.__inbox = live
@@ -0,0 +1,184 @@
+import errno
+import os
+import random
+import select
+import socket
+import struct
+import sys
+import threading
+import time
+import traceback
+
+# A heartbeat: the epoch is drawn when the robot starts, a new one means it restarted.
+# The address of the robot is the source of the datagram.
+HEARTBEAT = struct.Struct('!2sBBI')
+MAGIC = 'MB'
+VERSION = 1
+# Sent every interval while the robot runs, and once when it stops
+HELLO, BYE = 0, 1
+
+GROUP = '239.42.42.42'
+PORT = 4243
+
+
+# Robots in the swarm, found by the heartbeats they multicast to the group: a robot joins when its
+# first heartbeat arrives and leaves when it says goodbye or no heartbeat came for timeout seconds.
+# onJoin and onLeave are called with its address from this thread, a robot that restarted leaves and
+# joins again. Robots on one host can run it with their own loopback addresses, 127.0.0.x.
+class Membership(threading.Thread):
+    def __init__(self, address, simulationLogger, onJoin=None, onLeave=None, group=GROUP, port=PORT, interval=1.0,
+                 timeout=3.5, ttl=1):
+        threading.Thread.__init__(self, name='Membership')
+        self.daemon = True
+        self.__address = address
+        self.__simLogger = simulationLogger
+        self.__onJoin = onJoin
+        self.__onLeave = onLeave
+        self.__group = group
+        self.__port = port
+        self.interval = interval
+        self.timeout = timeout
+        self.__epoch = random.getrandbits(32)
+        # address -> (epoch, time of its last heartbeat)
+        self.__members = dict()
+        self.__membersLock = threading.Lock()
+        self.__isStopped = threading.Event()
+        self.joined = 0
+        self.left = 0
+        self.heartbeats = 0
+
+        # all the robots of a host share the port, each joins the group on the interface of its address
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if hasattr(socket, 'SO_REUSEPORT'):
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        sock.bind(('', port))
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, socket.inet_aton(group) + socket.inet_aton(address))
+        sock.setblocking(0)
+        self.__receiver = sock
+
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, ttl)
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, socket.inet_aton(address))
+        # the other robots of this host hear it too
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+        sock.bind((address, 0))
+        self.__sender = sock
+        # written to wake up the loop when it is stopped
+        self.__wakeRead, self.__wakeWrite = os.pipe()
+
+    @property
+    def members(self):
+        with self.__membersLock:
+            return self.__members.keys()
+
+    def stats(self):
+        return {'members': len(self.members), 'joined': self.joined, 'left': self.left,
+                'heartbeats': self.heartbeats}
+
+    def stop(self):
+        self.__isStopped.set()
+        try:
+            os.write(self.__wakeWrite, 'x')
+        except OSError:
+            pass
+
+    def __stopped(self):
+        return self.__isStopped.isSet()
+
+    def run(self):
+        try:
+            self.__simLogger.debug('Membership - ' + self.__address + ' - RUNNING')
+            nextHeartbeat = 0.0
+            while not self.__stopped():
+                now = time.time()
+                if now >= nextHeartbeat:
+                    self.__announce(HELLO)
+                    nextHeartbeat = now + self.interval
+                readable, _, _ = select.select([self.__receiver, self.__wakeRead], [], [],
+                                               max(min(nextHeartbeat, self.__nextExpiry()) - now, 0))
+                if self.__receiver in readable:
+                    self.__receive()
+                self.__expire(time.time())
+            self.__announce(BYE)
+        except:
+            self.__simLogger.critical(
+                'Error in Membership: ' + str(sys.exc_info()[0]) + ' - ' + traceback.format_exc())
+        finally:
+            self.__close()
+        self.__simLogger.debug('Membership - STOPPED -> EXITING...')
+
+    def __announce(self, kind):
+        try:
+            self.__sender.sendto(HEARTBEAT.pack(MAGIC, VERSION, kind, self.__epoch), (self.__group, self.__port))
+        except socket.error, e:
+            # the network may be down for a while, the next heartbeat tries again
+            self.__simLogger.warning('Membership - Error while sending a heartbeat: ' + str(e))
+
+    def __receive(self):
+        while True:
+            try:
+                data, (addr, port) = self.__receiver.recvfrom(64)
+            except socket.error, e:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return
+                raise
+            if addr == self.__address:
+                continue
+            if len(data) != HEARTBEAT.size or data[:2] != MAGIC:
+                self.__simLogger.warning('Membership - Dropped a datagram from ' + addr)
+                continue
+            magic, version, kind, epoch = HEARTBEAT.unpack(data)
+            if version != VERSION:
+                self.__simLogger.warning('Membership - Dropped a heartbeat of version ' + str(version) + ' from ' +
+                                         addr)
+                continue
+            self.heartbeats += 1
+            self.__heard(addr, kind, epoch, time.time())
+
+    def __heard(self, addr, kind, epoch, now):
+        with self.__membersLock:
+            member = self.__members.get(addr)
+        if member is not None and (kind == BYE or member[0] != epoch):
+            self.__leave(addr, 'said goodbye' if kind == BYE else 'restarted')
+            member = None
+        if kind == BYE:
+            return
+        with self.__membersLock:
+            self.__members[addr] = (epoch, now)
+        if member is None:
+            self.joined += 1
+            self.__simLogger.info('Membership - ' + addr + ' - JOINED')
+            if self.__onJoin is not None:
+                self.__onJoin(addr)
+
+    def __leave(self, addr, reason):
+        with self.__membersLock:
+            del self.__members[addr]
+        self.left += 1
+        self.__simLogger.info('Membership - ' + addr + ' - LEFT, ' + reason)
+        if self.__onLeave is not None:
+            self.__onLeave(addr)
+
+    def __nextExpiry(self):
+        with self.__membersLock:
+            if not self.__members:
+                return float('inf')
+            return min(lastSeen for _, lastSeen in self.__members.itervalues()) + self.timeout
+
+    def __expire(self, now):
+        with self.__membersLock:
+            silent = [addr for addr, (_, lastSeen) in self.__members.iteritems() if now - lastSeen >= self.timeout]
+        for addr in silent:
+            self.__leave(addr, 'no heartbeat for ' + str(self.timeout) + ' seconds')
+
+    def __close(self):
+        try:
+            self.__receiver.setsockopt(socket.IPPROTO_IP, socket.IP_DROP_MEMBERSHIP,
+                                       socket.inet_aton(self.__group) + socket.inet_aton(self.__address))
+        except socket.error:
+            pass
+        self.__receiver.close()
+        self.__sender.close()
+        os.close(self.__wakeRead)
+        os.close(self.__wakeWrite)
@@ -0,0 +1,89 @@
+import heapq
+import threading
+from collections import deque
+
+from genome_wire import peek_fitness
+
+# What is kept when the outbox is full: the latest messages, or those of the fittest genotypes
+LATEST, BEST = 'latest', 'best'
+
+
+# Messages waiting to be sent to one peer, at most capacity of them. A message equal to one that
+# is already waiting is coalesced with it, so a champion that did not change is sent once.
+class Outbox(object):
+    def __init__(self, capacity=3, policy=LATEST):
+        if policy not in (LATEST, BEST):
+            raise ValueError("Unknown outbox policy %r" % policy)
+        if capacity < 1:
+            raise ValueError("An outbox holds at least one message")
+        self.capacity = capacity
+        self.policy = policy
+        # in order of arrival for LATEST, a heap of (fitness, arrival, message) for BEST, least fit first
+        self.__messages = deque() if policy == LATEST else []
+        self.__arrivals = 0
+        self.__lock = threading.Lock()
+        self.dropped = 0
+        self.coalesced = 0
+        self.sent = 0
+
+    def __len__(self):
+        return len(self.__messages)
+
+    def append(self, message):
+        with self.__lock:
+            if message in self.__contents():
+                self.coalesced += 1
+                return
+            self.__add(message, self.__arrivals)
+            self.__arrivals += 1
+
+    def restore(self, message):
+        """ Puts back a message that could not be sent, it is sent first again
+            unless newer or fitter messages fill the outbox.
+        """
+        with self.__lock:
+            if message in self.__contents():
+                self.coalesced += 1
+            elif self.policy == LATEST:
+                if len(self.__messages) < self.capacity:
+                    self.__messages.appendleft(message)
+                else:
+                    self.dropped += 1
+            else:
+                self.__add(message, -1)
+
+    def pop(self):
+        """ Returns the next message to send, the oldest one for LATEST and the
+            fittest one for BEST, or None if there is none.
+        """
+        with self.__lock:
+            if not self.__messages:
+                return None
+            if self.policy == LATEST:
+                return self.__messages.popleft()
+            best = max(self.__messages)
+            self.__messages.remove(best)
+            heapq.heapify(self.__messages)
+            return best[2]
+
+    def stats(self):
+        return {'waiting': len(self.__messages), 'dropped': self.dropped, 'coalesced': self.coalesced,
+                'sent': self.sent}
+
+    def __contents(self):
+        if self.policy == LATEST:
+            return self.__messages
+        return [message for _, _, message in self.__messages]
+
+    def __add(self, message, arrival):
+        if self.policy == LATEST:
+            if len(self.__messages) == self.capacity:
+                self.__messages.popleft()
+                self.dropped += 1
+            self.__messages.append(message)
+        elif len(self.__messages) < self.capacity:
+            heapq.heappush(self.__messages, (peek_fitness(message), arrival, message))
+        else:
+            # the least fit of the waiting messages and this one is dropped
+            heapq.heappushpop(self.__messages, (peek_fitness(message), arrival, message))
+            self.dropped += 1
@@ -0,0 +1,351 @@
+import errno
+import os
+import select
+import socket
+import struct
+import sys
+import threading
+import time
+import traceback
+
+from genome_wire import MAX_MESSAGE_SIZE
+from Outbox import Outbox, LATEST
+
+# Delays before a new attempt to connect to a peer that could not be reached, doubled up to the maximum
+RECONNECT_DELAY = 0.1
+MAX_RECONNECT_DELAY = 5.0
+LENGTH = struct.Struct('!I')
+
+DISCONNECTED, CONNECTING, CONNECTED = 'disconnected', 'connecting', 'connected'
+
+
+# Outgoing connection and outbox of one peer, and the connection it opened to us
+class Peer(object):
+    def __init__(self, ipAddress, outboxCapacity, outboxPolicy):
+        self.ipAddress = ipAddress
+        self.outbox = Outbox(outboxCapacity, outboxPolicy)
+        self.state = DISCONNECTED
+        self.socket = None
+        # bytes of the message being sent, and the message to put back if the connection breaks
+        self.sendBuffer = ''
+        self.sending = None
+        self.reconnectDelay = RECONNECT_DELAY
+        self.nextAttempt = 0.0
+        self.attempts = 0
+        self.received = 0
+        self.lastSent = 0.0
+        self.incoming = None
+
+
+# Incoming connection of a peer, its bytes are collected until a whole message is in
+class Incoming(object):
+    def __init__(self, sock, peer):
+        self.socket = sock
+        self.peer = peer
+        self.buffer = ''
+
+
+# Connections to all peers, served by one thread: it connects and reconnects without blocking,
+# sends the outbox of each peer and puts the messages received in the shared inbox.
+# While a peer is down, its outbox keeps the latest or the fittest outboxCapacity messages.
+# Peers are added and removed while it runs, as robots join and leave the swarm, and a robot that
+# connects to it becomes a peer.
+# Each message is prefixed by its length, as the robots always sent them.
+class PeerNetwork(threading.Thread):
+    def __init__(self, address, port, peers, inbox, simulationLogger, outboxCapacity=3, outboxPolicy=LATEST,
+                 idleTimeout=None):
+        threading.Thread.__init__(self, name='PeerNetwork')
+        self.daemon = True
+        self.__address = address
+        self.__port = port
+        self.__inbox = inbox
+        self.__simLogger = simulationLogger
+        self.__outboxCapacity = outboxCapacity
+        self.__outboxPolicy = outboxPolicy
+        self.__peers = dict((ipAddress, Peer(ipAddress, outboxCapacity, outboxPolicy)) for ipAddress in peers)
+        self.__peersLock = threading.Lock()
+        # peers removed since the last step, their connections are closed by the loop
+        self.__removed = list()
+        self.__incoming = dict()
+        self.__isStopped = threading.Event()
+        # connections we opened are closed after this many seconds without sending, if it is set
+        self.__idleTimeout = idleTimeout
+
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((address, port))
+        # all the robots may connect at once when a generation ends
+        sock.listen(socket.SOMAXCONN)
+        sock.setblocking(0)
+        self.__listener = sock
+        # written to wake up the loop when a message is added or it is stopped
+        self.__wakeRead, self.__wakeWrite = os.pipe()
+
+    @property
+    def peers(self):
+        with self.__peersLock:
+            return self.__peers.keys()
+
+    def addPeer(self, ipAddress):
+        with self.__peersLock:
+            if ipAddress in self.__peers:
+                return
+            self.__peers[ipAddress] = Peer(ipAddress, self.__outboxCapacity, self.__outboxPolicy)
+        self.__simLogger.debug('PeerNetwork - ' + ipAddress + ' - ADDED peer')
+
+    def removePeer(self, ipAddress):
+        """ Forgets a peer, the messages waiting for it are dropped and its
+            connections closed.
+        """
+        with self.__peersLock:
+            peer = self.__peers.pop(ipAddress, None)
+            if peer is None:
+                return
+            self.__removed.append(peer)
+        self.__simLogger.debug('PeerNetwork - ' + ipAddress + ' - REMOVED peer')
+        self.__wake()
+
+    def send(self, message):
+        self.sendTo(message, self.peers)
+
+    def sendTo(self, message, peers):
+        with self.__peersLock:
+            # a peer may have left since the list was taken
+            outboxes = [self.__peers[ipAddress].outbox for ipAddress in peers if ipAddress in self.__peers]
+        for outbox in outboxes:
+            outbox.append(message)
+        self.__wake()
+
+    def stats(self):
+        stats = dict()
+        with self.__peersLock:
+            peers = self.__peers.values()
+        for peer in peers:
+            stats[peer.ipAddress] = dict(peer.outbox.stats(), state=peer.state, received=peer.received,
+                                         attempts=peer.attempts)
+        return stats
+
+    def stop(self):
+        self.__isStopped.set()
+        self.__wake()
+
+    def __wake(self):
+        try:
+            os.write(self.__wakeWrite, 'x')
+        except OSError:
+            pass
+
+    def __stopped(self):
+        return self.__isStopped.isSet()
+
+    def run(self):
+        try:
+            self.__simLogger.debug('PeerNetwork - ' + self.__address + ' - RUNNING')
+            while not self.__stopped():
+                self.__step()
+        except:
+            self.__simLogger.critical(
+                'Error in PeerNetwork: ' + str(sys.exc_info()[0]) + ' - ' + traceback.format_exc())
+        finally:
+            self.__close()
+        self.__simLogger.debug('PeerNetwork - STOPPED -> EXITING...')
+
+    def __step(self):
+        with self.__peersLock:
+            peers = self.__peers.values()
+            removed, self.__removed = self.__removed, list()
+        for peer in removed:
+            self.__forget(peer)
+        now = time.time()
+        timeout = 1.0
+        readable = [self.__listener, self.__wakeRead]
+        writable = []
+        for peer in peers:
+            # connects only when there is something to send
+            if peer.state == DISCONNECTED and (peer.outbox or peer.sending is not None):
+                if peer.nextAttempt <= now:
+                    self.__connect(peer, now)
+                else:
+                    timeout = min(timeout, peer.nextAttempt - now)
+            if peer.state == CONNECTING:
+                writable.append(peer.socket)
+            elif peer.state == CONNECTED:
+                if peer.sendBuffer or self.__takeMessage(peer):
+                    writable.append(peer.socket)
+                elif self.__idleTimeout is not None and now - peer.lastSent > self.__idleTimeout:
+                    self.__disconnect(peer, 'idle', warn=False)
+                    # it is not down, the next message connects again at once
+                    peer.nextAttempt = 0.0
+                    peer.reconnectDelay = RECONNECT_DELAY
+                    continue
+                # read to notice when the peer closes the connection
+                readable.append(peer.socket)
+        readable.extend(self.__incoming.keys())
+
+        readable, writable, _ = select.select(readable, writable, [], max(timeout, 0))
+        sockets = dict((peer.socket, peer) for peer in peers if peer.socket is not None)
+
+        for sock in readable:
+            if sock is self.__wakeRead:
+                os.read(self.__wakeRead, 4096)
+            elif sock is self.__listener:
+                self.__accept()
+            elif sock in self.__incoming:
+                self.__receive(self.__incoming[sock])
+            elif sock in sockets:
+                # peers do not send on the connections we opened, this is a close or an error
+                self.__disconnect(sockets[sock], 'closed by the peer', warn=False)
+        for sock in writable:
+            peer = sockets.get(sock)
+            if peer is None or peer.socket is not sock:
+                continue
+            if peer.state == CONNECTING:
+                self.__connected(peer)
+            elif peer.state == CONNECTED:
+                self.__send(peer)
+
+    def __connect(self, peer, now):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        # from our address, the peer knows us by it
+        sock.bind((self.__address, 0))
+        sock.setblocking(0)
+        peer.attempts += 1
+        error = sock.connect_ex((peer.ipAddress, self.__port))
+        if error in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+            peer.socket = sock
+            peer.state = CONNECTING
+        else:
+            sock.close()
+            self.__retryLater(peer, now)
+
+    def __connected(self, peer):
+        error = peer.socket.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+        if error:
+            peer.socket.close()
+            peer.socket = None
+            peer.state = DISCONNECTED
+            self.__retryLater(peer, time.time())
+            return
+        peer.state = CONNECTED
+        peer.lastSent = time.time()
+        peer.reconnectDelay = RECONNECT_DELAY
+        self.__simLogger.debug('PeerNetwork - ' + peer.ipAddress + ' - CONNECTED @ attempt ' + str(peer.attempts))
+
+    def __retryLater(self, peer, now):
+        peer.nextAttempt = now + peer.reconnectDelay
+        peer.reconnectDelay = min(peer.reconnectDelay * 2, MAX_RECONNECT_DELAY)
+
+    def __disconnect(self, peer, reason, warn=True):
+        log = self.__simLogger.warning if warn else self.__simLogger.debug
+        log('PeerNetwork - ' + peer.ipAddress + ' - ' + reason + ' - CLOSED socket')
+        peer.socket.close()
+        peer.socket = None
+        peer.state = DISCONNECTED
+        # the message being sent is sent again on the next connection
+        if peer.sending is not None:
+            peer.outbox.restore(peer.sending)
+            peer.sending = None
+            peer.sendBuffer = ''
+        self.__retryLater(peer, time.time())
+
+    def __takeMessage(self, peer):
+        peer.sending = peer.outbox.pop()
+        if peer.sending is None:
+            return False
+        peer.sendBuffer = LENGTH.pack(len(peer.sending)) + peer.sending
+        return True
+
+    def __send(self, peer):
+        try:
+            sent = peer.socket.send(peer.sendBuffer)
+        except socket.error, e:
+            if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return
+            self.__disconnect(peer, 'Error while sending: ' + str(e))
+            return
+        peer.sendBuffer = peer.sendBuffer[sent:]
+        if not peer.sendBuffer:
+            peer.lastSent = time.time()
+            peer.outbox.sent += 1
+            peer.sending = None
+            self.__simLogger.debug('PeerNetwork - ' + peer.ipAddress + ' - SENT message ' + str(peer.outbox.sent))
+
+    def __accept(self):
+        try:
+            conn, (addr, port) = self.__listener.accept()
+        except socket.error:
+            return
+        with self.__peersLock:
+            peer = self.__peers.get(addr)
+        if peer is None:
+            # a robot may hear of us before we hear of it, it becomes a peer we send to as well
+            self.__simLogger.info('PeerNetwork - Received connection from unknown ' + addr + ' - ADDING peer')
+            self.addPeer(addr)
+            with self.__peersLock:
+                peer = self.__peers[addr]
+        conn.setblocking(0)
+        # a peer that reconnects replaces its old connection, which may not have noticed it broke
+        if peer.incoming is not None:
+            self.__closeIncoming(peer.incoming)
+        peer.incoming = Incoming(conn, peer)
+        self.__incoming[conn] = peer.incoming
+        self.__simLogger.debug('PeerNetwork - ' + addr + ' - ACCEPTED connection')
+
+    def __receive(self, incoming):
+        try:
+            data = incoming.socket.recv(65536)
+        except socket.error, e:
+            if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return
+            data = ''
+        if not data:
+            self.__simLogger.debug('PeerNetwork - ' + incoming.peer.ipAddress + ' - incoming connection CLOSED')
+            self.__closeIncoming(incoming)
+            return
+        incoming.buffer += data
+        while len(incoming.buffer) >= LENGTH.size:
+            length, = LENGTH.unpack_from(incoming.buffer)
+            if length > MAX_MESSAGE_SIZE:
+                self.__simLogger.warning('PeerNetwork - ' + incoming.peer.ipAddress + ' - Message of ' +
+                                         str(length) + ' bytes is too large - CLOSING socket')
+                self.__closeIncoming(incoming)
+                return
+            if len(incoming.buffer) < LENGTH.size + length:
+                break
+            message = incoming.buffer[LENGTH.size:LENGTH.size + length]
+            incoming.buffer = incoming.buffer[LENGTH.size + length:]
+            incoming.peer.received += 1
+            self.__inbox.append(message, incoming.peer.ipAddress)
+            self.__simLogger.debug('PeerNetwork - ' + incoming.peer.ipAddress + ' - Appended ' +
+                                   str(length) + ' bytes to inbox.')
+
+    def __closeIncoming(self, incoming):
+        incoming.socket.close()
+        del self.__incoming[incoming.socket]
+        if incoming.peer.incoming is incoming:
+            incoming.peer.incoming = None
+
+    def __forget(self, peer):
+        if peer.socket is not None:
+            peer.socket.close()
+            peer.socket = None
+        peer.state = DISCONNECTED
+        peer.sending = None
+        peer.sendBuffer = ''
+        if peer.incoming is not None:
+            self.__closeIncoming(peer.incoming)
+
+    def __close(self):
+        for incoming in self.__incoming.values():
+            incoming.socket.close()
+        self.__incoming.clear()
+        with self.__peersLock:
+            peers = self.__peers.values() + self.__removed
+        for peer in peers:
+            if peer.socket is not None:
+                peer.socket.close()
+                peer.socket = None
+            peer.state = DISCONNECTED
+        self.__listener.close()
+        os.close(self.__wakeRead)
+        os.close(self.__wakeWrite)
@@ -7,8 +7,10 @@
 ### IMPORTS ###
 import sys
 import random
+import inspect
 import multiprocessing
 from copy import deepcopy
+from contextlib import contextmanager
 from itertools import product
 from collections import defaultdict
 
@@ -22,18 +24,88 @@ np.seterr(over='warn', divide='raise')
 rand = random.random
 inf  = float('inf')
 
+# What a random stream is drawn for, the first part of its key
+BIRTH, EVALUATE, SPECIATE, REPRODUCE = range(4)
+
 ### FUNCTIONS ###
 
-def evaluate_individual((individual, evaluator)):
+def rng_stream(seed, *key):
+    """ Returns a numpy RandomState for the given root seed and key,
+        e.g. (generation, species, slot). Different keys give independent
+        streams, the same key always gives the same stream.
+    """
+    return np.random.RandomState([seed] + [k % (2**32) for k in key])
+
+@contextmanager
+def seeded_globals(rng):
+    """ Seeds the module-level generators of random and numpy.random 
+        from the given stream, for code that does not take a stream,
+        and restores their state when it is done.
+    """
+    state = random.getstate(), np.random.get_state()
+    random.seed(rng.randint(2**31))
+    np.random.seed(rng.randint(2**31))
+    try:
+        yield
+    finally:
+        random.setstate(state[0])
+        np.random.set_state(state[1])
+
+def takes_rng(func):
+    """ Whether the function or method takes an rng argument. """
+    if not (inspect.isfunction(func) or inspect.ismethod(func)):
+        func = getattr(func, '__call__', None)
+        if not inspect.ismethod(func):
+            return False
+    return 'rng' in inspect.getargspec(func).args
+
+def choice(seq, rng):
+    """ Like random.choice, drawn from the given numpy stream. """
+    return seq[rng.randint(len(seq))]
+
+def sample(population, k, rng):
+    """ Like random.sample, drawn from the given numpy stream. """
+    return [population[i] for i in rng.permutation(len(population))[:k]]
+
+def evaluate(individual, evaluator, seed=None):
+    """ Returns the stats of the individual, as computed by the evaluator. 
+        If a seed is given, the evaluation draws from a stream seeded with
+        it, so it does not depend on the process it runs in. The stream is 
+        passed to evaluators that take an rng, others are run with the 
+        global generators seeded from it.
+    """
     if callable(evaluator):
-        individual.stats = evaluator(individual)
+        func = evaluator
     elif hasattr(evaluator, 'evaluate'):
-        individual.stats = evaluator.evaluate(individual)
+        func = evaluator.evaluate
     else:
         raise Exception("Evaluator must be a callable or object" \
                         "with a callable attribute 'evaluate'.")
+    if seed is None:
+        return func(individual)
+    rng = np.random.RandomState(seed)
+    if takes_rng(func):
+        return func(individual, rng=rng)
+    with seeded_globals(rng):
+        return func(individual)
+
+def evaluate_individual((individual, evaluator)):
+    individual.stats = evaluate(individual, evaluator)
     return individual
 
+# The evaluator of a worker process, it is set once when the worker starts.
+worker_evaluator = None
+
+def init_worker(evaluator):
+    global worker_evaluator
+    worker_evaluator = evaluator
+
+def evaluate_in_worker((index, individual, seed)):
+    """ Evaluates an individual with the worker's evaluator, only
+        the index and the stats are sent back.
+    """
+    return index, evaluate(individual, worker_evaluator, seed)
+
 
 ### CLASSES ###
                 
@@ -45,7 +117,8 @@ class SimplePopulation(object):
                        stop_when_solved=False, 
                        tournament_selection_k=3,
                        verbose=True,
-                       max_cores=1):
+                       max_cores=1,
+                       seed=None):
         # Instance properties
         self.geno_factory           = geno_factory
         self.popsize                = popsize
@@ -54,13 +127,13 @@ class SimplePopulation(object):
         self.tournament_selection_k = tournament_selection_k
         self.verbose                = verbose
         self.max_cores              = max_cores
+        self.seed                   = seed
 
         cpus = multiprocessing.cpu_count()
-        use_cores = min(self.max_cores, cpus-1)
-        if use_cores > 1:
-            self.pool = multiprocessing.Pool(processes=use_cores, maxtasksperchild=5)
-        else:
-            self.pool = None
+        self.use_cores = min(self.max_cores, cpus-1)
+        # Worker pool, started for an evaluator on its first use
+        self.pool = None
+        self.pool_evaluator = None
         
     def _reset(self):
         """ Resets the state of this population.
@@ -72,31 +145,47 @@ class SimplePopulation(object):
         self.generation = 0
         self.solved_at  = None
         self.stats = defaultdict(list)
+        self._reset_seed()
+
+    def _reset_seed(self):
+        """ Picks the root seed that all random streams of a run are derived 
+            from, a fresh one for each run unless a seed was given.
+        """
+        self.root_seed = self.seed if self.seed is not None else random.randrange(2**31)
+
+    def _stream(self, *key):
+        """ The random stream for the given key in the current generation. """
+        return rng_stream(self.root_seed, self.generation, *key)
                 
     def epoch(self, evaluator, generations, solution=None, reset=True, callback=None):
         """ Runs an evolutionary epoch 
 
             :param evaluator:    Either a function or an object with a function
                                  named 'evaluate' that returns a given individual's
-                                 fitness.
+                                 fitness, or with a function 'evaluate_all' that 
+                                 returns the stats of a list of individuals.
             :param callback:     Function that is called at the end of each generation.
         """
         if reset:
             self._reset()
         
-        for _ in xrange(generations):
-            self._evolve(evaluator, solution)
+        try:
+            for _ in xrange(generations):
+                self._evolve(evaluator, solution)
 
-            self.generation += 1
+                self.generation += 1
 
-            if self.verbose:
-                self._status_report()
-            
-            if callback is not None:
-                callback(self)
+                if self.verbose:
+                    self._status_report()
                 
-            if self.solved_at is not None and self.stop_when_solved:
-                break
+                if callback is not None:
+                    callback(self)
+                    
+                if self.solved_at is not None and self.stop_when_solved:
+                    break
+        finally:
+            # The workers do not outlive the epoch.
+            self._stop_pool()
                 
         return {'stats': self.stats, 'champions': self.champions}
         
@@ -118,24 +207,76 @@ class SimplePopulation(object):
             current population otherwise.
         """
         while len(self.population) < self.popsize:
-            individual = self.geno_factory()
+            individual = self._create(len(self.population))
             self.population.append(individual)
         
         return self.population
+
+    def _create(self, slot):
+        """ Creates a new individual with the geno_factory, from the stream of 
+            the given slot, so any factory is reproducible. A factory that does
+            not take an rng is run with the global generators seeded from it.
+        """
+        rng = self._stream(BIRTH, slot)
+        if takes_rng(self.geno_factory):
+            return self.geno_factory(rng=rng)
+        with seeded_globals(rng):
+            return self.geno_factory()
         
     def _evaluate_all(self, pop, evaluator):
         """ Evaluates all of the individuals in given pop,
             and assigns their "stats" property.
         """
-        to_eval = [(individual, evaluator) for individual in pop]
-        if self.pool is not None:
+        # Each individual is evaluated with its own seed, that does not
+        # depend on which process evaluates it, or in what order.
+        rng = self._stream(EVALUATE)
+        if hasattr(evaluator, 'evaluate_all'):
+            # The evaluator takes the whole population at once, e.g. to
+            # simulate all individuals in lockstep.
+            if takes_rng(evaluator.evaluate_all):
+                all_stats = evaluator.evaluate_all(pop, rng=rng)
+            else:
+                with seeded_globals(rng):
+                    all_stats = evaluator.evaluate_all(pop)
+            for individual, stats in zip(pop, all_stats):
+                individual.stats = stats
+            return pop
+        seeds = rng.randint(2**31, size=len(pop))
+        if self.use_cores > 1:
+            if self.pool is None or self.pool_evaluator is not evaluator:
+                self._start_pool(evaluator)
             print "Running in %d processes." % self.pool._processes
-            pop = self.pool.map(evaluate_individual, to_eval)
+            # Only the individuals are sent to the workers, in chunks, and 
+            # their stats are assigned back by index, so the order is kept.
+            chunksize = max(1, len(pop) // (4 * self.use_cores))
+            for index, stats in self.pool.imap_unordered(evaluate_in_worker, zip(xrange(len(pop)), pop, seeds), chunksize):
+                # Interned keys, like those of stats computed in this process,
+                # so champions pickle to the same bytes in serial runs.
+                pop[index].stats = dict((intern(key), value) for key, value in stats.iteritems())
         else:
             print "Running in single process."
-            pop = map(evaluate_individual, to_eval)
+            for individual, seed in zip(pop, seeds):
+                individual.stats = evaluate(individual, evaluator, seed)
         
         return pop
+
+    def _start_pool(self, evaluator):
+        """ Starts a pool of worker processes that hold on to the evaluator,
+            so it is passed once per worker instead of once per individual.
+            The pool lasts for one epoch, its workers keep the evaluator as
+            it was when the epoch started.
+        """
+        self._stop_pool()
+        self.pool = multiprocessing.Pool(processes=self.use_cores, 
+                                         initializer=init_worker, initargs=(evaluator,))
+        self.pool_evaluator = evaluator
+
+    def _stop_pool(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+        self.pool = None
+        self.pool_evaluator = None
     
     def _find_best(self, pop, solution=None):
         """ Finds the best individual, and adds it to the champions, also 
@@ -168,10 +309,11 @@ class SimplePopulation(object):
             newpop.append(self.champions[-1])
             
         while len(newpop) < self.popsize:
+            rng = self._stream(REPRODUCE, len(newpop))
             # Perform tournament selection
             k = min(self.tournament_selection_k, len(pop))
-            winner = max(random.sample(pop, k), key=lambda ind:ind.stats['fitness'])
-            winner = deepcopy(winner).mutate()
+            winner = max(sample(pop, k, rng), key=lambda ind:ind.stats['fitness'])
+            winner = deepcopy(winner).mutate(rng=rng)
             newpop.append(winner)
             
         return newpop
@@ -0,0 +1,145 @@
+""" Binary encoding of the genes of an odNEAT genotype, as the Distributor
+    sends champions to the other robots. Only the node and connection genes
+    and the fitness are sent, the receiver takes the other settings from a
+    genotype of its own. Decoding does not run any code from the message,
+    unlike unpickling.
+
+    A message is a header, followed by the genes, compressed with zlib if
+    the flag is set:
+
+        header   !2sBBd    magic 'OG', version, flags, fitness
+        genes    !HHB      number of nodes, connections and node types
+                 type      !B length, followed by the name, for each type
+                 node      !dBddQ fforder, type index, bias, response, layer
+                 conn      !ddddB innovation, from, to, weight, flags
+"""
+
+### IMPORTS ###
+import struct
+import zlib
+from copy import copy
+
+### CONSTANTS ###
+
+MAGIC = 'OG'
+# Increase when the layout changes, older messages are refused
+VERSION = 1
+COMPRESSED = 0x01
+# Messages are refused above this size, also after decompression
+MAX_MESSAGE_SIZE = 1 << 20
+
+HEADER = struct.Struct('!2sBBd')
+COUNTS = struct.Struct('!HHB')
+NODE = '!dBddQ'
+CONN = '!ddddB'
+NODE_SIZE = struct.calcsize(NODE)
+CONN_SIZE = struct.calcsize(CONN)
+
+# Flags of a connection gene: enabled, and whether its numbers are floats,
+# they are kept as the same type they were on the sending robot.
+ENABLED, INNOV_FLOAT, FROM_FLOAT, TO_FLOAT = 0x01, 0x02, 0x04, 0x08
+
+### FUNCTIONS ###
+
+def encode_genotype(genotype, compress=False):
+    """ Returns the message of the genes and fitness of the genotype.
+    """
+    types = sorted(set(node[1] for node in genotype.node_genes))
+    type_index = dict((name, i) for i, name in enumerate(types))
+    nodes = []
+    for fforder, node_type, bias, response, layer in genotype.node_genes:
+        nodes.extend((fforder, type_index[node_type], bias, response, layer))
+    conns = []
+    for innov, fr, to, weight, enabled in genotype.conn_genes.itervalues():
+        flags = ((ENABLED if enabled else 0) |
+                 (INNOV_FLOAT if isinstance(innov, float) else 0) |
+                 (FROM_FLOAT if isinstance(fr, float) else 0) |
+                 (TO_FLOAT if isinstance(to, float) else 0))
+        conns.extend((innov, fr, to, weight, flags))
+
+    genes = [COUNTS.pack(len(genotype.node_genes), len(genotype.conn_genes), len(types))]
+    for name in types:
+        genes.append(struct.pack('!B', len(name)) + name)
+    genes.append(struct.pack('!' + NODE[1:] * len(genotype.node_genes), *nodes))
+    genes.append(struct.pack('!' + CONN[1:] * len(genotype.conn_genes), *conns))
+    genes = ''.join(genes)
+
+    flags = 0
+    if compress:
+        genes = zlib.compress(genes)
+        flags |= COMPRESSED
+    fitness = genotype.stats.get('fitness', 0.0) if getattr(genotype, 'stats', None) else 0.0
+    return HEADER.pack(MAGIC, VERSION, flags, fitness) + genes
+
+def peek_fitness(data):
+    """ Returns the fitness of a message, without decoding its genes.
+    """
+    return _header(data)[2]
+
+def decode_genotype(data, template):
+    """ Returns a genotype with the genes and fitness of the message, and the
+        other settings of the template genotype. Raises ValueError if the
+        message is malformed.
+    """
+    _, flags, fitness = _header(data)
+    genes = buffer(data, HEADER.size)
+    if flags & COMPRESSED:
+        # A byte is added after the stream, it is left over only if the stream is complete
+        decompressor = zlib.decompressobj()
+        try:
+            genes = decompressor.decompress(str(genes) + '\0', MAX_MESSAGE_SIZE)
+        except zlib.error, e:
+            raise ValueError("Genome message does not decompress: %s" % e)
+        if decompressor.unconsumed_tail:
+            raise ValueError("Genome message is too large")
+        if decompressor.unused_data != '\0':
+            raise ValueError("Genome message is %s" % ('truncated' if not decompressor.unused_data else
+                                                        'followed by other data'))
+
+    try:
+        n_nodes, n_conns, n_types = COUNTS.unpack_from(genes)
+        offset = COUNTS.size
+        types = []
+        for _ in xrange(n_types):
+            length, = struct.unpack_from('!B', genes, offset)
+            types.append(str(genes[offset + 1:offset + 1 + length]))
+            offset += 1 + length
+        if len(genes) != offset + n_nodes * NODE_SIZE + n_conns * CONN_SIZE:
+            raise ValueError("Genome message has %d bytes, its counts need %d" %
+                             (len(genes), offset + n_nodes * NODE_SIZE + n_conns * CONN_SIZE))
+        nodes = struct.unpack_from('!' + NODE[1:] * n_nodes, genes, offset)
+        conns = struct.unpack_from('!' + CONN[1:] * n_conns, genes, offset + n_nodes * NODE_SIZE)
+    except struct.error, e:
+        raise ValueError("Genome message is truncated: %s" % e)
+
+    node_genes = []
+    for i in xrange(0, len(nodes), 5):
+        fforder, type_index, bias, response, layer = nodes[i:i + 5]
+        if type_index >= n_types:
+            raise ValueError("Genome message has an unknown node type %d" % type_index)
+        node_genes.append([fforder, types[type_index], bias, response, layer])
+    conn_genes = {}
+    for i in xrange(0, len(conns), 5):
+        innov, fr, to, weight, conn_flags = conns[i:i + 5]
+        innov = innov if conn_flags & INNOV_FLOAT else int(innov)
+        fr = fr if conn_flags & FROM_FLOAT else int(fr)
+        to = to if conn_flags & TO_FLOAT else int(to)
+        conn_genes[(fr, to)] = [innov, fr, to, weight, bool(conn_flags & ENABLED)]
+
+    # The settings are shared with the template, the genes are new
+    genotype = copy(template)
+    genotype.node_genes = node_genes
+    genotype.conn_genes = conn_genes
+    genotype.stats = {'fitness': fitness}
+    genotype.mutation_generation = 0
+    return genotype
+
+def _header(data):
+    if len(data) < HEADER.size:
+        raise ValueError("Genome message is too short")
+    magic, version, flags, fitness = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError("Not a genome message")
+    if version != VERSION:
+        raise ValueError("Genome message version %d, expected %d" % (version, VERSION))
+    return version, flags, fitness
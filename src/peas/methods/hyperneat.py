@@ -106,6 +106,26 @@ class Substrate(object):
 
         return self._connection_list
 
+    def get_connection_arrays(self, add_deltas):
+        """ Returns the connection list as arrays, for querying
+            all connections at once: a tuple of (from, to, coords,
+            connection_ids, expression_ids, has_expression), where coords
+            has a row per connection and has_expression is False for
+            connections without a link expression node.
+            Built only once, like the connection list.
+        """
+        if not hasattr(self, '_connection_arrays'):
+            conns = self.get_connection_list(add_deltas)
+            fr = np.array([i for ((i, j), _, _, _) in conns], dtype=int)
+            to = np.array([j for ((i, j), _, _, _) in conns], dtype=int)
+            coords = np.array([coords for (_, coords, _, _) in conns])
+            conn_ids = np.array([conn_id for (_, _, conn_id, _) in conns], dtype=int)
+            has_expr = np.array([expr_id is not None for (_, _, _, expr_id) in conns], dtype=bool)
+            expr_ids = np.array([expr_id or 0 for (_, _, _, expr_id) in conns], dtype=int)
+            self._connection_arrays = (fr, to, coords, conn_ids, expr_ids, has_expr)
+
+        return self._connection_arrays
+
 class HyperNEATDeveloper(object):
     
     """ HyperNEAT developer object."""
@@ -146,6 +166,8 @@ class HyperNEATDeveloper(object):
         # Cast input to a neuralnetwork if it isn't
         if not isinstance(network, NeuralNetwork):
             network = NeuralNetwork(network)
+            if network.feedforward:
+                network.make_sparse()
             
         # Since Stanley mentions to "fully activate" the CPPN,
         # I assume this means it's a feedforward net, since otherwise
@@ -163,15 +185,14 @@ class HyperNEATDeveloper(object):
         # Initialize connectivity matrix
         cm = np.zeros((self.substrate.num_nodes, self.substrate.num_nodes))
             
-        for (i,j), coords, conn_id, expr_id in self.substrate.get_connection_list(self.add_deltas):                
-            expression = True
-            if expr_id is not None:
-                network.flush()
-                expression = network.feed(coords, self.activation_steps)[expr_id] > 0
-            if expression:
-                network.flush()
-                weight = network.feed(coords, self.activation_steps)[conn_id]
-                cm[j, i] = weight
+        # Query the CPPN for all connections at once, the link expression
+        # and the weight are read from the same activation.
+        fr, to, coords, conn_ids, expr_ids, has_expr = self.substrate.get_connection_arrays(self.add_deltas)
+        if len(fr):
+            act = network.feed_batch(coords, self.activation_steps)
+            rows = np.arange(len(fr))
+            expression = ~has_expr | (act[rows, expr_ids] > 0)
+            cm[to[expression], fr[expression]] = act[rows, conn_ids][expression]
         
         # Rescale the CM
         cm[np.abs(cm) < self.min_weight] = 0
@@ -17,16 +17,82 @@ import numpy as np
 np.seterr(over='warn', divide='raise')
 
 # Package
-from .evolution import SimplePopulation
+from .evolution import SimplePopulation, choice, sample, SPECIATE, REPRODUCE
 from ..networks.rnn import NeuralNetwork
 
 # Shortcuts
 rand = random.random
 inf  = float('inf')
 
+# Packed gene records of CompactNEATGenotype
+NODE_DTYPE = np.dtype([('fforder', '<f8'), ('node_type', '<i2'), ('bias', '<f8'), 
+                       ('response', '<f8'), ('layer', '<i8')])
+CONN_DTYPE = np.dtype([('innov', '<i8'), ('conn_from', '<i4'), ('conn_to', '<i4'), 
+                       ('weight', '<f8'), ('enabled', '?')])
+
+
+### FUNCTIONS ###
+
+def match_sorted(a, b):
+    """ Merge-joins two sorted arrays of unique values, returns the 
+        positions in a and in b of the values they have in common.
+    """
+    if len(a) == 0 or len(b) == 0:
+        return np.zeros(0, dtype=int), np.zeros(0, dtype=int)
+    pos = np.searchsorted(b, a)
+    pos[pos == len(b)] = 0
+    found = (b[pos] == a)
+    return np.flatnonzero(found), pos[found]
+
 
 ### CLASSES ###
-                
+
+class InnovationRegistry(object):
+    """ Hands out innovation numbers. Connections that are made between
+        the same nodes get the same innovation number, new ones get the
+        next number from a counter that only ever increases.
+    """
+    def __init__(self, connections=None, counter=0):
+        """ :param connections: A dict of (from, to) -> innovation number to
+                                start from, it is updated in place.
+            :param counter:     The highest innovation number handed out so far.
+        """
+        self.counter = counter
+        self.connections = {} if connections is None else connections
+        self.splits = {}
+
+    def connection(self, fr, to, maxinnov=0):
+        """ Returns the innovation number of the connection (fr, to).
+            If it was not seen before, it is numbered above both the 
+            counter and the given maximum innovation of the genotype.
+        """
+        innov = self.connections.get((fr, to))
+        if innov is None:
+            self.counter = max(self.counter, maxinnov) + 1
+            innov = self.connections[(fr, to)] = self.counter
+        return innov
+
+    def split(self, fr, to, new_id, maxinnov=0):
+        """ Returns the innovation numbers of the two connections (fr, new_id)
+            and (new_id, to) that replace (fr, to) when it is split by node new_id.
+        """
+        key = (fr, to, new_id)
+        if key not in self.splits:
+            self.splits[key] = (self.connection(fr, new_id, maxinnov), 
+                                self.connection(new_id, to, maxinnov))
+        return self.splits[key]
+
+    def reset(self):
+        """ Forgets the connections that were made, but keeps counting
+            from the highest innovation number.
+        """
+        self.connections = {}
+        self.splits = {}
+
+    def __len__(self):
+        return len(self.connections)
+
+
 class NEATGenotype(object):
     """ Implements the NEAT genotype, consisting of
         node genes and connection genes.
@@ -104,6 +170,11 @@ class NEATGenotype(object):
         self.conn_genes = {} #: Tuples of (innov, from, to, weight, enabled)
         
         
+        # Incremented whenever the genes change, so compiled networks can be reused
+        self.mutation_generation = 0
+        # The highest innovation number in the connection genes
+        self.max_innov = -1
+
         if self.bias_as_node:
             self.inputs += 1
             
@@ -132,6 +203,7 @@ class NEATGenotype(object):
                 for j in xrange(self.inputs, self.inputs + self.outputs):
                     self.conn_genes[(i, j)] = [innov, i, j, np.random.normal(0.0, self.initial_weight_stdev), True]
                     innov += 1
+            self.max_innov = innov - 1
         else:
             # If an initial topology is given, use that:
             fr, to = zip(*topology)
@@ -150,16 +222,26 @@ class NEATGenotype(object):
             for fr, to in topology:
                 self.conn_genes[(fr, to)] = [innov, fr, to, np.random.normal(0.0, self.initial_weight_stdev), True]
                 innov += 1
+            self.max_innov = innov - 1
                 
-    def mutate(self, innovations={}, global_innov=0):
+    def mutate(self, innovations=None, global_innov=0, rng=None):
         """ Perform a mutation operation on this genotype. 
-            If a dict with innovations is passed in, any
-            add connection operations will be added to it,
-            and checked to ensure identical innovation numbers.
+            If an InnovationRegistry (or a dict with innovations,
+            which is wrapped in one) is passed in, any add connection 
+            operations will be added to it, and checked to ensure 
+            identical innovation numbers.
+            Random numbers are drawn from rng (a numpy RandomState), 
+            or from numpy's global generator if it is not given.
         """
-        maxinnov = max(global_innov, max(cg[0] for cg in self.conn_genes.values()))
+        if rng is None:
+            rng = np.random
+        if not isinstance(innovations, InnovationRegistry):
+            innovations = InnovationRegistry(innovations, global_innov)
+        if not hasattr(self, 'max_innov'):
+            self.max_innov = max(cg[0] for cg in self.conn_genes.itervalues())
+        maxinnov = self.max_innov
         
-        if len(self.node_genes) < self.max_nodes and rand() < self.prob_add_node:
+        if len(self.node_genes) < self.max_nodes and rng.random_sample() < self.prob_add_node:
             possible_to_split = self.conn_genes.keys()
             # If there is a max depth, we can only split connections that skip a layer.
             # E.g. we can split a connection from layer 0 to layer 2, because the resulting
@@ -169,37 +251,28 @@ class NEATGenotype(object):
                 possible_to_split = [(fr, to) for (fr, to) in possible_to_split if
                                         self.node_genes[fr][4] + 1 < self.node_genes[to][4]]
             if possible_to_split:
-                to_split = self.conn_genes[random.choice(possible_to_split)]
+                to_split = self.conn_genes[choice(possible_to_split, rng)]
                 to_split[4] = False # Disable the old connection
                 fr, to, w = to_split[1:4]
                 avg_fforder = (self.node_genes[fr][0] + self.node_genes[to][0]) * 0.5
                 # We assign a random function type to the node, which is #weird
                 # because I thought that in NEAT these kind of mutations
                 # initially don't affect the functionality of the network.
-                new_type = random.choice(self.types)
+                new_type = choice(self.types, rng)
                 # We assign a 'layer' to the new node that is one lower than the target of the connection
                 layer = self.node_genes[fr][4] + 1
                 node_gene = [avg_fforder, new_type, 0.0, self.response_default, layer]
                 new_id = len(self.node_genes)
                 self.node_genes.append(node_gene)
 
-                if (fr, new_id) in innovations:
-                    innov = innovations[(fr, new_id)]
-                else:
-                    maxinnov += 1
-                    innov = innovations[(fr, new_id)] = maxinnov
-                self.conn_genes[(fr, new_id)] = [innov, fr, new_id, 1.0, True]
-
-                if (new_id, to) in innovations:
-                    innov = innovations[(new_id, to)]
-                else:
-                    maxinnov += 1
-                    innov = innovations[(new_id, to)] = maxinnov
-                self.conn_genes[(new_id, to)] = [innov, new_id, to, w, True]
+                innov_in, innov_out = innovations.split(fr, to, new_id, maxinnov)
+                self.conn_genes[(fr, new_id)] = [innov_in, fr, new_id, 1.0, True]
+                self.conn_genes[(new_id, to)] = [innov_out, new_id, to, w, True]
+                self.max_innov = max(self.max_innov, innov_in, innov_out)
             
         # This is #weird, why use "elif"? but this is what
         # neat-python does, so I'm copying.
-        elif rand() < self.prob_add_conn:
+        elif rng.random_sample() < self.prob_add_conn:
             potential_conns = product(xrange(len(self.node_genes)), xrange(self.inputs, len(self.node_genes)))
             potential_conns = (c for c in potential_conns if c not in self.conn_genes)
             # Filter further connections if we're looking only for FF networks
@@ -213,55 +286,56 @@ class NEATGenotype(object):
             potential_conns = list(potential_conns)
             # If any potential connections are left
             if potential_conns:
-                (fr, to) = random.choice(potential_conns)
-                # Check if this innovation was already made, otherwise assign max + 1
-                if (fr, to) in innovations:
-                    innov = innovations[(fr, to)]
-                else:
-                    maxinnov += 1
-                    innov = innovations[(fr, to)] = maxinnov
-                conn_gene = [innov, fr, to, np.random.normal(0, self.stdev_mutate_weight), True]
+                (fr, to) = choice(potential_conns, rng)
+                # Check if this innovation was already made, otherwise assign a new number
+                innov = innovations.connection(fr, to, maxinnov)
+                conn_gene = [innov, fr, to, rng.normal(0, self.stdev_mutate_weight), True]
                 self.conn_genes[(fr, to)] = conn_gene
+                self.max_innov = max(self.max_innov, innov)
             
         else:
             for cg in self.conn_genes.values():
-                if rand() < self.prob_mutate_weight:
-                    cg[3] += np.random.normal(0, self.stdev_mutate_weight)
+                if rng.random_sample() < self.prob_mutate_weight:
+                    cg[3] += rng.normal(0, self.stdev_mutate_weight)
                     cg[3] = np.clip(cg[3], self.weight_range[0], self.weight_range[1])
 
-                if rand() < self.prob_reset_weight:
-                    cg[3] = np.random.normal(0, self.stdev_mutate_weight)
+                if rng.random_sample() < self.prob_reset_weight:
+                    cg[3] = rng.normal(0, self.stdev_mutate_weight)
                     
-                if rand() < self.prob_reenable_conn:
+                if rng.random_sample() < self.prob_reenable_conn:
                     cg[4] = True
 
-                if rand() < self.prob_disable_conn:
+                if rng.random_sample() < self.prob_disable_conn:
                     cg[4] = False
                     
             # Mutate non-input nodes
             for node_gene in self.node_genes[self.inputs:]:
-                if rand() < self.prob_mutate_bias:
-                    node_gene[2] += np.random.normal(0, self.stdev_mutate_bias)
+                if rng.random_sample() < self.prob_mutate_bias:
+                    node_gene[2] += rng.normal(0, self.stdev_mutate_bias)
                     node_gene[2] = np.clip(node_gene[2], self.weight_range[0], self.weight_range[1])
                     
-                if rand() < self.prob_mutate_type:
-                    node_gene[1] = random.choice(self.types)
+                if rng.random_sample() < self.prob_mutate_type:
+                    node_gene[1] = choice(self.types, rng)
                     
-                if rand() < self.prob_mutate_response:
-                    node_gene[3] += np.random.normal(0, self.stdev_mutate_response)
+                if rng.random_sample() < self.prob_mutate_response:
+                    node_gene[3] += rng.normal(0, self.stdev_mutate_response)
                     
         for (fr, to) in self.conn_genes:
             if self.node_genes[to][4] == 0:
                 raise Exception("Connection TO input node not allowed.")
+        self.mutation_generation = getattr(self, 'mutation_generation', 0) + 1
         return self # For chaining
         
-    def mate(self, other):
+    def mate(self, other, rng=None):
         """ Performs crossover between this genotype and another,
             and returns the child
         """
+        if rng is None:
+            rng = np.random
         child = deepcopy(self)
         child.node_genes = []
         child.conn_genes = {}
+        child.mutation_generation = getattr(self, 'mutation_generation', 0) + 1
             
         # Select node genes from parents
         maxnodes = max(len(self.node_genes), len(other.node_genes))
@@ -269,7 +343,7 @@ class NEATGenotype(object):
         for i in range(maxnodes):
             ng = None
             if i < minnodes:
-                ng = random.choice((self.node_genes[i], other.node_genes[i]))
+                ng = choice((self.node_genes[i], other.node_genes[i]), rng)
             else:
                 try:
                     ng = self.node_genes[i]
@@ -285,7 +359,7 @@ class NEATGenotype(object):
         for i in range(maxinnov+1):
             cg = None
             if i in self_conns and i in other_conns:
-                cg = random.choice((self_conns[i], other_conns[i]))
+                cg = choice((self_conns[i], other_conns[i]), rng)
                 enabled = self_conns[i][4] and other_conns[i][4]
             else:
                 if i in self_conns:
@@ -296,7 +370,7 @@ class NEATGenotype(object):
                     enabled = cg[4]
             if cg is not None:
                 child.conn_genes[(cg[1], cg[2])] = deepcopy(cg)
-                child.conn_genes[(cg[1], cg[2])][4] = enabled or rand() < self.prob_reenable_parent
+                child.conn_genes[(cg[1], cg[2])][4] = enabled or rng.random_sample() < self.prob_reenable_parent
 
         # Filter out connections that would become recursive in the new individual.
         def is_feedforward(((fr, to), cg)):
@@ -304,6 +378,7 @@ class NEATGenotype(object):
 
         if self.feedforward:
             child.conn_genes = dict(filter(is_feedforward, child.conn_genes.items()))
+        child.max_innov = max(cg[0] for cg in child.conn_genes.itervalues()) if child.conn_genes else -1
         
         return child
         
@@ -313,26 +388,19 @@ class NEATGenotype(object):
         # index the connections by innov numbers
         self_conns = dict( ((c[0], c) for c in self.conn_genes.itervalues()) )
         other_conns = dict( ((c[0], c) for c in other.conn_genes.itervalues()) )
-        # Select connection genes from parents
-        allinnovs = self_conns.keys() + other_conns.keys()
-        mininnov = min(allinnovs)
         
         e = 0
         d = 0
         w = 0.0
         m = 0
         
-        for i in allinnovs:
-            if i in self_conns and i in other_conns:
-                w += np.abs(self_conns[i][3] - other_conns[i][3])
+        # A single pass over the genes, every gene that is not
+        # matched by the other genotype counts as excess.
+        for i, cg in self_conns.iteritems():
+            if i in other_conns:
+                w += np.abs(cg[3] - other_conns[i][3])
                 m += 1
-            elif i in self_conns or i in other_conns:
-                if i < mininnov:
-                    d += 1 # Disjoint                
-                else:
-                    e += 1 # Excess                    
-            else:
-                raise Exception("NEITHERHWATHWATHAWTHA")
+        e = len(self_conns) + len(other_conns) - 2 * m
         
         w = (w / m) if m > 0 else w
         
@@ -393,6 +461,368 @@ class NEATGenotype(object):
     def visualize(self, filename):
         return NeuralNetwork(self).visualize(filename, inputs=self.inputs, outputs=self.outputs)
         
+class CompactNEATGenotype(object):
+    """ A NEAT genotype with the same interface as :class:`NEATGenotype`,
+        that keeps its genes in parallel NumPy arrays instead of
+        lists of lists. Connection genes are sorted by innovation number,
+        so that crossover and distance are vectorized merges, and
+        mutation draws all its random numbers at once.
+    """
+    __slots__ = ('inputs', 'outputs', 'types', 'feedforward', 'max_depth', 'max_nodes',
+                 'response_default', 'initial_weight_stdev', 'bias_as_node',
+                 'prob_add_node', 'prob_add_conn', 'prob_mutate_weight', 'prob_reset_weight',
+                 'prob_reenable_conn', 'prob_disable_conn', 'prob_reenable_parent',
+                 'prob_mutate_bias', 'prob_mutate_response', 'prob_mutate_type',
+                 'stdev_mutate_weight', 'stdev_mutate_bias', 'stdev_mutate_response',
+                 'weight_range', 'distance_excess', 'distance_disjoint', 'distance_weight',
+                 # Node genes
+                 'fforder', 'node_type', 'bias', 'response', 'layer',
+                 # Connection genes
+                 'innov', 'conn_from', 'conn_to', 'weight', 'enabled',
+                 'mutation_generation', 'stats')
+
+    def __init__(self, 
+                 inputs=2, 
+                 outputs=1, 
+                 types=['tanh'],
+                 topology=None,
+                 feedforward=True,
+                 max_depth=None,
+                 max_nodes=inf,
+                 response_default=4.924273,
+                 initial_weight_stdev=2.0,
+                 bias_as_node=False,
+                 prob_add_node=0.03,
+                 prob_add_conn=0.3,
+                 prob_mutate_weight=0.8,
+                 prob_reset_weight=0.1,
+                 prob_reenable_conn=0.01,
+                 prob_disable_conn=0.01,
+                 prob_reenable_parent=0.25,
+                 prob_mutate_bias=0.2,
+                 prob_mutate_response=0.0,
+                 prob_mutate_type=0.2,
+                 stdev_mutate_weight=1.5,
+                 stdev_mutate_bias=0.5,
+                 stdev_mutate_response=0.5,
+                 weight_range=(-50., 50.),
+                 distance_excess=1.0,
+                 distance_disjoint=1.0,
+                 distance_weight=0.4):
+        """ Takes the same parameters as :class:`NEATGenotype`.
+        """
+        self.inputs = inputs
+        self.outputs = outputs
+        self.types = types
+        self.feedforward = feedforward
+        self.max_depth = max_depth
+        self.max_nodes = max_nodes
+        self.response_default = response_default
+        self.initial_weight_stdev = initial_weight_stdev
+        self.bias_as_node = bias_as_node
+        self.prob_add_conn = prob_add_conn
+        self.prob_add_node = prob_add_node
+        self.prob_mutate_weight = prob_mutate_weight
+        self.prob_reset_weight = prob_reset_weight      
+        self.prob_reenable_conn = prob_reenable_conn
+        self.prob_disable_conn = prob_disable_conn
+        self.prob_reenable_parent = prob_reenable_parent
+        self.prob_mutate_bias = prob_mutate_bias
+        self.prob_mutate_response = prob_mutate_response
+        self.prob_mutate_type = prob_mutate_type
+        self.stdev_mutate_weight = stdev_mutate_weight
+        self.stdev_mutate_bias = stdev_mutate_bias
+        self.stdev_mutate_response = stdev_mutate_response
+        self.weight_range = weight_range
+        self.distance_excess = distance_excess
+        self.distance_disjoint = distance_disjoint
+        self.distance_weight = distance_weight
+        self.mutation_generation = 0
+        self.stats = {}
+
+        if self.bias_as_node:
+            self.inputs += 1
+            
+        max_layer = sys.maxint if (self.max_depth is None) else (self.max_depth - 1)
+
+        if topology is None:
+            # Fully connect the inputs to the outputs, as NEATGenotype does.
+            n = self.inputs + self.outputs
+            self.fforder = np.arange(n) * 1024.0
+            self.node_type = np.zeros(n, dtype=np.int16)
+            self.node_type[self.inputs:] = np.random.randint(0, len(self.types), self.outputs)
+            self.layer = np.zeros(n, dtype=np.int64)
+            self.layer[self.inputs:] = max_layer
+            fr, to = np.mgrid[0:self.inputs, self.inputs:n]
+            fr, to = fr.ravel(), to.ravel()
+        else:
+            fr, to = (np.array(a) for a in zip(*topology))
+            n = max(fr.max(), to.max()) + 1
+
+            if n < inputs + outputs:
+                raise Exception("Topology (%d) contains fewer than inputs (%d) + outputs (%d) nodes." % 
+                    (n - 1, inputs, outputs))
+
+            self.fforder = np.arange(n) * 1024.0
+            self.node_type = np.random.randint(0, len(self.types), n).astype(np.int16)
+            self.layer = np.where(np.arange(n) < inputs, 0, np.arange(n) + 1).astype(np.int64)
+
+        self.bias = np.zeros(n)
+        self.response = np.ones(n) * self.response_default
+        self.innov = np.arange(len(fr), dtype=np.int64)
+        self.conn_from = fr.astype(np.int32)
+        self.conn_to = to.astype(np.int32)
+        self.weight = np.random.normal(0.0, self.initial_weight_stdev, len(fr))
+        self.enabled = np.ones(len(fr), dtype=bool)
+
+    @property
+    def node_genes(self):
+        """ The node genes in the list format of NEATGenotype, 
+            (fforder, type, bias, response, layer). This is a copy.
+        """
+        types = [self.types[t] for t in self.node_type]
+        return map(list, zip(self.fforder.tolist(), types, self.bias.tolist(), 
+                             self.response.tolist(), self.layer.tolist()))
+
+    @property
+    def conn_genes(self):
+        """ The connection genes in the dict format of NEATGenotype,
+            (from, to) -> (innov, from, to, weight, enabled). This is a copy.
+        """
+        return dict(((fr, to), [innov, fr, to, w, en]) for (innov, fr, to, w, en) in 
+                    zip(self.innov.tolist(), self.conn_from.tolist(), self.conn_to.tolist(),
+                        self.weight.tolist(), self.enabled.tolist()))
+
+    def _add_conn(self, innov, fr, to, weight):
+        """ Inserts a new (enabled) connection gene, keeping the
+            genes sorted by innovation number.
+        """
+        i = np.searchsorted(self.innov, innov, side='right')
+        self.innov = np.insert(self.innov, i, innov)
+        self.conn_from = np.insert(self.conn_from, i, fr)
+        self.conn_to = np.insert(self.conn_to, i, to)
+        self.weight = np.insert(self.weight, i, weight)
+        self.enabled = np.insert(self.enabled, i, True)
+
+    def mutate(self, innovations=None, global_innov=0, rng=None):
+        """ Perform a mutation operation on this genotype, 
+            see NEATGenotype.mutate.
+        """
+        if rng is None:
+            rng = np.random
+        if not isinstance(innovations, InnovationRegistry):
+            innovations = InnovationRegistry(innovations, global_innov)
+        # Genes are sorted by innovation, so the last one is the highest
+        maxinnov = int(self.innov[-1]) if len(self.innov) else 0
+        num_nodes = len(self.fforder)
+
+        if num_nodes < self.max_nodes and rng.random_sample() < self.prob_add_node:
+            possible_to_split = np.arange(len(self.innov))
+            # With a max depth, only connections that skip a layer can be split.
+            if self.max_depth is not None:
+                possible_to_split = possible_to_split[self.layer[self.conn_from] + 1 < self.layer[self.conn_to]]
+            if len(possible_to_split):
+                i = choice(possible_to_split, rng)
+                self.enabled[i] = False # Disable the old connection
+                fr, to, w = int(self.conn_from[i]), int(self.conn_to[i]), self.weight[i]
+                new_id = num_nodes
+                self.fforder = np.append(self.fforder, (self.fforder[fr] + self.fforder[to]) * 0.5)
+                self.node_type = np.append(self.node_type, np.int16(rng.randint(len(self.types))))
+                self.bias = np.append(self.bias, 0.0)
+                self.response = np.append(self.response, self.response_default)
+                self.layer = np.append(self.layer, self.layer[fr] + 1)
+
+                innov_in, innov_out = innovations.split(fr, to, new_id, maxinnov)
+                self._add_conn(innov_in, fr, new_id, 1.0)
+                self._add_conn(innov_out, new_id, to, w)
+
+        # The same "elif" as in NEATGenotype.mutate
+        elif rng.random_sample() < self.prob_add_conn:
+            exists = np.zeros((num_nodes, num_nodes), dtype=bool)
+            exists[self.conn_from, self.conn_to] = True
+            fr, to = np.mgrid[0:num_nodes, self.inputs:num_nodes]
+            fr, to = fr.ravel(), to.ravel()
+            allowed = ~exists[fr, to]
+            # Filter further connections if we're looking only for FF networks
+            if self.feedforward:
+                allowed &= self.fforder[fr] < self.fforder[to]
+            # Don't create intra-layer connections if there is a max_depth
+            if self.max_depth is not None:
+                allowed &= self.layer[fr] < self.layer[to]
+            potential_conns = np.flatnonzero(allowed)
+            if len(potential_conns):
+                c = choice(potential_conns, rng)
+                fr, to = int(fr[c]), int(to[c])
+                innov = innovations.connection(fr, to, maxinnov)
+                self._add_conn(innov, fr, to, rng.normal(0, self.stdev_mutate_weight))
+
+        else:
+            # Bernoulli masks over all genes at once
+            c = len(self.innov)
+            mutate = rng.random_sample(c) < self.prob_mutate_weight
+            self.weight[mutate] = np.clip(self.weight[mutate] + rng.normal(0, self.stdev_mutate_weight, mutate.sum()),
+                                          self.weight_range[0], self.weight_range[1])
+            reset = rng.random_sample(c) < self.prob_reset_weight
+            self.weight[reset] = rng.normal(0, self.stdev_mutate_weight, reset.sum())
+            self.enabled[rng.random_sample(c) < self.prob_reenable_conn] = True
+            self.enabled[rng.random_sample(c) < self.prob_disable_conn] = False
+
+            # Mutate non-input nodes
+            n = num_nodes - self.inputs
+            bias = rng.random_sample(n) < self.prob_mutate_bias
+            self.bias[self.inputs:][bias] = np.clip(self.bias[self.inputs:][bias] + rng.normal(0, self.stdev_mutate_bias, bias.sum()),
+                                                    self.weight_range[0], self.weight_range[1])
+            new_type = rng.random_sample(n) < self.prob_mutate_type
+            self.node_type[self.inputs:][new_type] = rng.randint(0, len(self.types), new_type.sum())
+            response = rng.random_sample(n) < self.prob_mutate_response
+            self.response[self.inputs:][response] += rng.normal(0, self.stdev_mutate_response, response.sum())
+
+        if (self.layer[self.conn_to] == 0).any():
+            raise Exception("Connection TO input node not allowed.")
+        self.mutation_generation += 1
+        return self # For chaining
+
+    def _copy_settings(self):
+        """ Returns a genotype with the same settings but no genes. """
+        child = object.__new__(self.__class__)
+        for attr in self.__slots__:
+            if attr not in NODE_DTYPE.names + CONN_DTYPE.names:
+                setattr(child, attr, getattr(self, attr))
+        child.stats = {}
+        return child
+
+    def mate(self, other, rng=None):
+        """ Performs crossover between this genotype and another,
+            and returns the child
+        """
+        if rng is None:
+            rng = np.random
+        child = self._copy_settings()
+        child.mutation_generation = self.mutation_generation + 1
+
+        # Select node genes from parents, randomly where both have them
+        minnodes = min(len(self.fforder), len(other.fforder))
+        longest = self if len(self.fforder) >= len(other.fforder) else other
+        pick_other = rng.random_sample(minnodes) < 0.5
+        for attr in NODE_DTYPE.names:
+            mine, theirs = getattr(self, attr), getattr(other, attr)
+            genes = getattr(longest, attr).copy()
+            genes[:minnodes] = np.where(pick_other, theirs[:minnodes], mine[:minnodes])
+            setattr(child, attr, genes)
+
+        # Merge the connection genes on innovation number
+        matching, partner = match_sorted(self.innov, other.innov)
+        in_self = np.zeros(len(other.innov), dtype=bool)
+        in_self[partner] = True
+        pick_other = rng.random_sample(len(matching)) < 0.5
+        enabled = self.enabled.copy()
+        enabled[matching] &= other.enabled[partner]
+
+        innov = np.concatenate((self.innov, other.innov[~in_self]))
+        order = np.argsort(innov, kind='mergesort')
+        for attr in ('innov', 'conn_from', 'conn_to', 'weight'):
+            mine, theirs = getattr(self, attr).copy(), getattr(other, attr)
+            mine[matching] = np.where(pick_other, theirs[partner], mine[matching])
+            setattr(child, attr, np.concatenate((mine, theirs[~in_self]))[order])
+        enabled = np.concatenate((enabled, other.enabled[~in_self]))[order]
+        child.enabled = enabled | (rng.random_sample(len(enabled)) < self.prob_reenable_parent)
+
+        # A (from, to) pair that appears under several innovations keeps the last,
+        # and connections to non-existing nodes are dropped.
+        n = len(child.fforder)
+        key = child.conn_from.astype(np.int64) * n + child.conn_to
+        _, last = np.unique(key[::-1], return_index=True)
+        keep = np.zeros(len(key), dtype=bool)
+        keep[len(key) - 1 - last] = True
+        exists = (child.conn_from < n) & (child.conn_to < n)
+        keep &= exists
+        # Filter out connections that would become recursive in the new individual.
+        if self.feedforward:
+            keep[exists] &= child.fforder[child.conn_from[exists]] < child.fforder[child.conn_to[exists]]
+        for attr in CONN_DTYPE.names:
+            setattr(child, attr, getattr(child, attr)[keep])
+        return child
+
+    def distance(self, other):
+        """ NEAT's compatibility distance. Like NEATGenotype.distance,
+            every gene that is not matched by innovation counts as excess.
+        """
+        matching, partner = match_sorted(self.innov, other.innov)
+        m = len(matching)
+        e = (len(self.innov) - m) + (len(other.innov) - m)
+        d = 0
+        if m > 0:
+            w = np.abs(self.weight[matching] - other.weight[partner]).mean()
+        else:
+            w = 0.0
+        return (self.distance_excess * e + 
+                self.distance_disjoint * d +
+                self.distance_weight * w)
+
+    def get_network_data(self):
+        """ Returns a tuple of (connection_matrix, node_types) 
+            like NEATGenotype.get_network_data.
+        """
+        n = len(self.fforder)
+        cm = np.zeros((n, n))
+        cm.fill(np.nan)
+        enabled = self.enabled
+        cm[self.conn_to[enabled], self.conn_from[enabled]] = self.weight[enabled]
+
+        # Reorder the nodes/connections, ties are broken by index like sorted() does
+        order = np.argsort(self.fforder, kind='mergesort')
+        cm = cm[:,order][order,:]
+        node_types = np.array(self.types)[self.node_type[order]]
+        bias = self.bias[order]
+        response = self.response[order]
+
+        # Then, we multiply all the incoming connection weights by the response
+        cm *= np.atleast_2d(response).T
+        # Finally, add the bias as incoming weights from node-0
+        if not self.bias_as_node:
+            cm = np.hstack( (np.atleast_2d(bias).T, cm) )
+            cm = np.insert(cm, 0, 0.0, axis=0)
+            node_types = [node_types[0]] + list(node_types)
+
+        if self.feedforward and np.triu(np.nan_to_num(cm)).any():
+            raise Exception("Network is not feedforward.")
+        
+        return cm, node_types
+
+    def __getstate__(self):
+        """ Pickles the genes as two packed records instead of
+            ten separate arrays.
+        """
+        state = dict((attr, getattr(self, attr)) for attr in self.__slots__ 
+                     if hasattr(self, attr) and attr not in NODE_DTYPE.names + CONN_DTYPE.names)
+        nodes = np.empty(len(self.fforder), dtype=NODE_DTYPE)
+        for attr in NODE_DTYPE.names:
+            nodes[attr] = getattr(self, attr)
+        conns = np.empty(len(self.innov), dtype=CONN_DTYPE)
+        for attr in CONN_DTYPE.names:
+            conns[attr] = getattr(self, attr)
+        state['nodes'] = nodes.tostring()
+        state['conns'] = conns.tostring()
+        return state
+
+    def __setstate__(self, state):
+        state = dict(state)
+        nodes = np.frombuffer(state.pop('nodes'), dtype=NODE_DTYPE)
+        conns = np.frombuffer(state.pop('conns'), dtype=CONN_DTYPE)
+        for attr in NODE_DTYPE.names:
+            setattr(self, attr, nodes[attr].copy())
+        for attr in CONN_DTYPE.names:
+            setattr(self, attr, conns[attr].copy())
+        for attr, value in state.iteritems():
+            setattr(self, attr, value)
+
+    def __str__(self):
+        return '%s with %d nodes and %d connections.' % (self.__class__.__name__, 
+            len(self.fforder), len(self.innov))
+            
+    def visualize(self, filename):
+        return NeuralNetwork(self).visualize(filename, inputs=self.inputs, outputs=self.outputs)
+        
 class NEATSpecies(object):
     
     def __init__(self, initial_member):
@@ -456,11 +886,11 @@ class NEATPopulation(SimplePopulation):
         self.generation = 0
         self.solved_at = None
         self.stats = defaultdict(list)
+        self._reset_seed()
         
         # Neat specific:
         self.species = [] # List of species
-        self.global_innov = 0
-        self.innovations = {} # Keep track of global innovations
+        self.innovations = InnovationRegistry() # Keep track of global innovations
         self.current_compatibility_threshold = self.compatibility_threshold
                 
     @property
@@ -483,7 +913,7 @@ class NEATPopulation(SimplePopulation):
         
         ## INITIAL BIRTH
         while len(pop) < self.popsize:
-            individual = self.geno_factory()
+            individual = self._create(len(pop))
             pop.append(individual)
             
         ## EVALUATE 
@@ -496,8 +926,8 @@ class NEATPopulation(SimplePopulation):
     
         ## SPECIATE
         # Select random representatives
-        for specie in self.species:
-            specie.representative = random.choice(specie.members)
+        for i, specie in enumerate(self.species):
+            specie.representative = choice(specie.members, self._stream(SPECIATE, i))
             specie.members = []
             specie.age += 1
         # Add all individuals to a species
@@ -566,8 +996,8 @@ class NEATPopulation(SimplePopulation):
         # neat-python keeps a global list.
         # This switch controls which behavior to simulate.
         if self.reset_innovations:
-            self.innovations = dict()
-        for specie in self.species:
+            self.innovations.reset()
+        for i, specie in enumerate(self.species):
             # First we keep only the best individuals of each species
             specie.members.sort(key=lambda ind: ind.stats['fitness'], reverse=True)
             keep = max(1, int(round(len(specie.members) * self.survival)))
@@ -580,17 +1010,16 @@ class NEATPopulation(SimplePopulation):
                 specie.members = []
             # Produce offspring:
             while len(specie.members) < specie.offspring:
+                # Each child slot of each species has its own stream
+                rng = self._stream(REPRODUCE, i, len(specie.members))
                 # Perform tournament selection
                 k = min(len(pool), self.tournament_selection_k)
-                p1 = max(random.sample(pool, k), key=lambda ind: ind.stats['fitness'])
-                p2 = max(random.sample(pool, k), key=lambda ind: ind.stats['fitness'])
+                p1 = max(sample(pool, k, rng), key=lambda ind: ind.stats['fitness'])
+                p2 = max(sample(pool, k, rng), key=lambda ind: ind.stats['fitness'])
                 # Mate and mutate
-                child = p1.mate(p2)
-                child.mutate(innovations=self.innovations, global_innov=self.global_innov)
+                child = p1.mate(p2, rng)
+                child.mutate(innovations=self.innovations, rng=rng)
                 specie.members.append(child)
-        
-        if self.innovations:
-            self.global_innov = max(self.innovations.itervalues())            
 
 
         self._gather_stats(pop)
@@ -13,10 +13,12 @@ from itertools import product
 from collections import defaultdict
 import socket
 
-from MessageReceiver import *
-from MessageSender import *
 from Inbox import Inbox
-from ConnectionsListener import ConnectionsListener
+from PeerNetwork import PeerNetwork
+from Outbox import LATEST
+from Gossip import Gossip
+from Membership import Membership
+import genome_wire
 
 import cPickle as pickle
 
@@ -25,7 +27,7 @@ import numpy as np
 np.seterr(over='warn', divide='raise')
 
 # Package
-from .evolution import SimplePopulation
+from .evolution import SimplePopulation, choice, sample, SPECIATE, REPRODUCE
 from ..networks.rnn import NeuralNetwork
 
 # Shortcuts
@@ -119,6 +121,9 @@ class NEATGenotype(object):
         # be appended with a timestamp to ensure chronological ordering with external genotypes
         self.conn_genes = {}
         
+        # Incremented whenever the genes change, so compiled networks can be reused
+        self.mutation_generation = 0
+
         if self.bias_as_node:
             self.inputs += 1
             
@@ -166,17 +171,23 @@ class NEATGenotype(object):
                 self.conn_genes[(fr, to)] = [innov, fr, to, np.random.normal(0.0, self.initial_weight_stdev), True]
                 innov += 1
 
-    def mutate(self, innovations={}, global_innov=0):
+    def mutate(self, innovations=None, global_innov=0, rng=None):
         """ Perform a mutation operation on this genotype. 
             If a dict with innovations is passed in, any
             add connection operations will be added to it,
             and checked to ensure identical innovation numbers.
+            Random numbers are drawn from rng (a numpy RandomState), 
+            or from numpy's global generator if it is not given.
         """
+        if innovations is None:
+            innovations = {}
+        if rng is None:
+            rng = np.random
 
         #  retrieve the maximum innovation number and cast this to an integer, so timestamp information is not taken
         maxinnov = int(max(global_innov, max(int(cg[0]) for cg in self.conn_genes.values())))
         
-        if len(self.node_genes) < self.max_nodes and rand() < self.prob_add_node:
+        if len(self.node_genes) < self.max_nodes and rng.random_sample() < self.prob_add_node:
             # retrieve all the keys of the connections, which are tupels of nodes.
             possible_to_split = self.conn_genes.keys()
             # If there is a max depth, we can only split connections that skip a layer.
@@ -187,14 +198,14 @@ class NEATGenotype(object):
                 possible_to_split = [(fr, to) for (fr, to) in possible_to_split if
                                         self.node_genes[fr][4] + 1 < self.node_genes[to][4]]
             if possible_to_split:
-                to_split = self.conn_genes[random.choice(possible_to_split)]
+                to_split = self.conn_genes[choice(possible_to_split, rng)]
                 to_split[4] = False  # Disable the old connection
                 fr, to, w = to_split[1:4]
                 avg_fforder = (self.node_genes[fr][0] + self.node_genes[to][0]) * 0.5
                 # We assign a random function type to the node, which is #weird
                 # because I thought that in NEAT these kind of mutations
                 # initially don't affect the functionality of the network.
-                new_type = random.choice(self.types)
+                new_type = choice(self.types, rng)
                 # We assign a 'layer' to the new node that is one lower than the target of the connection
                 layer = self.node_genes[fr][4] + 1
                 node_gene = [avg_fforder, new_type, 0.0, self.response_default, layer]
@@ -220,7 +231,7 @@ class NEATGenotype(object):
             
         # This is #weird, why use "elif"? but this is what
         # neat-python does, so I'm copying.
-        elif rand() < self.prob_add_conn:
+        elif rng.random_sample() < self.prob_add_conn:
             potential_conns = product(xrange(len(self.node_genes)), xrange(self.inputs, len(self.node_genes)))
             potential_conns = (c for c in potential_conns if c not in self.conn_genes)
             # Filter further connections if we're looking only for FF networks
@@ -234,62 +245,66 @@ class NEATGenotype(object):
             potential_conns = list(potential_conns)
             # If any potential connections are left
             if potential_conns:
-                (fr, to) = random.choice(potential_conns)
+                (fr, to) = choice(potential_conns, rng)
                 # Check if this innovation was already made, otherwise assign max + 1
                 if (fr, to) in innovations:
                     innov = innovations[(fr, to)]
                 else:
                     # maxinnov += 1
                     innov = innovations[(fr, to)] = innovation_number(maxinnov)
-                conn_gene = [innov, fr, to, np.random.normal(0, self.stdev_mutate_weight), True]
+                conn_gene = [innov, fr, to, rng.normal(0, self.stdev_mutate_weight), True]
                 self.conn_genes[(fr, to)] = conn_gene
             
         else:
             for cg in self.conn_genes.values():
-                if rand() < self.prob_mutate_weight:
-                    cg[3] += np.random.normal(0, self.stdev_mutate_weight)
+                if rng.random_sample() < self.prob_mutate_weight:
+                    cg[3] += rng.normal(0, self.stdev_mutate_weight)
                     cg[3] = np.clip(cg[3], self.weight_range[0], self.weight_range[1])
 
-                if rand() < self.prob_reset_weight:
-                    cg[3] = np.random.normal(0, self.stdev_mutate_weight)
+                if rng.random_sample() < self.prob_reset_weight:
+                    cg[3] = rng.normal(0, self.stdev_mutate_weight)
                     
-                if rand() < self.prob_reenable_conn:
+                if rng.random_sample() < self.prob_reenable_conn:
                     cg[4] = True
 
-                if rand() < self.prob_disable_conn:
+                if rng.random_sample() < self.prob_disable_conn:
                     cg[4] = False
                     
             # Mutate non-input nodes
             for node_gene in self.node_genes[self.inputs:]:
-                if rand() < self.prob_mutate_bias:
-                    node_gene[2] += np.random.normal(0, self.stdev_mutate_bias)
+                if rng.random_sample() < self.prob_mutate_bias:
+                    node_gene[2] += rng.normal(0, self.stdev_mutate_bias)
                     node_gene[2] = np.clip(node_gene[2], self.weight_range[0], self.weight_range[1])
                     
-                if rand() < self.prob_mutate_type:
-                    node_gene[1] = random.choice(self.types)
+                if rng.random_sample() < self.prob_mutate_type:
+                    node_gene[1] = choice(self.types, rng)
                     
-                if rand() < self.prob_mutate_response:
-                    node_gene[3] += np.random.normal(0, self.stdev_mutate_response)
+                if rng.random_sample() < self.prob_mutate_response:
+                    node_gene[3] += rng.normal(0, self.stdev_mutate_response)
                     
         for (fr, to) in self.conn_genes:
             if self.node_genes[int(to)][4] == 0:
                 raise Exception("Connection TO input node not allowed.")
+        self.mutation_generation = getattr(self, 'mutation_generation', 0) + 1
         return self  # For chaining
         
-    def mate(self, other):
+    def mate(self, other, rng=None):
         """ Performs crossover between this genotype and another,
             and returns the child
         """
+        if rng is None:
+            rng = np.random
         child = deepcopy(self)
         child.node_genes = []
         child.conn_genes = {}
+        child.mutation_generation = getattr(self, 'mutation_generation', 0) + 1
         # Select node genes from parents
         maxnodes = max(len(self.node_genes), len(other.node_genes))
         minnodes = min(len(self.node_genes), len(other.node_genes))
         for i in range(maxnodes):
             ng = None
             if i < minnodes:
-                ng = random.choice((self.node_genes[i], other.node_genes[i]))
+                ng = choice((self.node_genes[i], other.node_genes[i]), rng)
             else:
                 try:
                     ng = self.node_genes[i]
@@ -309,14 +324,14 @@ class NEATGenotype(object):
         for fromto, con in self_conns2.iteritems():
             if fromto in other_conns2.keys():
                 # the connection also exists in the other genotype
-                cg = random.choice((con, other_conns2[fromto]))
+                cg = choice((con, other_conns2[fromto]), rng)
                 enabled = con[4] and other_conns2[fromto][4]
             else:
                 cg = con
                 enabled = cg[4]
             if cg is not None:
                 child.conn_genes[(cg[1], cg[2])] = deepcopy(cg)
-                child.conn_genes[(cg[1], cg[2])][4] = enabled or rand() < self.prob_reenable_parent
+                child.conn_genes[(cg[1], cg[2])][4] = enabled or rng.random_sample() < self.prob_reenable_parent
 
         # for i in range(maxinnov+1):
         #     cg = None
@@ -363,26 +378,19 @@ class NEATGenotype(object):
         # index the connections by innov numbers
         self_conns = dict( ((c[0], c) for c in self.conn_genes.itervalues()) )
         other_conns = dict( ((c[0], c) for c in other.conn_genes.itervalues()) )
-        # Select connection genes from parents
-        allinnovs = self_conns.keys() + other_conns.keys()
-        mininnov = min(allinnovs)
         
         e = 0
         d = 0
         w = 0.0
         m = 0
         
-        for i in allinnovs:
-            if i in self_conns and i in other_conns:
-                w += np.abs(self_conns[i][3] - other_conns[i][3])
+        # A single pass over the genes, every gene that is not
+        # matched by the other genotype counts as excess.
+        for i, cg in self_conns.iteritems():
+            if i in other_conns:
+                w += np.abs(cg[3] - other_conns[i][3])
                 m += 1
-            elif i in self_conns or i in other_conns:
-                if i < mininnov:
-                    d += 1  # Disjoint
-                else:
-                    e += 1  # Excess
-            else:
-                raise Exception("NEITHERHWATHWATHAWTHA")
+        e = len(self_conns) + len(other_conns) - 2 * m
         
         w = (w / m) if m > 0 else w
         
@@ -485,12 +493,15 @@ class NEATPopulation(SimplePopulation):
                  old_multiplier=0.2,
                  reset_innovations=False,
                  survival=0.2,
+                 distribution=None,
                  **kwargs):
         """ Initializes the object with settings,
             does not create a population yet.
             
             :param geno_factory: A callable (function or object) that returns
                                  a new instance of a genotype.
+            :param distribution: How champions reach the other robots,
+                                 Distributor.MESH or Distributor.GOSSIP.
 
         """
         super(NEATPopulation, self).__init__(geno_factory, **kwargs)
@@ -507,7 +518,7 @@ class NEATPopulation(SimplePopulation):
         self.stagnation_age = stagnation_age
         self.min_elitism_size = min_elitism_size
         self.logger = Logger()
-        self.distributor = Distributor(self.ip_address, self.logger)
+        self.distributor = Distributor(self.ip_address, self.logger, self.geno_factory, distribution)
         self.distributor.start()
         self.population_backup = self.population
         self.species_backup = []
@@ -521,6 +532,7 @@ class NEATPopulation(SimplePopulation):
         self.generation = 0
         self.solved_at = None
         self.stats = defaultdict(list)
+        self._reset_seed()
         
         # Neat specific:
         self.species = [] # List of species
@@ -548,15 +560,15 @@ class NEATPopulation(SimplePopulation):
         pop = list(self.population)
 
         # receive the best individuals from all the other robots and choose the best, add the best as a new species
-        remote_genotypes = self.distributor.get_genotypes()
+        remote_genotypes = self.distributor.get_genotypes(1)
         if len(remote_genotypes) is not 0:
-            best_remote_ind = max(remote_genotypes, key=lambda ind: ind.stats['fitness'])
+            best_remote_ind = remote_genotypes[0]
             self.species.append(NEATSpecies(best_remote_ind))
             pop.append(best_remote_ind)
 
         ## INITIAL BIRTH
         while len(pop) < self.popsize:
-            individual = self.geno_factory()
+            individual = self._create(len(pop))
             pop.append(individual)
             
         ## EVALUATE 
@@ -569,8 +581,8 @@ class NEATPopulation(SimplePopulation):
 
         ## SPECIATE
         # Select random representatives
-        for specie in self.species:
-            specie.representative = random.choice(specie.members)
+        for i, specie in enumerate(self.species):
+            specie.representative = choice(specie.members, self._stream(SPECIATE, i))
             specie.members = []
             specie.age += 1
         # Add all individuals to a species
@@ -644,7 +656,7 @@ class NEATPopulation(SimplePopulation):
         # This switch controls which behavior to simulate.
         if self.reset_innovations:
             self.innovations = dict()
-        for specie in self.species:
+        for i, specie in enumerate(self.species):
             # First we keep only the best individuals of each species
             specie.members.sort(key=lambda ind: ind.stats['fitness'], reverse=True)
             keep = max(1, int(round(len(specie.members) * self.survival)))
@@ -657,13 +669,15 @@ class NEATPopulation(SimplePopulation):
                 specie.members = []
             # Produce offspring:
             while len(specie.members) < specie.offspring:
+                # Each child slot of each species has its own stream
+                rng = self._stream(REPRODUCE, i, len(specie.members))
                 # Perform tournament selection
                 k = min(len(pool), self.tournament_selection_k)
-                p1 = max(random.sample(pool, k), key=lambda ind: ind.stats['fitness'])
-                p2 = max(random.sample(pool, k), key=lambda ind: ind.stats['fitness'])
+                p1 = max(sample(pool, k, rng), key=lambda ind: ind.stats['fitness'])
+                p2 = max(sample(pool, k, rng), key=lambda ind: ind.stats['fitness'])
                 # Mate and mutate
-                child = p1.mate(p2)
-                child.mutate(innovations=self.innovations, global_innov=self.global_innov)
+                child = p1.mate(p2, rng)
+                child.mutate(innovations=self.innovations, global_innov=self.global_innov, rng=rng)
                 specie.members.append(child)
         
         if self.innovations:
@@ -690,21 +704,62 @@ class NEATPopulation(SimplePopulation):
 
 class Distributor:
     PORT = 4242
-
-    def __init__(self, ip_address, logger):
-        self.__msg_senders = dict()
-        self.__msg_receivers = dict()
-        self.__stopSockets = list()
+    # Compress the genes of the genotypes sent, see genome_wire
+    COMPRESS = True
+    # Genotypes waiting for a robot that is down: the latest ones are kept, or the fittest with BEST
+    OUTBOX_CAPACITY = 3
+    OUTBOX_POLICY = LATEST
+    # Champions are sent to every robot, or gossiped: sent to GOSSIP_FANOUT random robots, that each
+    # forward them to as many, GOSSIP_TTL times. A robot forwards the GOSSIP_FORWARD fittest champions
+    # it received along with its own, so its traffic stays constant in large swarms.
+    MESH, GOSSIP = 'mesh', 'gossip'
+    MODE = MESH
+    GOSSIP_FANOUT = 2
+    GOSSIP_TTL = 4
+    GOSSIP_FORWARD = 2
+    # seconds after which an unused connection is closed when gossiping, as the peers change every time
+    GOSSIP_IDLE_TIMEOUT = 60
+    # The other robots are found by the heartbeats they multicast every HEARTBEAT_INTERVAL seconds, and
+    # forgotten after MEMBER_TIMEOUT seconds without one. STATIC reads them from bots.txt instead.
+    MULTICAST, STATIC = 'multicast', 'static'
+    DISCOVERY = MULTICAST
+    HEARTBEAT_INTERVAL = 1.0
+    MEMBER_TIMEOUT = 5.0
+
+    def __init__(self, ip_address, logger, geno_factory, mode=None, discovery=None):
         self.__address = ip_address
-        self.__bots = self.get_bots()
+        self.__mode = mode or self.MODE
+        if self.__mode not in (self.MESH, self.GOSSIP):
+            raise ValueError("Unknown distribution mode %r" % self.__mode)
+        self.__discovery = discovery or self.DISCOVERY
+        if self.__discovery not in (self.MULTICAST, self.STATIC):
+            raise ValueError("Unknown discovery %r" % self.__discovery)
+        # with multicast discovery, the robots are added as they join
+        self.__bots = self.get_bots() if self.__discovery == self.STATIC else []
         self.__logger = logger
         self.__inbox = Inbox(self.__logger)
         self.__started = False
-        for bot in self.__bots:
-            self.__logger.debug(ip_address + " added sender and receiver for: " + bot)
-            self.__msg_senders[bot] = MessageSender(bot, self.PORT, self.__logger)
-            self.__msg_receivers[bot] = MessageReceiver(bot, self.__inbox, self.__logger)
-        self.__connection = ConnectionsListener(self.__address, self.PORT, self.__msg_receivers, self.__logger)
+        # Received genes are decoded into a copy of a local genotype, made when the first one arrives
+        self.__geno_factory = geno_factory
+        self.__template = None
+        self.__logger.debug(ip_address + " added peers: " + str(self.__bots))
+        # one thread sends to and receives from all the other robots
+        if self.__mode == self.GOSSIP:
+            self.__gossip = Gossip(self.__address, self.__inbox, self.__logger, self.GOSSIP_FANOUT, self.GOSSIP_TTL,
+                                   self.GOSSIP_FORWARD)
+            self.__network = PeerNetwork(self.__address, self.PORT, self.__bots, self.__gossip, self.__logger,
+                                         self.OUTBOX_CAPACITY, self.OUTBOX_POLICY, self.GOSSIP_IDLE_TIMEOUT)
+            self.__gossip.network = self.__network
+        else:
+            self.__gossip = None
+            self.__network = PeerNetwork(self.__address, self.PORT, self.__bots, self.__inbox, self.__logger,
+                                         self.OUTBOX_CAPACITY, self.OUTBOX_POLICY)
+        if self.__discovery == self.MULTICAST:
+            self.__membership = Membership(self.__address, self.__logger, self.__network.addPeer,
+                                           self.__network.removePeer, interval=self.HEARTBEAT_INTERVAL,
+                                           timeout=self.MEMBER_TIMEOUT)
+        else:
+            self.__membership = None
 
     def get_bots(self):
         with open('bots.txt') as bots_file:
@@ -713,64 +768,78 @@ class Distributor:
         return [bot.replace("\n", "") for bot in bots]
 
     """
-        Sends the Genotype to all robots listed in te bots.txt file. The function will return True when the sending was
+        Sends the Genotype to the other robots. The function will return True when the sending was
         successful and False otherwise
     """
     def send_genotype(self, genotype):
         self.__logger.debug("Sending genotype to listeners: " + str(genotype))
         if self.__started:
-            for addr in self.__msg_senders:
-                bot = self.__msg_senders[addr]
-                self.__logger.debug("Sending message to " + addr)
-                bot.outboxAppend(genotype)
+            # encoded once, the same message goes to every robot
+            message = genome_wire.encode_genotype(genotype, self.COMPRESS)
+            if self.__gossip is not None:
+                self.__gossip.publish(message)
+            else:
+                self.__network.send(message)
             return True
         else:
             self.__logger.debug("Attempted to send genotype without starting the Distributor")
             return False
 
-    def get_genotypes(self):
-        genotypes = self.__inbox.popAll()
+    """
+        Takes the genotypes received since the last call, the latest one of each robot, and returns the k fittest of
+        them, fittest first, or as many as the inbox holds if k is None
+    """
+    def get_genotypes(self, k=None):
+        genotypes = []
+        for message in self.__inbox.drain(k):
+            try:
+                genotypes.append(genome_wire.decode_genotype(message, self.__get_template()))
+            except ValueError as e:
+                self.__logger.warning("Dropped a malformed genotype message: " + str(e))
         self.__logger.info("Recieved " + str(len(genotypes)) +  " genotypes")
+        if self.__gossip is not None:
+            self.__logger.info("Gossip: " + str(self.__gossip.stats()))
         return genotypes
 
+    def __get_template(self):
+        if self.__template is None:
+            # the factory draws random weights, the random generators are left as they were
+            state = random.getstate(), np.random.get_state()
+            self.__template = self.__geno_factory()
+            random.setstate(state[0])
+            np.random.set_state(state[1])
+        return self.__template
+
     """
         Start waiting for messages and enable the senders to send messages to the other bots
     """
     def start(self):
-        self.__connection.start()
+        self.__network.start()
+        if self.__membership is not None:
+            self.__membership.start()
+        self.__started = True
 
-        # for i in range(0, len(self.__msg_receivers)):
-        #     stop_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        #     stop_socket.connect(('127.0.0.1', '1337'))
-        #     self.__stopSockets.append(stop_socket)
+    def network_stats(self):
+        return self.__network.stats()
 
-        for addr in self.__msg_senders:
-            self.__msg_senders[addr].start()
-        for addr in self.__msg_receivers:
-            self.__msg_receivers[addr].start()
-        self.__started = True
+    def gossip_stats(self):
+        return self.__gossip.stats() if self.__gossip is not None else None
+
+    def membership_stats(self):
+        return self.__membership.stats() if self.__membership is not None else None
 
     def stop(self):
         if not self.__started:
             return
 
-        for addr in self.__msg_senders:
-            self.__logger.info('Killing Sender ' + addr)
-            self.__msg_senders[addr].stop()
-            self.__msg_senders[addr].join()
-        self.__logger.info('All MessageSenders: KILLED')
-
-        # Stopping connections listener: no more incoming connections
-        self.__connection.stop()
-        self.__connection.join()
-        self.__logger.info('ConnectionsListener: KILLED')
-
-        for addr in self.__msg_receivers:
-            self.__logger.info("Killing receiver " + addr)
-            self.__msg_receivers[addr].stop()
-            self.__msg_receivers[addr].join()
-
-        self.__logger.info("All MessageReceivers KILLED")
+        if self.__membership is not None:
+            # the other robots are told we leave
+            self.__membership.stop()
+            self.__membership.join()
+            self.__logger.info('Membership: KILLED')
+        self.__network.stop()
+        self.__network.join()
+        self.__logger.info('PeerNetwork: KILLED')
         self.__started = False
         self.__logger.close()
 
@@ -127,12 +127,17 @@ class WaveletDeveloper(object):
     def convert(self, individual):
         cm = np.zeros((self.substrate.num_nodes, self.substrate.num_nodes))
         
-        for (i,j), coords, conn_id, expr_id in self.substrate.get_connection_list(self.add_deltas):
-            # Add a bias (translation)
-            coords = np.hstack((coords, [1]))
-            w = sum(weight * gabor_opt(*(np.dot(mat, coords)), sigma=sigma) 
-                    for (weight, sigma, mat) in individual.wavelets[conn_id])
-            cm[j,i] = w
+        fr, to, coords, conn_ids, _, _ = self.substrate.get_connection_arrays(self.add_deltas)
+        # Add a bias (translation)
+        coords = np.hstack((coords, np.ones((len(coords), 1))))
+        # Evaluate each wavelet layer on all of its connections at once
+        for conn_id in np.unique(conn_ids):
+            selected = (conn_ids == conn_id)
+            w = np.zeros(selected.sum())
+            for (weight, sigma, mat) in individual.wavelets[conn_id]:
+                x, y = np.dot(coords[selected], mat.T).T
+                w += weight * gabor_opt(x, y, sigma=sigma)
+            cm[to[selected], fr[selected]] = w
         
         # Rescale weights
         cm[np.abs(cm) < self.min_weight] = 0
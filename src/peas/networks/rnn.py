@@ -4,6 +4,7 @@
 ### IMPORTS ###
 
 import sys
+from collections import OrderedDict
 import numpy as np
 np.seterr(over='ignore', divide='raise')
 
@@ -177,6 +178,8 @@ class NeuralNetwork(object):
         self.original_shape = None
         self.sum_all_node_inputs = False
         self.all_nodes_same_function = False
+        self.sparse         = False
+        self.schedules      = None
         
         if source is not None:
             try:
@@ -207,6 +210,93 @@ class NeuralNetwork(object):
         self.feedforward = True
         self.cm[np.triu_indices(self.cm.shape[0])] = 0
         
+    def make_sparse(self):
+        """ Activates the (feedforward) network by a topologically sorted
+            schedule of sparse, layer-wise gathers instead of propagating
+            the dense matrix once for every node. Each node is then evaluated
+            exactly once per input, in O(connections).
+        """
+        if not self.feedforward or self.sandwich:
+            raise Exception("Only feedforward networks can be activated sparsely.")
+        self.sparse = True
+        self.schedules = {}
+        return self
+
+    def _schedule(self, input_size):
+        """ Builds the activation schedule for a given number of clamped
+            input nodes. It is a list of layers, each a tuple of
+            (nodes, rows, cols, weights, updates, funcs), where rows/cols/weights
+            are the CSR-like connections into the layer, updates are the positions
+            of the nodes that feed later layers (clamped inputs are never
+            overwritten) and funcs groups the positions by node function.
+        """
+        if input_size in self.schedules:
+            return self.schedules[input_size]
+
+        cm = self.cm
+        n = cm.shape[0]
+        if self.sum_all_node_inputs:
+            present = (cm != 0)
+        else:
+            # Complex nodes get all non-NaN entries of their row as inputs
+            present = ~np.isnan(cm)
+        preds = [np.flatnonzero(present[i, :i]) for i in xrange(n)]
+        depth = np.zeros(n, dtype=int)
+        for i in xrange(input_size, n):
+            p = preds[i][preds[i] >= input_size]
+            if p.size:
+                depth[i] = depth[p].max() + 1
+
+        schedule = []
+        for d in xrange(depth.max() + 1 if n else 0):
+            nodes = np.flatnonzero(depth == d)
+            if self.sum_all_node_inputs:
+                rows = np.concatenate([np.repeat(k, preds[i].size) for k, i in enumerate(nodes)]).astype(int)
+                cols = np.concatenate([preds[i] for i in nodes]).astype(int)
+                weights = cm[nodes[rows], cols]
+            else:
+                rows = None
+                cols = [np.flatnonzero(present[i]) for i in nodes]
+                weights = [cm[i, c] for i, c in zip(nodes, cols)]
+            updates = np.flatnonzero(nodes >= input_size)
+            funcs = {}
+            if not self.all_nodes_same_function:
+                for k, i in enumerate(nodes):
+                    funcs.setdefault(self.node_types[i], []).append(k)
+            schedule.append((nodes, rows, cols, weights, updates, funcs.items()))
+
+        self.schedules[input_size] = schedule
+        return schedule
+
+    def _feed_sparse(self, input_activation, input_size):
+        """ Activates each node once, following the schedule. A matrix
+            of inputs (one per row) is activated in a single pass if the
+            network sums all node inputs, complex nodes take one input
+            vector only.
+        """
+        node_types = self.node_types
+        batch_shape = input_activation.shape[:-1]
+        src = np.zeros(batch_shape + (self.cm.shape[0],))
+        src[..., :input_size] = input_activation[..., :input_size]
+        act = np.zeros(src.shape)
+        for (nodes, rows, cols, weights, updates, funcs) in self._schedule(input_size):
+            if self.sum_all_node_inputs:
+                if src.ndim == 1:
+                    nodeinputs = np.bincount(rows, weights=weights * src[cols], minlength=nodes.size)
+                else:
+                    nodeinputs = np.dot(src[:, cols] * weights, np.eye(nodes.size)[rows])
+                if self.all_nodes_same_function:
+                    values = node_types[0](nodeinputs)
+                else:
+                    values = np.empty(nodeinputs.shape)
+                    for fn, positions in funcs:
+                        values[..., positions] = fn(nodeinputs[..., positions])
+            else:
+                values = np.array([node_types[i](w * src[c]) for i, c, w in zip(nodes, cols, weights)])
+            act[..., nodes] = values
+            src[..., nodes[updates]] = values[..., updates]
+        return act
+        
     def flush(self):
         """ Reset activation values. """
         self.act = np.zeros(self.cm.shape[0])
@@ -234,6 +324,10 @@ class NeuralNetwork(object):
         input_size = min(act.size - 1, input_activation.size)
         node_count = act.size
         
+        if self.sparse:
+            act = self.act = self._feed_sparse(input_activation.ravel(), input_size)
+            return act.reshape(self.original_shape)
+
         # Feed forward nets reset the activation, and activate as many
         # times as there are nodes
         if self.feedforward:
@@ -249,7 +343,7 @@ class NeuralNetwork(object):
                 nodeinputs = np.dot(self.cm, act)
             else:
                 nodeinputs = self.cm * act
-                nodeinputs = [ni[-np.isnan(ni)] for ni in nodeinputs]
+                nodeinputs = [ni[~np.isnan(ni)] for ni in nodeinputs]
             
             if self.all_nodes_same_function:
                 act = node_types[0](nodeinputs)
@@ -265,6 +359,62 @@ class NeuralNetwork(object):
         else:
             return act.reshape(self.original_shape)
 
+    def feed_batch(self, input_activations, add_bias=True, propagate=1):
+        """ Feed a matrix of inputs, one input per row, to the network.
+            Each row is activated as if fed to a flushed network, and
+            the activation state of each row is returned as a row
+            of the resulting matrix. The state of the network itself
+            is left untouched.
+            
+            :param add_bias: Add a bias input automatically, before other inputs.
+        """
+        if propagate != 1 and (self.feedforward or self.sandwich):
+            raise Exception("Feedforward and sandwich network have a fixed number of propagation steps.")
+        node_types = self.node_types
+        cm = self.cm
+        inputs = np.atleast_2d(input_activations)
+        inputs = inputs.reshape(inputs.shape[0], -1)
+        batch = inputs.shape[0]
+        
+        if add_bias:
+            inputs = np.hstack((np.ones((batch, 1)), inputs))
+        
+        if inputs.shape[1] >= cm.shape[0]:
+            raise Exception("More input values (%s) than nodes (%s)." % (inputs.shape[1], cm.shape[0]))
+        
+        input_size = min(cm.shape[0] - 1, inputs.shape[1])
+        
+        if not self.sum_all_node_inputs:
+            # Complex nodes take their input vectors one node at a time,
+            # so these networks are simply fed row by row.
+            state = self.act
+            act = np.empty((batch, cm.shape[0]))
+            for b in xrange(batch):
+                self.flush()
+                self.feed(inputs[b], add_bias=False, propagate=propagate)
+                act[b] = self.act
+            self.act = state
+        elif self.sparse:
+            act = self._feed_sparse(inputs, input_size)
+        else:
+            act = np.zeros((batch, cm.shape[0]))
+            if self.feedforward:
+                propagate = len(node_types)
+            if self.sandwich:
+                propagate = 1
+            for _ in xrange(propagate):
+                act[:, :input_size] = inputs[:, :input_size]
+                nodeinputs = np.dot(act, cm.T)
+                if self.all_nodes_same_function:
+                    act = node_types[0](nodeinputs)
+                else:
+                    for i in xrange(len(node_types)):
+                        act[:, i] = node_types[i](nodeinputs[:, i])
+        
+        if self.sandwich:
+            return act[:, act.shape[1]//2:]
+        return act
+
     def cm_string(self):
         print "Connectivity matrix: %s" % (self.cm.shape,)
         cp = self.cm.copy()
@@ -323,6 +473,124 @@ class NeuralNetwork(object):
         
     def __str__(self):
         return 'Neuralnet with %d nodes.' % (self.act.shape[0])
+
+
+class NetworkStack(object):
+    """ A number of networks with the same inputs (e.g. a population), 
+        activated together as one block-diagonal network. The input nodes
+        of all networks are put first, so a feedforward stack is still 
+        feedforward, and is activated sparsely, a layer of all networks 
+        at a time.
+    """
+    def __init__(self, networks):
+        if any(net.sandwich for net in networks):
+            raise Exception("Sandwich networks can not be stacked.")
+        self.networks = list(networks)
+        self.sizes = np.array([net.cm.shape[0] for net in self.networks])
+        self.offsets = np.concatenate(([0], np.cumsum(self.sizes)[:-1]))
+        self.stacks = {}
+
+    def _stack(self, input_size):
+        """ Builds the stacked network for a given number of clamped inputs. """
+        if input_size in self.stacks:
+            return self.stacks[input_size]
+        nets = self.networks
+        total = self.sizes.sum()
+        sum_all = all(net.sum_all_node_inputs for net in nets)
+        # The stacked positions of the nodes, inputs of all networks first
+        is_input = np.concatenate([np.arange(n) < input_size for n in self.sizes])
+        order = np.concatenate((np.flatnonzero(is_input), np.flatnonzero(~is_input)))
+        position = np.empty(total, dtype=int)
+        position[order] = np.arange(total)
+
+        cm = np.zeros((total, total)) if sum_all else np.empty((total, total))
+        if not sum_all:
+            cm.fill(np.nan)
+        node_types = []
+        for net, offset, n in zip(nets, self.offsets, self.sizes):
+            cm[offset:offset+n, offset:offset+n] = net.cm
+            if net.sum_all_node_inputs and not sum_all:
+                node_types.extend(summed(fn) for fn in net.node_types)
+            else:
+                node_types.extend(net.node_types)
+
+        stack = NeuralNetwork()
+        stack.cm = cm[np.ix_(order, order)]
+        stack.node_types = [node_types[i] for i in order]
+        stack.original_shape = (total,)
+        stack.act = np.zeros(total)
+        stack.sum_all_node_inputs = sum_all
+        stack.all_nodes_same_function = sum_all and all(fn is stack.node_types[0] for fn in stack.node_types)
+        if all(net.feedforward for net in nets):
+            stack.feedforward = True
+            stack.make_sparse()
+        # Gathers each network's activation in a row, aligned to the right so
+        # that the outputs of all networks are in the last columns.
+        width = self.sizes.max()
+        gather = np.empty((len(nets), width), dtype=int)
+        gather.fill(total)
+        for b, (offset, n) in enumerate(zip(self.offsets, self.sizes)):
+            gather[b, width-n:] = position[offset:offset+n]
+        self.stacks[input_size] = stack, gather
+        return stack, gather
+
+    def flush(self):
+        for stack, _ in self.stacks.values():
+            stack.flush()
+
+    def feed(self, input_activations, add_bias=True, propagate=1):
+        """ Feeds one input row to each network, returns the activations
+            as a matrix with one row per network, aligned to the right, 
+            so out[:, -2:] are the last two nodes of every network.
+        """
+        inputs = np.asarray(input_activations, dtype=float).reshape(len(self.networks), -1)
+        if add_bias:
+            inputs = np.hstack((np.ones((inputs.shape[0], 1)), inputs))
+        stack, gather = self._stack(inputs.shape[1])
+        act = stack.feed(inputs.ravel(), add_bias=False, propagate=propagate)
+        return np.append(act, 0.0)[gather]
+
+        
+class PhenotypeCache(object):
+    """ Keeps the networks compiled from recently seen genotypes, so that
+        a controller that is queried every control tick only has its
+        connection matrix built once per evaluation.
+
+        Entries are keyed on the identity of the genotype and its
+        ``mutation_generation`` counter, so a genotype that was mutated
+        since it was compiled is converted again.
+    """
+    def __init__(self, size=1):
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self.entries = OrderedDict()
+
+    def network(self, genotype):
+        """ Returns a network for the given genotype, with its activation
+            flushed, as if it was freshly constructed.
+        """
+        key = id(genotype)
+        generation = getattr(genotype, 'mutation_generation', None)
+        entry = self.entries.pop(key, None)
+        # The genotype itself is kept in the entry, so its id cannot be
+        # reused by another object while it is cached.
+        if entry is not None and entry[0] is genotype and entry[1] == generation:
+            self.hits += 1
+            network = entry[2]
+            network.flush()
+        else:
+            self.misses += 1
+            network = NeuralNetwork(genotype)
+            if network.feedforward:
+                network.make_sparse()
+        self.entries[key] = (genotype, generation, network)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+        return network
+
+    def clear(self):
+        self.entries.clear()
         
 
 if __name__ == '__main__':
@@ -84,11 +84,13 @@ class PoleBalanceTask(object):
         
         return (x, dx, theta, dtheta)
 
-    def _loop(self, network, max_steps, initial=None, verbose=False):
+    def _loop(self, network, max_steps, initial=None, verbose=False, rng=None):
+        if rng is None:
+            rng = np.random
         if initial is None:
             x, dx  = 0.0, 0.0
             if self.start_random:
-                theta = np.random.normal(0, 0.01, self.l.size)
+                theta = rng.normal(0, 0.01, self.l.size)
             else:
                 # Long pole starts at a fixed 1 degree angle.
                 theta = np.array([0.017, 0.0])
@@ -116,14 +118,17 @@ class PoleBalanceTask(object):
         
         return steps, states, actions
         
-    def evaluate(self, network, verbose=False):
-        """ Perform a single run of this task """
+    def evaluate(self, network, verbose=False, rng=None):
+        """ Perform a single run of this task, a random start is drawn
+            from rng (a numpy RandomState), or from numpy's global generator
+            if it is not given.
+        """
         # Convert to a network if it is not.
 
         if not isinstance(network, NeuralNetwork):
             network = NeuralNetwork(network)
         
-        steps, states, _ = self._loop(network, max_steps=self.max_steps, verbose=verbose)
+        steps, states, _ = self._loop(network, max_steps=self.max_steps, verbose=verbose, rng=rng)
         
         if network.node_types[-1].__name__ != 'tanh':
             raise Exception("Network output must have range [-1, 1]") 
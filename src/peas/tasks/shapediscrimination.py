@@ -101,7 +101,13 @@ class ShapeDiscriminationTask(object):
         
         return im
         
-    def evaluate(self, network):
+    def evaluate(self, network, rng=None):
+        """ Evaluates the network on a number of random trials, the positions
+            of the shapes are drawn from rng (a numpy RandomState), or from
+            numpy's global generator if it is not given.
+        """
+        if rng is None:
+            rng = np.random
         if not network.sandwich:
             raise Exception("Object Discrimination task should be performed by a sandwich net.")
         
@@ -112,15 +118,15 @@ class ShapeDiscriminationTask(object):
         for _ in xrange(self.trials):
             pattern *= 0.0
             targetsize = self.target.shape[0]
-            distractor = random.choice(self.distractors)
+            distractor = self.distractors[rng.randint(len(self.distractors))]
             distsize = distractor.shape[0]
-            x, y = np.random.randint(self.size - targetsize, size=2)
+            x, y = rng.randint(self.size - targetsize, size=2)
         
             pattern[x:x+targetsize, y:y+targetsize] = self.target
             cx, cy = x + targetsize // 2, y + targetsize // 2
         
             for i in xrange(100):
-                x, y = np.random.randint(self.size - distsize, size=2)
+                x, y = rng.randint(self.size - distsize, size=2)
                 if not np.any(pattern[x:x+distsize, y:y+distsize]):
                     pattern[x:x+distsize, y:y+distsize] = distractor
                     break
@@ -8,9 +8,17 @@ working properly.
 ### IMPORTS
 
 # Python Imports
+import multiprocessing
 import os
+import random
+import shutil
+import socket
 import sys
+import tempfile
+import threading
+import time
 import unittest
+import cPickle as pickle
 
 # Libraries
 import numpy as np
@@ -18,13 +26,64 @@ import numpy as np
 # Package
 sys.path.append(os.path.join(os.path.split(__file__)[0],'..','..')) 
 from peas.networks import rnn
-from peas.methods import neat
+from peas.methods import neat, evolution
+from peas.methods import odneat, genome_wire
+from peas.methods.Inbox import Inbox
+from peas.methods.Outbox import Outbox, LATEST, BEST
+from peas.methods.PeerNetwork import PeerNetwork
+from peas.methods.Gossip import Gossip
+from peas.methods.Membership import Membership, HEARTBEAT, MAGIC, VERSION, HELLO, GROUP
 from peas.tasks import xor
+from thymio_sim import Arena, RobotArray, SimulatedThymio, AsebaError, NODE_NAME, ROBOT_RADIUS
+from sim_tasks import ObstacleAvoidanceSim, ForagingSim
+from cameravision import CameraVision, CameraVisionVectors, FrameRing, ObjectTracker
+import color_lut
+import frame_sources
+import image_stream
 
 ### CONSTANTS
 
+### FUNCTIONS
+
+def genome_message(fitness):
+    genotype = odneat.NEATGenotype(inputs=2, outputs=1)
+    genotype.stats = {'fitness': fitness}
+    return genome_wire.encode_genotype(genotype)
+
+def wait(condition, timeout=5.0):
+    """ Polls the condition until it holds, or the timeout in seconds ends. """
+    for _ in xrange(int(timeout / 0.1)):
+        if condition():
+            return True
+        time.sleep(0.1)
+    return False
+
 ### CLASSES
 
+class NullLogger(object):
+    """ Stands in for the simulation logger, drops the messages of every level. """
+    def __getattr__(self, level):
+        return lambda message: None
+
+
+class ConstantController(object):
+    """ Stands in for a genotype, its network drives both motors at the
+        same output from the bias, whatever the inputs. With a loop, the
+        motor nodes also feed back into themselves.
+    """
+    def __init__(self, inputs, weight, loop=0.0):
+        self.inputs = inputs
+        self.weight = weight
+        self.loop = loop
+
+    def get_network_data(self):
+        # the bias, the inputs and the two motor outputs
+        cm = np.zeros((self.inputs + 3, self.inputs + 3))
+        cm[-2:, 0] = self.weight
+        cm[-2:, -2:] += self.loop * np.eye(2)
+        return cm, ['tanh']
+
+
 class TestPEAS(unittest.TestCase):
         
     def test_rnn(self):
@@ -32,12 +91,465 @@ class TestPEAS(unittest.TestCase):
         output = net.feed(np.array([1,1]), add_bias=False)
         self.assertEqual(output[-1], rnn.sigmoid(1 + 1))
 
+    def test_sparse_feedforward(self):
+        genotype = neat.NEATGenotype(inputs=4, outputs=2, types=['tanh', 'sigmoid'], prob_add_node=0.5)
+        for _ in xrange(30):
+            genotype.mutate()
+        dense = rnn.NeuralNetwork(genotype)
+        sparse = rnn.NeuralNetwork(genotype).make_sparse()
+        for _ in xrange(10):
+            inputs = np.random.normal(size=4)
+            self.assertTrue(np.allclose(dense.feed(inputs), sparse.feed(inputs), rtol=0, atol=1e-12))
+
+    def test_feed_batch(self):
+        for feedforward in (True, False):
+            genotype = neat.NEATGenotype(inputs=3, outputs=2, types=['tanh', 'sin'], feedforward=feedforward)
+            for _ in xrange(20):
+                genotype.mutate()
+            net = rnn.NeuralNetwork(genotype)
+            inputs = np.random.normal(size=(6, 3))
+            expected = []
+            for row in inputs:
+                net.flush()
+                expected.append(net.feed(row))
+            self.assertTrue(np.allclose(net.feed_batch(inputs), expected))
+            if feedforward:
+                self.assertTrue(np.allclose(net.make_sparse().feed_batch(inputs), expected))
+
+    def test_network_stack(self):
+        for feedforward in (True, False):
+            genotypes = [neat.NEATGenotype(inputs=3, outputs=2, types=['tanh', 'sin'], feedforward=feedforward, 
+                                           prob_add_node=0.3) for _ in xrange(5)]
+            for genotype in genotypes:
+                for _ in xrange(15):
+                    genotype.mutate()
+            nets = [rnn.NeuralNetwork(genotype) for genotype in genotypes]
+            stack = rnn.NetworkStack([rnn.NeuralNetwork(genotype) for genotype in genotypes])
+            for _ in xrange(3):
+                inputs = np.random.normal(size=(5, 3))
+                out = stack.feed(inputs)
+                for row, net, net_inputs in zip(out, nets, inputs):
+                    act = net.feed(net_inputs)
+                    self.assertTrue(np.allclose(row[-act.size:], act))
+
+    def test_phenotype_cache(self):
+        genotype = neat.NEATGenotype(inputs=2, types=['tanh'])
+        cache = rnn.PhenotypeCache()
+        net = cache.network(genotype)
+        self.assertIs(cache.network(genotype), net)
+        genotype.mutate()
+        self.assertIsNot(cache.network(genotype), net)
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+
     def test_neat(self):
         task = xor.XORTask()
         genotype = lambda: neat.NEATGenotype(inputs=2, types=['tanh'])
         pop = neat.NEATPopulation(genotype)
         pop.epoch(task, 3)
 
+    def test_innovation_registry(self):
+        registry = neat.InnovationRegistry()
+        self.assertEqual(registry.connection(0, 3, maxinnov=5), 6)
+        self.assertEqual(registry.connection(0, 3), 6)
+        self.assertEqual(registry.split(0, 3, 4), (7, 8))
+        registry.reset()
+        self.assertEqual(registry.connection(0, 3), 9)
+        genotype = neat.NEATGenotype(inputs=2, types=['tanh'], prob_add_node=1.0)
+        genotype.mutate(innovations=registry)
+        self.assertEqual(genotype.max_innov, registry.counter)
+        self.assertEqual(genotype.max_innov, max(cg[0] for cg in genotype.conn_genes.values()))
+
+    def test_compact_neat(self):
+        task = xor.XORTask()
+        genotype = lambda: neat.CompactNEATGenotype(inputs=2, types=['tanh'], prob_add_node=0.1)
+        pop = neat.NEATPopulation(genotype)
+        pop.epoch(task, 3)
+        champion = pop.champions[-1]
+        copied = pickle.loads(pickle.dumps(champion, pickle.HIGHEST_PROTOCOL))
+        self.assertEqual(copied.conn_genes, champion.conn_genes)
+        self.assertEqual(copied.node_genes, champion.node_genes)
+        self.assertEqual(champion.distance(copied), 0)
+        child = champion.mate(genotype(), np.random.RandomState(0))
+        self.assertTrue((child.conn_from < len(child.fforder)).all() and (child.conn_to < len(child.fforder)).all())
+
+    def test_seeded_runs(self):
+        def champions(cores):
+            genotype = lambda: neat.NEATGenotype(inputs=2, types=['tanh'])
+            pop = neat.NEATPopulation(genotype, popsize=30, seed=7, verbose=False)
+            pop.use_cores = cores
+            pop.epoch(xor.XORTask(), 3)
+            # the workers end with the epoch
+            self.assertEqual((pop.pool, multiprocessing.active_children()), (None, []))
+            return [pickle.dumps(champion, pickle.HIGHEST_PROTOCOL) for champion in pop.champions]
+        state = random.getstate(), np.random.get_state()
+        serial = champions(1)
+        # the global generators are left as they were
+        self.assertEqual(random.getstate(), state[0])
+        self.assertTrue((np.random.get_state()[1] == state[1][1]).all())
+        self.assertEqual(champions(1), serial)
+        self.assertEqual(champions(2), serial)
+        # evaluators that take an rng are given the stream of the individual
+        draw = lambda seed: evolution.evaluate(None, lambda individual, rng: {'fitness': rng.rand()}, seed)
+        self.assertEqual(draw(3), draw(3))
+        self.assertNotEqual(draw(3), draw(4))
+
+    def test_thymio_sim(self):
+        arena = Arena(obstacles=[(100, 150, 10)])
+        # a ray from the middle to the right wall, and one into the obstacle
+        dist = arena.raycast(np.array([[100.0, 100.0], [100.0, 100.0]]), np.array([0.0, np.pi / 2]), 500.0)
+        self.assertTrue(np.allclose(dist, [100.0, 40.0]))
+        self.assertEqual(list(arena.collides(np.array([[3.0, 100.0], [100.0, 100.0], [100.0, 135.0]]), ROBOT_RADIUS)),
+                         [True, False, True])
+
+        # facing a wall, the front sensors see it and the back ones do not
+        robots = RobotArray(2, arena, poses=[(190.0, 100.0, 0.0), (100.0, 100.0, 0.0)])
+        prox = robots.prox()
+        self.assertTrue(prox[0, 2] > 0 and (prox[0, 5:] == 0).all())
+        self.assertTrue((prox[1] == 0).all())
+        # driving into the wall, the robots stop at it
+        for _ in xrange(400):
+            robots.step(np.array([[500, 500], [500, 500]]))
+        self.assertTrue((robots.poses[:, 0] <= 200 - ROBOT_RADIUS).all())
+        self.assertTrue((robots.poses[:, 0] > 190 - ROBOT_RADIUS).all())
+        self.assertTrue((robots.collisions > 0).all())
+
+        thymio = SimulatedThymio(pose=(100.0, 100.0, 0.0))
+        thymio.SetVariable(NODE_NAME, 'motor.left.target', [900])
+        thymio.SetVariable(NODE_NAME, 'motor.right.target', [500])
+        self.assertEqual(thymio.GetVariable(NODE_NAME, 'motor.left.target'), [500])
+        # each reading of the proximity sensors is a control step
+        replies = []
+        thymio.GetVariable(NODE_NAME, 'prox.horizontal', reply_handler=replies.append)
+        self.assertEqual(len(replies[0]), 7)
+        self.assertEqual(thymio.steps, 1)
+        self.assertTrue(thymio.x > 100.0)
+        errors = []
+        thymio.GetVariable(NODE_NAME, 'prox.nothing', reply_handler=replies.append, error_handler=errors.append)
+        self.assertEqual(len(errors), 1)
+        self.assertRaises(AsebaError, thymio.SetVariable, 'thymio-III', 'motor.left.target', [0])
+        thymio.SendEventName('SetSpeed', [-100, 100])
+        self.assertEqual(thymio.GetVariable(NODE_NAME, 'motor.right.target'), [100])
+
+    def test_sim_tasks(self):
+        forward, still = ConstantController(6, 5.0), ConstantController(6, 0.0)
+        task = ObstacleAvoidanceSim(steps=300)
+        stats = task.evaluate_all([forward, still], np.random.RandomState(0))
+        # driving on reaches an obstacle or a wall
+        self.assertTrue(stats[0]['collisions'] > 0 and stats[1]['collisions'] == 0)
+        # in lockstep, the robots do not see each other
+        self.assertEqual(stats, [task.evaluate(forward, np.random.RandomState(1)),
+                                 task.evaluate(still, np.random.RandomState(1))])
+        # as on the robots, a recurrent network starts each step flushed
+        self.assertEqual(task.evaluate(ConstantController(6, 5.0, loop=-3.0), np.random.RandomState(1)), stats[0])
+
+        # a puck straight ahead is picked up and carried to the goal behind it
+        forward, still = ConstantController(8, 5.0), ConstantController(8, 0.0)
+        task = ForagingSim(pucks=((130, 100),), goals=((170, 100),))
+        stats = task.evaluate_all([forward, still], np.random.RandomState(0))
+        self.assertTrue(stats[0]['pickups'] >= 1 and stats[0]['goals'] >= 1)
+        self.assertEqual((stats[1]['pickups'], stats[1]['goals']), (0, 0))
+
+    def test_color_lut(self):
+        green, blue, black, red = (0, 255, 0), (255, 0, 0), (0, 0, 0), (0, 0, 255)
+        gray, dark = (128, 128, 128), (64, 64, 64)
+        image = np.array([[green, green, blue, gray, gray, dark, dark, dark, black, (10, 200, 30)]], np.uint8)
+        # a gray pixel of each class, two of three dark pixels are goal, the last pixel is not labeled
+        mask = np.array([[green, green, blue, green, black, green, blue, blue, black, red]], np.uint8)
+        labels = color_lut.mask_labels(mask)
+        self.assertEqual(labels[0, -1], color_lut.UNLABELED)
+        PUCK, GOAL, BACKGROUND = color_lut.PUCK, color_lut.GOAL, color_lut.BACKGROUND
+        lut = color_lut.build_lut([(image, labels)])
+        self.assertEqual(list(color_lut.classify(lut, image)[0]),
+                         [PUCK, PUCK, GOAL, BACKGROUND, BACKGROUND, GOAL, GOAL, GOAL, BACKGROUND, BACKGROUND])
+        # the empty cells next to a puck cell are puck, those farther away are not
+        near, far = (0, 240, 0), (0, 232, 0)
+        self.assertEqual(list(color_lut.classify(lut, np.array([[near, far]], np.uint8))[0]), [PUCK, BACKGROUND])
+        unspread = color_lut.build_lut([(image, labels)], spread=0)
+        self.assertEqual(color_lut.classify(unspread, np.array([[near]], np.uint8))[0, 0], BACKGROUND)
+
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'lut.npy')
+            self.assertTrue(color_lut.load_lut(path) is None)
+            color_lut.save_lut(lut, path)
+            self.assertTrue((color_lut.load_lut(path) == lut).all())
+            for wrong in (lut[:-1], lut.astype(np.int32), lut * 2):
+                color_lut.save_lut(wrong, path)
+                self.assertRaises(ValueError, color_lut.load_lut, path)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_frame_ring(self):
+        def numbered(count, error=None):
+            def frame(number):
+                if number == error:
+                    raise ValueError("camera failed")
+                return np.full((240, 320, 3), number, np.uint8) if number < count else None
+            return frame
+        def capture(source, seen, delay=0.0):
+            """ Adds the numbers of the frames read from the ring to seen, returns the ring. """
+            vision = CameraVision(source, NullLogger())
+            with source:
+                thread = vision._startCapture(source)
+                try:
+                    while True:
+                        frame = vision.ring.acquire_read(timeout=5)
+                        if frame is None:
+                            break
+                        seen.append(int(frame[0][0, 0, 0]))
+                        vision.ring.release_read()
+                        time.sleep(delay)
+                finally:
+                    thread.join()
+            return vision.ring
+
+        # as fast as possible, the producer waits for the consumer
+        seen = []
+        ring = capture(frame_sources.SyntheticSource(numbered(20), mode=frame_sources.FAST), seen, 0.005)
+        self.assertEqual((seen, ring.dropped), (range(20), 0))
+        # at a fixed rate, the frames a slow consumer misses are dropped, the last one is still read
+        seen = []
+        ring = capture(frame_sources.SyntheticSource(numbered(20), mode=frame_sources.FIXED, fps=200), seen, 0.03)
+        self.assertTrue(ring.dropped > 0 and seen[-1] == 19 and seen == sorted(seen))
+        self.assertEqual(len(seen) + ring.dropped, 20)
+        # the consumer gets the frames before the error of the producer, then the error
+        seen = []
+        self.assertRaises(ValueError, capture, frame_sources.SyntheticSource(numbered(20, error=3),
+                                                                             mode=frame_sources.FAST), seen)
+        self.assertEqual(seen, range(3))
+        self.assertRaises(RuntimeError, FrameRing((2, 2, 3)).acquire_read, 0.05)
+
+    def test_object_tracker(self):
+        tracker = ObjectTracker((100, 100), margin=5, refresh=3)
+        binary = np.zeros((100, 100), np.uint8)
+        binary[40:50, 40:50] = 1
+        tracker.update(binary, None, (45, 45))
+        self.assertEqual((tracker.searches, tracker.region()), (1, (35, 55, 35, 55)))
+        # after refresh tracked frames the full frame is searched again
+        for _ in xrange(3):
+            region = tracker.region()
+            self.assertTrue(region is not None)
+            top, bottom, left, right = region
+            self.assertFalse(tracker.clipped(binary[top:bottom, left:right], region))
+            tracker.update(binary[top:bottom, left:right], region, (45, 45))
+        self.assertTrue(tracker.region() is None)
+        # an object lost, or reaching the edge of its region, is searched for in the full frame
+        tracker.update(binary, None, (45, 45))
+        self.assertFalse(tracker.region() is None)
+        tracker.update(np.zeros((20, 20), np.uint8), tracker.region(), None)
+        self.assertTrue(tracker.region() is None)
+        self.assertTrue(tracker.clipped(binary[45:65, 45:65], (45, 65, 45, 65)))
+        self.assertFalse(tracker.clipped(binary[30:60, 30:60], (30, 60, 30, 60)))
+
+        # tracked, the vectors are those of the full frames, also when the objects leave the view
+        source = frame_sources.SyntheticSource(count=30)
+        frames = [source.arena_frame(number) for number in xrange(30)]
+        frames[10:13] = [np.full_like(frames[0], 90)] * 3
+        full, tracked = CameraVisionVectors(None, None), CameraVisionVectors(None, None, tracking=True)
+        stdout, sys.stdout = sys.stdout, open(os.devnull, 'w')
+        try:
+            for number, frame in enumerate(frames):
+                expected, values = full.process_frame(frame.copy()), tracked.process_frame(frame.copy())
+                for name in ('puck', 'target'):
+                    self.assertTrue(np.allclose(values[name], expected[name]), (number, name))
+        finally:
+            sys.stdout = stdout
+        for tracker in tracked.trackers.values():
+            self.assertTrue(tracker.hits > 0 and tracker.searches > 3)
+
+    def test_image_stream(self):
+        def read(client, received):
+            while True:
+                data = client.recv(65536)
+                if not data:
+                    break
+                received.append(data)
+        # noise is large as a PNG, a viewer that does not read soon falls behind
+        noise = np.random.RandomState(0).randint(0, 256, (2, 480, 640)).astype(np.uint8)
+        stdout, sys.stdout = sys.stdout, open(os.devnull, 'w')
+        server = image_stream.ImageStreamServer('127.0.0.1', 0, fps=50, encoding=image_stream.MASK,
+                                                timeout=1.0).start()
+        try:
+            viewers = [socket.create_connection(server.address) for _ in xrange(2)]
+            received = [[] for _ in viewers]
+            readers = [threading.Thread(target=read, args=(viewer, data)) for viewer, data in zip(viewers, received)]
+            for reader in readers:
+                reader.start()
+            slow = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            slow.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+            slow.connect(server.address)
+            self.assertTrue(wait(lambda: len(server.viewers) == 3))
+            slowest = 0.0
+            for number in xrange(100):
+                start = time.time()
+                server.publish(noise, float(number), 1.0, 2.0)
+                slowest = max(slowest, time.time() - start)
+                time.sleep(0.01)
+            # the viewer that does not read is offered the newest frame, the older ones are dropped
+            lagging, = [viewer for viewer in server.viewers if viewer.address == slow.getsockname()]
+            self.assertTrue(wait(lambda: lagging.dropped > 0))
+        finally:
+            server.close()
+            sys.stdout = stdout
+        for reader in readers:
+            reader.join()
+        slow.close()
+        # the control loop never waited, the images published in between were replaced
+        self.assertTrue(slowest < 0.05)
+        self.assertTrue(0 < server.encoded < server.published)
+        for data in received:
+            data = ''.join(data)
+            self.assertTrue(data.startswith('HTTP/1.0 200 OK'))
+            self.assertTrue('multipart/x-mixed-replace; boundary=thymio' in data)
+            self.assertTrue(data.count('Content-type: image/png') >= 2)
+
+    def test_genome_wire(self):
+        genotype = odneat.NEATGenotype(inputs=4, outputs=2, types=['tanh', 'sin'], prob_add_node=0.3)
+        for _ in xrange(30):
+            genotype.mutate()
+        genotype.stats = {'fitness': 2.5, 'steps': 10}
+        template = odneat.NEATGenotype(inputs=4, outputs=2, types=['tanh', 'sin'])
+        for compress in (False, True):
+            message = genome_wire.encode_genotype(genotype, compress)
+            copied = genome_wire.decode_genotype(message, template)
+            self.assertEqual(copied.node_genes, genotype.node_genes)
+            self.assertEqual(copied.conn_genes, genotype.conn_genes)
+            self.assertEqual(copied.stats, {'fitness': 2.5})
+            self.assertEqual(genome_wire.peek_fitness(message), 2.5)
+            self.assertTrue(len(message) < len(pickle.dumps(genotype)) / 2)
+            for malformed in (message[:-1], message + 'x', 'XX' + message[2:], message[:10]):
+                self.assertRaises(ValueError, genome_wire.decode_genotype, malformed, template)
+
+    def test_outbox(self):
+        outbox = Outbox(2, LATEST)
+        for message in ('a', 'b', 'b', 'c'):
+            outbox.append(message)
+        self.assertEqual((outbox.dropped, outbox.coalesced), (1, 1))
+        outbox.restore('a')
+        self.assertEqual([outbox.pop(), outbox.pop(), outbox.pop()], ['b', 'c', None])
+        self.assertEqual(outbox.dropped, 2)
+
+        outbox = Outbox(2, BEST)
+        for fitness in (1.0, 5.0, 3.0, 0.5):
+            outbox.append(genome_message(fitness))
+        self.assertEqual([genome_wire.peek_fitness(outbox.pop()) for _ in xrange(2)], [5.0, 3.0])
+        self.assertEqual(outbox.dropped, 2)
+
+    def test_inbox(self):
+        inbox = Inbox(None, capacity=3)
+        for sender, fitness in (('a', 1.0), ('b', 4.0), ('a', 2.0), ('c', 3.0), (None, 0.5), (None, 6.0)):
+            inbox.append(genome_message(fitness), sender)
+        # the first message of a is replaced by its latest one
+        self.assertEqual(len(inbox), 3)
+        self.assertEqual(genome_wire.peek_fitness(inbox.best()), 6.0)
+        self.assertEqual([genome_wire.peek_fitness(m) for m in inbox.top_k(3)], [6.0, 4.0, 3.0])
+        self.assertEqual([genome_wire.peek_fitness(m) for m in inbox.drain(2)], [6.0, 4.0])
+        self.assertEqual(inbox.drain(), [])
+        for fitness in xrange(10):
+            inbox.append(genome_message(float(fitness)))
+        self.assertEqual([genome_wire.peek_fitness(m) for m in inbox.drain()], [9.0, 8.0, 7.0])
+
+    def test_peer_network(self):
+        addresses = ['127.0.0.1', '127.0.0.2', '127.0.0.3']
+        inboxes = [Inbox(NullLogger()) for _ in addresses]
+        networks = [PeerNetwork(address, 42420, [peer for peer in addresses if peer != address], inbox, NullLogger())
+                    for address, inbox in zip(addresses, inboxes)]
+        try:
+            for address, network in zip(addresses, networks)[:-1]:
+                network.start()
+                network.send(genome_message(float(address[-1])))
+            # the last robot starts late, the others reconnect to it
+            time.sleep(0.3)
+            networks[-1].start()
+            networks[-1].send(genome_message(0.0))
+            received = [[] for _ in inboxes]
+            for _ in xrange(50):
+                for messages, inbox in zip(received, inboxes):
+                    messages.extend(inbox.drain())
+                if all(len(messages) == len(addresses) - 1 for messages in received):
+                    break
+                time.sleep(0.1)
+            self.assertEqual([len(messages) for messages in received], [len(addresses) - 1] * len(addresses))
+            self.assertEqual(networks[0].stats()['127.0.0.3']['sent'], 1)
+
+            # a robot that knows no peers takes one that connects to it as a peer
+            inboxes.append(Inbox(NullLogger()))
+            networks.append(PeerNetwork('127.0.0.4', 42420, [], inboxes[-1], NullLogger()))
+            networks[-1].start()
+            networks[0].addPeer('127.0.0.4')
+            networks[0].send(genome_message(5.0))
+            self.assertTrue(wait(lambda: len(inboxes[-1]) == 1))
+            self.assertEqual(networks[-1].peers, ['127.0.0.1'])
+            networks[-1].send(genome_message(6.0))
+            self.assertTrue(wait(lambda: len(inboxes[0]) == 1))
+        finally:
+            for network in networks:
+                network.stop()
+                network.join()
+
+    def test_gossip(self):
+        addresses = ['127.0.0.4', '127.0.0.5', '127.0.0.6']
+        inboxes = [Inbox(NullLogger()) for _ in addresses]
+        gossips = [Gossip(address, inbox, NullLogger(), fanout=2, ttl=2)
+                   for address, inbox in zip(addresses, inboxes)]
+        for address, gossip in zip(addresses, gossips):
+            gossip.network = PeerNetwork(address, 42421, [peer for peer in addresses if peer != address], gossip,
+                                         NullLogger())
+            gossip.network.start()
+        try:
+            gossips[0].publish(genome_message(1.0))
+            self.assertTrue(wait(lambda: len(inboxes[1]) == 1 and len(inboxes[2]) == 1))
+            # the second robot forwards the first message along with its own, the third has seen it
+            gossips[1].publish(genome_message(2.0))
+            self.assertTrue(wait(lambda: gossips[2].stats()['duplicates'] == 1 and len(inboxes[2]) == 2))
+            self.assertEqual(map(genome_wire.peek_fitness, inboxes[2].drain()), [2.0, 1.0])
+            stats = gossips[2].stats()
+            self.assertEqual(stats['received'], 2)
+            self.assertEqual(stats['coverage'], {'127.0.0.4': 1.0, '127.0.0.5': 1.0})
+            self.assertEqual(gossips[1].stats()['sent'], 3)
+        finally:
+            for gossip in gossips:
+                gossip.network.stop()
+                gossip.network.join()
+
+    def test_membership(self):
+        addresses = ['127.0.0.7', '127.0.0.8']
+        inboxes = [Inbox(NullLogger()) for _ in addresses]
+        # the robots know no peers, they are added as their heartbeats arrive
+        networks = [PeerNetwork(address, 42422, [], inbox, NullLogger())
+                    for address, inbox in zip(addresses, inboxes)]
+        memberships = [Membership(address, NullLogger(), network.addPeer, network.removePeer, port=42423,
+                                  interval=0.1, timeout=0.5)
+                       for address, network in zip(addresses, networks)]
+        # a robot that sends a single heartbeat, then is silent
+        silent = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        silent.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, socket.inet_aton('127.0.0.9'))
+        silent.bind(('127.0.0.9', 0))
+        try:
+            for network, membership in zip(networks, memberships):
+                network.start()
+                membership.start()
+            self.assertTrue(wait(lambda: networks[0].peers == ['127.0.0.8'] and networks[1].peers == ['127.0.0.7']))
+            networks[0].send(genome_message(1.0))
+            self.assertTrue(wait(lambda: len(inboxes[1]) == 1))
+            silent.sendto(HEARTBEAT.pack(MAGIC, VERSION, HELLO, 1), (GROUP, 42423))
+            self.assertTrue(wait(lambda: '127.0.0.9' in networks[0].peers))
+            self.assertTrue(wait(lambda: networks[0].peers == ['127.0.0.8']))
+            # a robot that stops says goodbye
+            memberships[1].stop()
+            memberships[1].join()
+            self.assertTrue(wait(lambda: networks[0].peers == []))
+            self.assertEqual(memberships[0].stats()['joined'], 2)
+            self.assertEqual(memberships[0].stats()['left'], 2)
+        finally:
+            silent.close()
+            for network, membership in zip(networks, memberships):
+                membership.stop()
+                network.stop()
+            for network, membership in zip(networks, memberships):
+                membership.join()
+                network.join()
+
     def test_rbfneat(self):
         def evaluate(network):
             cm, nt = network.get_network_data()
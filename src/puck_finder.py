@@ -1,5 +1,3 @@
-import dbus
-import dbus.mainloop.glib
 import gobject
 import os
 import random
@@ -10,6 +8,7 @@ import csv
 import itertools
 from optparse import OptionParser
 from cameravision import *
+from helpers import getThymioController, getFrameSource
 
 CURRENT_FILE_PATH = os.path.abspath(os.path.dirname(__file__))
 AESL_PATH = os.path.join(CURRENT_FILE_PATH, 'asebaCommands.aesl')
@@ -206,14 +205,7 @@ if __name__ == "__main__":
     parser.add_option("-s", "--system", action="store_true", dest="system", default=False,
                       help="use the system bus instead of the session bus")
     (options, args) = parser.parse_args()
-    dbus.mainloop.glib.DBusGMainLoop(set_as_default=True)
-
-    if options.system:
-        bus = dbus.SystemBus()
-    else:
-        bus = dbus.SessionBus()
-
-    controller = dbus.Interface(bus.get_object('ch.epfl.mobots.Aseba', '/'), dbus_interface='ch.epfl.mobots.AsebaNetwork')
+    controller = getThymioController(options.system)
     controller.LoadScripts(AESL_PATH, reply_handler=dbusReply, error_handler=dbusError)
 
     loop = gobject.MainLoop()
@@ -231,6 +223,6 @@ if __name__ == "__main__":
         print "writing file"
         logger.writeFile()
 
-    cameravision = CameraVision(False, None)
+    cameravision = CameraVision(getFrameSource(), None)
     cameravision.start_camera(cameracallback, cameraErrorCallback, False)
 
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+# The robot tasks in the simulator, evaluating a whole population in lockstep:
+# one simulated robot per individual, all networks activated as one NetworkStack.
+# As on the robots, where PhenotypeCache.network flushes the network of each step,
+# the networks are flushed before each step and keep no activation between steps.
+import math
+import numpy as np
+
+from parameters import MAX_MOTOR_SPEED, MIN_GOAL_DIST
+from helpers import normalize_prox, obstacle_avoidance_fitness, foraging_energy_delta
+from thymio_sim import Arena, RobotArray, PROX_POSITIONS
+from peas.networks.rnn import NeuralNetwork, NetworkStack
+
+# As in foraging_task_3.py
+FORAGING_MAX_MOTOR_SPEED = 150
+INITIAL_ENERGY = 500
+ENERGY_DECAY = 5
+MAX_STEPS = 200
+PUCK_BONUS_SCALE = 1
+GOAL_BONUS_SCALE = 2
+TURN_AWAY_PUNISH_SCALE = 10
+ANGLE_PENALTY = 1
+
+# The camera sits at the front of the robot, it sees CAMERA_RANGE cm ahead over
+# CAMERA_FOV radians, distances are scaled to the pixels of cameravision.py.
+CAMERA_POSITION = (PROX_POSITIONS[2, 0], 0.0)
+CAMERA_RANGE = 80.0
+CAMERA_FOV = 0.95
+MAX_DISTANCE = math.sqrt(240 ** 2 + 160 ** 2) + 1
+PIXELS_PER_CM = MAX_DISTANCE / CAMERA_RANGE
+# A puck this close in front of the camera is held by the robot
+GRIP_DISTANCE = 3.0
+
+
+class ObstacleAvoidanceSim(object):
+    """ obstacle_avoidance.py in the simulator: each robot drives for a number
+        of steps and sums obstacle_avoidance_fitness.
+    """
+    def __init__(self, arena=None, steps=1000, noise=0.0):
+        if arena is None:
+            arena = Arena(obstacles=[(50, 50, 10), (150, 60, 15), (70, 150, 12), (140, 140, 8)])
+        self.arena = arena
+        self.steps = steps
+        self.noise = noise
+
+    def evaluate(self, genotype, rng=None):
+        return self.evaluate_all([genotype], rng)[0]
+
+    def evaluate_all(self, genotypes, rng=None):
+        if rng is None:
+            rng = np.random
+        robots = RobotArray(len(genotypes), self.arena, noise=self.noise, seed=rng.randint(2**31))
+        networks = NetworkStack([NeuralNetwork(g) for g in genotypes])
+        fitness = np.zeros(len(genotypes))
+        for _ in xrange(self.steps):
+            prox = robots.prox()
+            observation = np.hstack((normalize_prox(prox[:, [0, 2, 4, 5, 6]]), np.ones((robots.n, 1))))
+            networks.flush()
+            out = networks.feed(observation)
+            left, right = out[:, -2], out[:, -1]
+            robots.step(np.column_stack((left, right)) * MAX_MOTOR_SPEED)
+            fitness += obstacle_avoidance_fitness(left, right, observation)
+        return [{'fitness': max(f, 1), 'collisions': c} for f, c in zip(fitness, robots.collisions)]
+
+
+class ForagingSim(object):
+    """ foraging_task_3.py in the simulator: the camera is replaced by the distance
+        and angle to the nearest puck and goal in view, a robot holds a puck it
+        drives into, and delivers it at the goal, after which a new puck is placed.
+        Each robot runs until its energy or its MAX_STEPS run out. Besides the
+        fitness, the stats count the goals reached and the pucks picked up.
+    """
+    def __init__(self, arena=None, pucks=((60, 60), (140, 60), (60, 140)), goals=((200, 100),), noise=0.0):
+        self.arena = arena if arena is not None else Arena()
+        self.pucks = np.array(pucks, dtype=float)
+        self.goals = np.array(goals, dtype=float)
+        self.noise = noise
+
+    def _see(self, robots, points):
+        """ Camera presence of the nearest of the points in view, in pixels and radians. """
+        dist, angle = robots.bearings(points, CAMERA_POSITION)
+        dist = np.where((dist <= CAMERA_RANGE) & (np.abs(angle) <= CAMERA_FOV / 2), dist, np.inf)
+        nearest = dist.argmin(axis=1)
+        rows = np.arange(robots.n)
+        dist, angle = dist[rows, nearest], angle[rows, nearest]
+        seen = np.isfinite(dist)
+        return np.where(seen, dist * PIXELS_PER_CM, -np.inf), np.where(seen, angle, -np.inf)
+
+    def evaluate(self, genotype, rng=None):
+        return self.evaluate_all([genotype], rng)[0]
+
+    def evaluate_all(self, genotypes, rng=None):
+        if rng is None:
+            rng = np.random
+        n = len(genotypes)
+        rows = np.arange(n)
+        robots = RobotArray(n, self.arena, noise=self.noise, seed=rng.randint(2**31))
+        networks = NetworkStack([NeuralNetwork(g) for g in genotypes])
+        pucks = np.array(np.broadcast_to(self.pucks, (n,) + self.pucks.shape))
+        holding = np.empty(n, dtype=int)
+        holding.fill(-1)
+        has_puck = np.zeros(n, dtype=bool)
+        goal_waiter = np.zeros(n, dtype=int)
+        goals_reached = np.zeros(n, dtype=int)
+        pickups = np.zeros(n, dtype=int)
+        energy = np.empty(n)
+        energy.fill(INITIAL_ENERGY)
+        steps = np.zeros(n, dtype=int)
+        running = np.ones(n, dtype=bool)
+        prev_presence = None
+
+        while running.any():
+            # Pucks that are held are carried in front of the camera
+            held = holding >= 0
+            pucks[rows[held], holding[held]] = robots.to_world(np.array([CAMERA_POSITION]))[held, 0]
+            puck_dist, puck_angle = self._see(robots, pucks)
+            puck_dist[held] = puck_angle[held] = 0
+            goal_dist, goal_angle = self._see(robots, self.goals)
+            presence = np.column_stack((puck_dist, puck_angle, goal_dist, goal_angle))
+
+            prox = robots.prox()
+            proxvalues = normalize_prox(np.column_stack(((prox[:, 0] + prox[:, 4]) // 2, (prox[:, 5] + prox[:, 6]) // 2)))
+
+            inputs = np.where(presence == -np.inf, -MAX_DISTANCE, presence)
+            inputs[:, ::2] /= MAX_DISTANCE
+            inputs = np.hstack((inputs, proxvalues, has_puck[:, None], np.ones((n, 1))))
+            networks.flush()
+            out = networks.feed(inputs)
+            targets = out[:, -2:] * FORAGING_MAX_MOTOR_SPEED
+            targets[~running] = 0
+            robots.step(targets)
+
+            seen = np.where(presence == -np.inf, MAX_DISTANCE, presence)
+            if prev_presence is not None:
+                delta = foraging_energy_delta(seen, prev_presence, proxvalues, has_puck, MAX_DISTANCE,
+                                              PUCK_BONUS_SCALE, GOAL_BONUS_SCALE, TURN_AWAY_PUNISH_SCALE,
+                                              ANGLE_PENALTY)
+                energy[running] += delta[running]
+            prev_presence = seen
+
+            # Grab the nearest puck in view when it is close enough
+            grab = running & ~held & (puck_dist >= 0) & (puck_dist <= GRIP_DISTANCE * PIXELS_PER_CM)
+            if grab.any():
+                dist, _ = robots.bearings(pucks, CAMERA_POSITION)
+                holding[grab] = dist[grab].argmin(axis=1)
+                pickups += grab
+            # A held puck is never lost here
+            has_puck = held = holding >= 0
+
+            # Delivering at the goal, after which the puck is put back somewhere else
+            near_goal = has_puck & (goal_dist >= 0) & (goal_dist <= MIN_GOAL_DIST)
+            goal_waiter = np.where(near_goal, goal_waiter + 1, np.maximum(goal_waiter - 1, 0))
+            delivered = running & held & (goal_waiter >= 3)
+            if delivered.any():
+                goals_reached += delivered
+                goal_waiter[delivered] = 0
+                pucks[rows[delivered], holding[delivered]] = np.column_stack((
+                    rng.uniform(20, self.arena.width - 20, delivered.sum()),
+                    rng.uniform(20, self.arena.height - 20, delivered.sum())))
+                holding[delivered] = -1
+                has_puck[delivered] = False
+                prev_presence[delivered, 0] = prev_presence[delivered, 2] = MAX_DISTANCE
+
+            steps += running
+            energy[running] -= ENERGY_DECAY
+            running &= (energy > 0) & (steps < MAX_STEPS)
+
+        fitness = np.maximum(steps + np.tanh(energy), 1)
+        return [{'fitness': f, 'goals': g, 'pickups': p} for f, g, p in zip(fitness, goals_reached, pickups)]
@@ -9,9 +9,7 @@ while read line
 do
 	echo "STARTING $line"
 
-    if [ ! -f "distances.p" ]; then # only if not existing
-		python dist_angle_matrices.py
-	fi
+    python dist_angle_matrices.py # builds the matrices only if not existing
 
     git_sha="$(git rev-parse --short HEAD)" # current commit git
 
@@ -1,5 +1,13 @@
 #!/bin/bash
 
+# ./start_one.sh --sim task.py ... runs the task against a simulated Thymio,
+# without asebamedulla or a robot
+if [ "$1" = "--sim" ]
+then
+    THYMIO_SIM=1 python $2 $3 $4
+    exit
+fi
+
 killall -s9 asebamedulla
 sleep 2
 
@@ -2,12 +2,11 @@ import os
 import time
 import gobject
 import glib
-import dbus
-import dbus.mainloop.glib
 import logging
 import thread
 from helpers import *
 from parameters import *
+from peas.networks.rnn import PhenotypeCache
 
 class TaskEvaluator:
     def __init__(self, thymioController, commit_sha, debug=False, experimentName='NEAT_task', evaluations=1000, timeStep=0.005, activationFunction='tanh', popSize=1, generations=100, solvedAt=1000):
@@ -35,6 +34,8 @@ class TaskEvaluator:
         self.popSize = popSize
         self.generations = generations
         self.solvedAt = solvedAt
+        # Networks are compiled once per evaluee instead of on every step
+        self.phenotypes = PhenotypeCache()
 
     def _step(self, evaluee, callback):
         raise NotImplemented('Step method not implemented')
@@ -54,8 +55,11 @@ class TaskEvaluator:
             task.evaluations_taken += 1
             # time.sleep(TIME_STEP)
             return ret_value
-        gobject.timeout_add(int(self.timeStep * 1000), lambda: main_lambda(self))
-        # glib.idle_add(lambda: main_lambda(self))
+        if getattr(self.thymioController, 'simulated', False):
+            # The simulator keeps its own time, so steps don't need to wait
+            gobject.idle_add(lambda: main_lambda(self))
+        else:
+            gobject.timeout_add(int(self.timeStep * 1000), lambda: main_lambda(self))
         self.loop.run()
 
         fitness = max(self.fitness, 1)
@@ -65,7 +69,8 @@ class TaskEvaluator:
         # time.sleep(.3)
         # self.thymioController.SendEventName('PlayFreq', [700, -1], reply_handler=dbusReply, error_handler=dbusError)
         # time.sleep(0.1)
-        time.sleep(1)
+        if not getattr(self.thymioController, 'simulated', False):
+            time.sleep(1)
 
         return { 'fitness': fitness }
 
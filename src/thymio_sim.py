@@ -0,0 +1,298 @@
+# -*- coding: utf-8 -*-
+# Headless stand-in for the Aseba D-Bus network of a Thymio II, backed by a
+# 2D differential drive simulation, so controllers can be evaluated without a robot.
+import os
+import math
+import xml.etree.ElementTree as ET
+import numpy as np
+
+from parameters import SENSOR_MAX, TIME_STEP
+
+NODE_NAME = 'thymio-II'
+
+# Thymio II geometry, in cm, with x pointing forward from the center between the wheels
+ROBOT_RADIUS = 5.5
+WHEEL_DISTANCE = 9.5
+# cm/s per unit of motor.*.target, 500 is about 20 cm/s
+SPEED_PER_UNIT = 0.04
+MOTOR_LIMIT = 500
+# prox.horizontal: five sensors at the front from left to right, two at the back
+PROX_POSITIONS = np.array([[6.2, 4.9], [7.4, 2.6], [7.8, 0.0], [7.4, -2.6], [6.2, -4.9],
+                           [-3.0, 3.0], [-3.0, -3.0]])
+PROX_ANGLES = np.array([0.69, 0.35, 0.0, -0.35, -0.69, math.pi, math.pi])
+PROX_RANGE = 10.0
+# prox.ground.reflected: two sensors at the front, looking down
+GROUND_POSITIONS = np.array([[7.2, 1.2], [7.2, -1.2]])
+
+
+class AsebaError(Exception):
+    pass
+
+
+class Arena(object):
+    """ A rectangular arena with walls, round obstacles and ground zones
+        (x, y, radius, reflected value) that are darker or lighter than the floor.
+    """
+    def __init__(self, width=200.0, height=200.0, walls=(), obstacles=(), zones=(), ground=900):
+        corners = [(0, 0), (width, 0), (width, height), (0, height)]
+        segments = [corners[i] + corners[(i + 1) % 4] for i in range(4)] + list(walls)
+        self.width = width
+        self.height = height
+        self.segments = np.array(segments, dtype=float).reshape(-1, 4)
+        self.obstacles = np.array(obstacles, dtype=float).reshape(-1, 3)
+        self.zones = np.array(zones, dtype=float).reshape(-1, 4)
+        self.ground = ground
+
+    def raycast(self, origins, angles, max_range, discs=None):
+        """ Distances from each origin along its angle to the nearest wall or
+            obstacle, max_range where nothing is hit. Extra discs (x, y, radius),
+            e.g. other robots, are hit only from the outside.
+        """
+        d = np.column_stack((np.cos(angles), np.sin(angles)))
+        dist = np.empty(len(origins))
+        dist.fill(max_range)
+
+        # Ray against segment: solve origin + t*d = p + u*(q - p)
+        p = self.segments[:, :2]
+        e = self.segments[:, 2:] - p
+        denom = d[:, 0, None] * e[None, :, 1] - d[:, 1, None] * e[None, :, 0]
+        w = p[None, :, :] - origins[:, None, :]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = (w[:, :, 0] * e[None, :, 1] - w[:, :, 1] * e[None, :, 0]) / denom
+            u = (w[:, :, 0] * d[:, 1, None] - w[:, :, 1] * d[:, 0, None]) / denom
+            hit = (denom != 0) & (t >= 0) & (u >= 0) & (u <= 1)
+        if hit.any():
+            dist = np.minimum(dist, np.where(hit, t, max_range).min(axis=1))
+
+        # Ray against circle: |origin + t*d - c| = r
+        circles = self.obstacles if discs is None else np.vstack((self.obstacles, discs))
+        if len(circles):
+            oc = origins[:, None, :] - circles[None, :, :2]
+            b = (oc * d[:, None, :]).sum(axis=2)
+            c = (oc ** 2).sum(axis=2) - circles[None, :, 2] ** 2
+            disc = b ** 2 - c
+            with np.errstate(invalid='ignore'):
+                t = -b - np.sqrt(disc)
+                hit = (disc >= 0) & (t >= 0)
+            if hit.any():
+                dist = np.minimum(dist, np.where(hit, t, max_range).min(axis=1))
+        return dist
+
+    def collides(self, positions, radius):
+        """ Whether discs at the given positions overlap a wall or an obstacle. """
+        p = self.segments[:, :2]
+        e = self.segments[:, 2:] - p
+        rel = positions[:, None, :] - p[None, :, :]
+        u = np.clip((rel * e).sum(axis=2) / (e ** 2).sum(axis=1), 0, 1)
+        near = ((rel - u[:, :, None] * e) ** 2).sum(axis=2) < radius ** 2
+        collides = near.any(axis=1)
+        if len(self.obstacles):
+            gap = np.sqrt(((positions[:, None, :] - self.obstacles[None, :, :2]) ** 2).sum(axis=2))
+            collides |= (gap < self.obstacles[:, 2] + radius).any(axis=1)
+        return collides
+
+    def reflected(self, points):
+        """ Ground reflection under each point. """
+        values = np.empty(points.shape[:-1])
+        values.fill(self.ground)
+        for x, y, r, value in self.zones:
+            values[((points - (x, y)) ** 2).sum(axis=-1) < r ** 2] = value
+        return values
+
+
+class RobotArray(object):
+    """ A number of Thymios driven in lockstep, all state is kept in arrays
+        so the robots are moved and sensed together. Each robot is alone
+        in its own copy of the arena, unless swarm is set, then they share
+        the arena and see and bump into each other.
+    """
+    def __init__(self, n, arena=None, poses=None, dt=TIME_STEP, swarm=False, noise=0.0, seed=None):
+        self.n = n
+        self.arena = arena if arena is not None else Arena()
+        if poses is None:
+            poses = (self.arena.width / 2.0, self.arena.height / 2.0, 0.0)
+        self.poses = np.array(np.broadcast_to(poses, (n, 3)), dtype=float) #: (x, y, theta)
+        self.targets = np.zeros((n, 2)) #: motor.left.target, motor.right.target
+        self.dt = dt
+        self.swarm = swarm
+        self.noise = noise
+        self.rng = np.random.RandomState(seed)
+        self.steps = 0
+        self.collisions = np.zeros(n, dtype=int)
+
+    def step(self, targets=None, dt=None):
+        """ Moves the robots by their wheel speeds for dt seconds. A robot
+            stays in place (but may still turn) when it would run into something.
+        """
+        if targets is not None:
+            self.targets = np.clip(targets, -MOTOR_LIMIT, MOTOR_LIMIT)
+        dt = self.dt if dt is None else dt
+        speed = self.targets * SPEED_PER_UNIT
+        if self.noise:
+            speed = speed * (1 + self.noise * self.rng.normal(size=speed.shape))
+        x, y, theta = self.poses.T
+        v = speed.mean(axis=1)
+        omega = (speed[:, 1] - speed[:, 0]) / WHEEL_DISTANCE
+        new_theta = theta + omega * dt
+        # Follow the arc, or a straight line where the robot (almost) doesn't turn
+        turning = np.abs(omega) > 1e-9
+        radius = np.where(turning, v / np.where(turning, omega, 1), 0)
+        new_x = np.where(turning, x + radius * (np.sin(new_theta) - np.sin(theta)), x + v * dt * np.cos(theta))
+        new_y = np.where(turning, y - radius * (np.cos(new_theta) - np.cos(theta)), y + v * dt * np.sin(theta))
+        positions = np.column_stack((new_x, new_y))
+        blocked = self.arena.collides(positions, ROBOT_RADIUS)
+        if self.swarm and self.n > 1:
+            gap = np.sqrt(((positions[:, None, :] - positions[None, :, :]) ** 2).sum(axis=2))
+            np.fill_diagonal(gap, np.inf)
+            blocked |= (gap < 2 * ROBOT_RADIUS).any(axis=1)
+        self.collisions += blocked
+        self.poses[~blocked, :2] = positions[~blocked]
+        self.poses[:, 2] = (new_theta + math.pi) % (2 * math.pi) - math.pi
+        self.steps += 1
+
+    def to_world(self, points):
+        """ Points given relative to the robots, as an (n, points, 2) array in the arena. """
+        x, y, theta = self.poses.T
+        c, s = np.cos(theta)[:, None], np.sin(theta)[:, None]
+        return np.dstack((x[:, None] + c * points[:, 0] - s * points[:, 1],
+                          y[:, None] + s * points[:, 0] + c * points[:, 1]))
+
+    def prox(self):
+        """ prox.horizontal of all robots, as an (n, 7) array. """
+        origins = self.to_world(PROX_POSITIONS).reshape(-1, 2)
+        angles = (self.poses[:, 2, None] + PROX_ANGLES).ravel()
+        discs = None
+        if self.swarm:
+            discs = np.column_stack((self.poses[:, :2], np.repeat(ROBOT_RADIUS, self.n)))
+        dist = self.arena.raycast(origins, angles, PROX_RANGE, discs).reshape(self.n, -1)
+        # Linear response, from SENSOR_MAX at contact to 0 at the end of the range
+        prox = SENSOR_MAX[0] * (1 - dist / PROX_RANGE)
+        if self.noise:
+            prox *= 1 + self.noise * self.rng.normal(size=prox.shape)
+        return np.floor(np.clip(prox, 0, SENSOR_MAX[0]))
+
+    def ground(self):
+        """ prox.ground.reflected of all robots, as an (n, 2) array. """
+        return self.arena.reflected(self.to_world(GROUND_POSITIONS))
+
+    def bearings(self, points, origin=(0.0, 0.0)):
+        """ Distance and angle from a point on each robot (relative to the robot) to 
+            each of the given points, either (points, 2) shared by all robots or
+            (n, points, 2), returned as two (n, points) arrays.
+        """
+        origin = self.to_world(np.array([origin]))
+        delta = points - origin
+        angle = np.arctan2(delta[..., 1], delta[..., 0]) - self.poses[:, 2, None]
+        return np.sqrt((delta ** 2).sum(axis=-1)), (angle + math.pi) % (2 * math.pi) - math.pi
+
+
+class SimulatedThymio(object):
+    """ Answers the calls the tasks make on ch.epfl.mobots.AsebaNetwork:
+        GetVariable, SetVariable, SendEventName, LoadScripts and GetNodesList.
+
+        Like D-Bus calls, calls with a reply_handler return nothing and hand
+        their result to the reply_handler, or the error to the error_handler;
+        they are answered right away, so no main loop is needed. Calls without
+        handlers return the result or raise an AsebaError.
+
+        There is no clock, the world is advanced by dt every time
+        prox.horizontal is read, i.e. once per control step.
+    """
+    simulated = True
+
+    def __init__(self, arena=None, pose=None, dt=TIME_STEP, noise=0.0, seed=None):
+        self.robots = RobotArray(1, arena, pose, dt, noise=noise, seed=seed)
+        self.arena = self.robots.arena
+        self.events = set(['SetSpeed', 'SetColor', 'PlaySound', 'PlayFreq'])
+        self.variables = {
+            'motor.left.target': [0],
+            'motor.right.target': [0],
+            'motor.left.speed': [0],
+            'motor.right.speed': [0],
+            'prox.horizontal': [0] * len(PROX_ANGLES),
+            'prox.ground.reflected': [0] * len(GROUND_POSITIONS),
+            'prox.ground.delta': [0] * len(GROUND_POSITIONS),
+        }
+        self._sense()
+
+    x = property(lambda self: self.robots.poses[0, 0])
+    y = property(lambda self: self.robots.poses[0, 1])
+    theta = property(lambda self: self.robots.poses[0, 2])
+    steps = property(lambda self: self.robots.steps)
+    collisions = property(lambda self: self.robots.collisions[0])
+
+    def step(self, dt=None):
+        """ Moves the robot by its wheel speeds for dt seconds. """
+        targets = self.variables['motor.left.target'] + self.variables['motor.right.target']
+        self.robots.step(np.array([targets]), dt)
+        self._sense()
+
+    def _sense(self):
+        self.variables['prox.horizontal'] = [int(v) for v in self.robots.prox()[0]]
+        ground = [int(v) for v in self.robots.ground()[0]]
+        self.variables['prox.ground.reflected'] = ground
+        self.variables['prox.ground.delta'] = ground
+        self.variables['motor.left.speed'] = list(self.variables['motor.left.target'])
+        self.variables['motor.right.speed'] = list(self.variables['motor.right.target'])
+
+    def _call(self, method, args, reply_handler, error_handler):
+        try:
+            result = method(*args)
+        except AsebaError as e:
+            if error_handler is None:
+                raise
+            error_handler(e)
+            return
+        if reply_handler is None:
+            return result
+        if result is None:
+            reply_handler()
+        else:
+            reply_handler(result)
+
+    def _check_node(self, node):
+        if node != NODE_NAME:
+            raise AsebaError('node %s does not exists' % node)
+
+    def _get(self, node, name):
+        self._check_node(node)
+        if name not in self.variables:
+            raise AsebaError('variable %s does not exists in node %s' % (name, node))
+        if name == 'prox.horizontal':
+            self.step()
+        return list(self.variables[name])
+
+    def _set(self, node, name, value):
+        self._check_node(node)
+        if name not in self.variables:
+            raise AsebaError('variable %s does not exists in node %s' % (name, node))
+        if name.startswith('motor.'):
+            value = [int(np.clip(v, -MOTOR_LIMIT, MOTOR_LIMIT)) for v in value]
+        self.variables[name] = list(value)
+
+    def _send_event(self, name, args):
+        if name not in self.events:
+            raise AsebaError('no event named %s' % name)
+        if name == 'SetSpeed':
+            self._set(NODE_NAME, 'motor.left.target', args[:1])
+            self._set(NODE_NAME, 'motor.right.target', args[1:2])
+
+    def _load_scripts(self, path):
+        if not os.path.isfile(path):
+            raise AsebaError('cannot open file %s' % path)
+        self.events.update(e.get('name') for e in ET.parse(path).getroot().iter('event'))
+
+    def GetVariable(self, node, name, reply_handler=None, error_handler=None):
+        return self._call(self._get, (node, name), reply_handler, error_handler)
+
+    def SetVariable(self, node, name, value, reply_handler=None, error_handler=None):
+        return self._call(self._set, (node, name, value), reply_handler, error_handler)
+
+    def SendEventName(self, name, args, reply_handler=None, error_handler=None):
+        return self._call(self._send_event, (name, args), reply_handler, error_handler)
+
+    def LoadScripts(self, path, reply_handler=None, error_handler=None):
+        return self._call(self._load_scripts, (path,), reply_handler, error_handler)
+
+    def GetNodesList(self, reply_handler=None, error_handler=None):
+        return self._call(lambda: [NODE_NAME], (), reply_handler, error_handler)
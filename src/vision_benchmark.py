@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+# Benchmark of the stages of cameravision.py over recorded frames, with a check of their
+# outputs against the golden outputs in vision_golden.json, and of the vectors found with
+# tracking against those found in the full frames.
+#
+#   python vision_benchmark.py                      calibrate/hsv_*.jpg and synthetic frames
+#   python vision_benchmark.py --frames video.avi --scales 1,2,4
+#   python vision_benchmark.py --update-golden      after a change that is meant to change outputs
+#   python vision_benchmark.py --output new.json --baseline old.json
+#
+# It exits with 1 when an output differs from its golden output, or a tracked vector from the
+# full frame one.
+import os
+import sys
+import json
+import time
+from optparse import OptionParser
+
+import cv2
+import numpy as np
+
+import frame_sources
+from cameravision import CameraVision, CameraVisionVectors
+
+CURRENT_FILE_PATH = os.path.abspath(os.path.dirname(__file__))
+CALIBRATION_FRAMES = os.path.join(CURRENT_FILE_PATH, '..', 'calibrate', 'hsv_*.jpg')
+GOLDEN_FILE = os.path.join(CURRENT_FILE_PATH, 'vision_golden.json')
+SYNTHETIC_FRAMES = 30
+
+STAGES = ('retContours', 'run_bgr', 'run_hsv', 'segment', 'get_binary_img', 'find_shortest', 'track')
+
+
+class NullWriter(object):
+    """ run_hsv prints every frame, it is silenced while it runs """
+    def write(self, text):
+        pass
+
+
+def load_frames(path=None, synthetic=SYNTHETIC_FRAMES):
+    """ Returns (name, BGR frame) pairs: those of the images or video at path, by default
+        the calibration captures, followed by the given number of synthetic frames.
+    """
+    if path and os.path.isfile(path) and not path.lower().endswith(('.jpg', '.png')):
+        sources = [('video', frame_sources.VideoFileSource(path))]
+    else:
+        sources = [('image', frame_sources.ImageDirectorySource(path or CALIBRATION_FRAMES))]
+    if synthetic:
+        sources.append(('synthetic', frame_sources.SyntheticSource(count=synthetic)))
+
+    frames = []
+    for kind, source in sources:
+        with source:
+            names = getattr(source, 'names', None)
+            for number, frame in enumerate(source.frames()):
+                name = os.path.basename(names[number]) if names else "%s_%d" % (kind, number)
+                frames.append((name, frame.copy()))
+    return frames
+
+def timed(latencies, stage, function, *args, **kwargs):
+    start = time.time()
+    result = function(*args, **kwargs)
+    latencies[stage].append(time.time() - start)
+    return result
+
+def run_stages(frames, scale_down, repeat=1):
+    """ Runs each stage over the frames, returns the latencies of the stages in seconds,
+        the outputs of each frame and the vectors of each frame found with tracking.
+    """
+    vision = CameraVision(None, None, scale_down)
+    vectors = CameraVisionVectors(None, None, scale_down)
+    # processes the frames in order, as the camera gives them
+    tracked = CameraVisionVectors(None, None, scale_down, tracking=True)
+    latencies = dict((stage, []) for stage in STAGES)
+    outputs = {}
+    tracking = {}
+
+    stdout = sys.stdout
+    sys.stdout = NullWriter()
+    try:
+        for _ in range(repeat):
+            for name, frame in frames:
+                if scale_down != 1:
+                    frame = cv2.resize(frame, (frame.shape[1] / scale_down, frame.shape[0] / scale_down))
+                hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
+                result = {}
+
+                # the range of the puck, as each range was segmented before the fused run_bgr
+                image_total = vision.divideImage(frame)
+                timed(latencies, 'retContours', vision.retContours, vision.green_lower_bgr, vision.green_upper_bgr,
+                      image_total, 1)
+                timed(latencies, 'run_bgr', vision.run_bgr, frame, lambda values: result.update(bgr=values))
+                # run_hsv returns its masks, and also gives the presence to the callback
+                timed(latencies, 'run_hsv', vision.run_hsv, hsv, lambda values: result.update(hsv=values))
+
+                vectors.labels = timed(latencies, 'segment', vectors.labelImage, frame)
+                puck_binary = timed(latencies, 'get_binary_img', vectors.get_binary_img, check_puck=True)
+                goal_binary = timed(latencies, 'get_binary_img', vectors.get_binary_img)
+                puck = timed(latencies, 'find_shortest', vectors.find_shortest, puck_binary, check_puck=True)
+                goal = timed(latencies, 'find_shortest', vectors.find_shortest, goal_binary)
+                result['vectors'] = {'puck': list(puck), 'target': list(goal)}
+                outputs[name] = as_json(result)
+
+                if name.lower().endswith(('.jpg', '.png')):
+                    # a still is not a sequence: it is found with a full search, then tracked
+                    for tracker in tracked.trackers.values():
+                        tracker.reset()
+                    tracked.process_frame(frame)
+                values = timed(latencies, 'track', tracked.process_frame, frame)
+                tracking[name] = as_json({'puck': list(values['puck']), 'target': list(values['target'])})
+    finally:
+        sys.stdout = stdout
+    return latencies, outputs, tracking
+
+def as_json(value):
+    if isinstance(value, dict):
+        return dict((key, as_json(item)) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return [as_json(item) for item in value]
+    return float(value)
+
+def summary(latencies, frames):
+    report = {}
+    for stage, times in latencies.items():
+        times = np.array(times) * 1000
+        # get_binary_img and find_shortest run twice a frame, once for the puck and once for the goal
+        per_frame = times.sum() / frames
+        report[stage] = {'mean_ms': times.mean(), 'p95_ms': np.percentile(times, 95),
+                         'fps': 1000.0 / per_frame if per_frame else float('inf')}
+    return report
+
+def compare(outputs, golden, tolerance):
+    """ Returns the differences of the outputs with the golden outputs, as (frame, message) """
+    differences = []
+    for name in sorted(outputs):
+        if name not in golden:
+            differences.append((name, "no golden output"))
+            continue
+        for key in sorted(outputs[name]):
+            for target in sorted(outputs[name][key]):
+                got = np.array(outputs[name][key][target], float)
+                expected = np.array(golden[name][key].get(target), float)
+                if got.shape != expected.shape or not np.allclose(got, expected, rtol=tolerance, atol=tolerance):
+                    differences.append((name, "%s %s: %s, golden %s" % (key, target, got.tolist(), expected.tolist())))
+    return differences
+
+def compare_tracking(outputs, tracking, tolerance):
+    """ Returns the differences of the vectors found with tracking with those found in
+        the full frames, as (frame, message)
+    """
+    differences = []
+    for name in sorted(tracking):
+        for target in sorted(tracking[name]):
+            got = np.array(tracking[name][target], float)
+            expected = np.array(outputs[name]['vectors'][target], float)
+            if not np.allclose(got, expected, rtol=tolerance, atol=tolerance):
+                differences.append((name, "%s: %s, full frame %s" % (target, got.tolist(), expected.tolist())))
+    return differences
+
+def configuration(scale_down):
+    """ The golden outputs depend on the scale and on whether a calibrated color table is used """
+    vision = CameraVision(None, None, scale_down)
+    return "scale_%d_%s" % (scale_down, 'lut' if vision.color_lut is not None else 'ranges')
+
+
+if __name__ == '__main__':
+    parser = OptionParser()
+    parser.add_option("--frames", dest="frames", help="directory, glob or video of the frames [default: calibrate/hsv_*.jpg]")
+    parser.add_option("--synthetic", type="int", dest="synthetic", default=SYNTHETIC_FRAMES,
+                      help="synthetic frames added to the recorded ones [default: %default]")
+    parser.add_option("--scales", dest="scales", default="1,2", help="scale_down of the frames [default: %default]")
+    parser.add_option("--repeat", type="int", dest="repeat", default=3, help="passes over the frames [default: %default]")
+    parser.add_option("--golden", dest="golden", default=GOLDEN_FILE, help="golden outputs [default: %default]")
+    parser.add_option("--update-golden", action="store_true", dest="update_golden", default=False,
+                      help="store the outputs as the golden ones")
+    parser.add_option("--tolerance", type="float", dest="tolerance", default=1e-4,
+                      help="relative and absolute tolerance of the outputs [default: %default]")
+    parser.add_option("--output", dest="output", help="write the timings to this file")
+    parser.add_option("--baseline", dest="baseline", help="timings of an earlier --output to compare with")
+    (options, args) = parser.parse_args()
+
+    frames = load_frames(options.frames, options.synthetic)
+    golden = json.load(open(options.golden)) if os.path.exists(options.golden) else {}
+    baseline = json.load(open(options.baseline)) if options.baseline else {}
+    report = {}
+    failed = False
+
+    for scale_down in [int(scale) for scale in options.scales.split(',')]:
+        config = configuration(scale_down)
+        latencies, outputs, tracking = run_stages(frames, scale_down, options.repeat)
+        report[config] = summary(latencies, len(frames) * options.repeat)
+
+        print "\n== %s, %d frames of %dx%d ==" % (config, len(frames), frames[0][1].shape[1] / scale_down,
+                                                 frames[0][1].shape[0] / scale_down)
+        print "%-16s %10s %10s %10s %10s" % ("stage", "mean ms", "p95 ms", "fps", "speed-up")
+        for stage in STAGES:
+            stats = report[config][stage]
+            before = baseline.get(config, {}).get(stage)
+            speedup = "%.2fx" % (before['mean_ms'] / stats['mean_ms']) if before else ""
+            print "%-16s %10.3f %10.3f %10.1f %10s" % (stage, stats['mean_ms'], stats['p95_ms'], stats['fps'], speedup)
+
+        if options.update_golden:
+            golden[config] = outputs
+            print "Golden outputs updated"
+        elif config not in golden:
+            print "No golden outputs for %s, run with --update-golden" % config
+        else:
+            differences = compare(outputs, golden[config], options.tolerance)
+            for name, difference in differences:
+                print "DIFFERENT %s %s" % (name, difference)
+            print "%d of %d frames equal to the golden outputs" % (
+                len(outputs) - len(set(name for name, difference in differences)), len(outputs))
+            failed = failed or bool(differences)
+
+        differences = compare_tracking(outputs, tracking, options.tolerance)
+        for name, difference in differences:
+            print "TRACKED %s %s" % (name, difference)
+        print "%d of %d frames tracked as in the full frame" % (
+            len(tracking) - len(set(name for name, difference in differences)), len(tracking))
+        failed = failed or bool(differences)
+
+    if options.update_golden:
+        json.dump(golden, open(options.golden, 'w'), indent=1, sort_keys=True)
+    if options.output:
+        json.dump(report, open(options.output, 'w'), indent=1, sort_keys=True)
+    sys.exit(1 if failed else 0)
@@ -4,8 +4,6 @@ from parameters import *
 # from neat_task import NEATTask
 
 import numpy as np
-import dbus
-import dbus.mainloop.glib
 import logging
 import parameters as pr
 from helpers import *
@@ -56,7 +54,7 @@ class ObstacleAvoidance(TaskEvaluator):
         def ok_call(psValues):
             psValues = np.array([psValues[0], psValues[2], psValues[4], psValues[5], psValues[6], 1],dtype='f')
             psValues[0:5] = [(float(x) - float(pr.SENSOR_MAX[0]/2))/float(pr.SENSOR_MAX[0]/2) for x in psValues[0:5]]
-            left, right = list(NeuralNetwork(evaluee).feed(psValues)[-2:])
+            left, right = list(self.phenotypes.network(evaluee).feed(psValues)[-2:])
             motorspeed = { 'left': left, 'right': right }
             try:
                 writeMotorSpeed(self.thymioController, motorspeed)
@@ -126,7 +124,7 @@ if __name__ == '__main__':
         stdev_mutate_weight=.25,
         stdev_mutate_bias=.25,
         stdev_mutate_response=.25)
-    pop = NEATPopulation(genotype, popsize=POPSIZE, target_species=TARGET_SPECIES)
+    pop = NEATPopulation(genotype, popsize=POPSIZE, target_species=TARGET_SPECIES, seed=pr.seed)
 
     # log neat settings
     log = { 'neat': {}, 'generations': [] }
@@ -155,9 +153,7 @@ if __name__ == '__main__':
         'weight_range': dummy_individual.weight_range
     }
 
-    dbus.mainloop.glib.DBusGMainLoop(set_as_default=True)
-    bus = dbus.SessionBus()
-    thymioController = dbus.Interface(bus.get_object('ch.epfl.mobots.Aseba', '/'), dbus_interface='ch.epfl.mobots.AsebaNetwork')
+    thymioController = getThymioController()
     thymioController.LoadScripts(AESL_PATH, reply_handler=dbusReply, error_handler=dbusError)
 
     # switch thymio LEDs off